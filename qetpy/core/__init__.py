@@ -7,6 +7,7 @@ from ._fitting import *
 from ._of_nsmb import *
 from ._of_pileup import *
 from ._de_pileup import *
+from ._of_cache import *
 from ._of_base import *
 from ._of_nxm import *
 from ._of_nxmx2 import *
@@ -14,3 +15,4 @@ from ._of_1x1 import *
 from ._of_nonlin import *
 from ._of_1x2 import *
 from ._of_1x3 import *
+from ._of_processor import *
@@ -1,8 +1,7 @@
 import numpy as np
 from scipy.optimize import least_squares
-from numpy.fft import rfft, fft, ifft, fftfreq, rfftfreq
 from qetpy.plotting import plotnonlin
-from qetpy.utils import shift
+from qetpy.utils import shift, fft, ifft, fftfreq
 
 
 __all__ = [
@@ -242,7 +241,7 @@ class OptimumFilter(object):
         self.df = self.fs / self.nbins
      
         
-        self.s = fft(template) / self.nbins / self.df
+        self.s = fft(np.asarray(template)) / self.nbins / self.df
 
         if integralnorm:
             self.s /= self.s[0]
@@ -283,7 +282,7 @@ class OptimumFilter(object):
         """
 
         if self.freqs is None:
-            self.freqs = fftfreq(self.nbins, d=1.0/self.fs)
+            self.freqs = fftfreq(self.nbins, self.fs)
 
     @staticmethod
     def _interpolate_parabola(vals, bestind, delta, t_interp=None):
@@ -336,7 +335,7 @@ class OptimumFilter(object):
 
         """
 
-        self.v = fft(signal, axis=-1)/self.nbins/self.df
+        self.v = fft(np.asarray(signal), axis=-1)/self.nbins/self.df
         self.signalfilt = self.phi * self.v / self.norm
 
         self.chi0 = None
@@ -1097,7 +1096,7 @@ def ofamp(signal, template, inputpsd, fs, withdelay=True, coupling='AC',
     # take fft of signal, template
     # divide by nbins to get correct convention
     v = fft(signal, axis=-1) / nbins / df
-    s = fft(template) / nbins / df
+    s = fft(np.asarray(template)) / nbins / df
 
     if integralnorm:
         s /= s[0]
@@ -1252,7 +1251,7 @@ def ofamp_pileup(signal, template, inputpsd, fs, a1=None, t1=None,
 
     nbins = len(signal)
     df = fs / nbins
-    freqs = fftfreq(nbins, d=1.0 / fs)
+    freqs = fftfreq(nbins, fs)
     omega = 2.0 * np.pi * freqs
 
     if a1 is None or t1 is None:
@@ -1268,8 +1267,8 @@ def ofamp_pileup(signal, template, inputpsd, fs, a1=None, t1=None,
 
     # take fft of signal and template,
     # divide by nbins to get correct convention
-    v = fft(signal) / nbins / df
-    s = fft(template) / nbins / df
+    v = fft(np.asarray(signal)) / nbins / df
+    s = fft(np.asarray(template)) / nbins / df
 
     # check for compatibility between PSD and DFT
     if(len(psd) != len(v)):
@@ -1396,8 +1395,8 @@ def ofamp_pileup_stationary(signal, template, inputpsd, fs, coupling='AC',
 
     # take fft of signal and template,
     # divide by nbins to get correct convention
-    v = fft(signal) / nbins / df
-    s = fft(template) / nbins / df
+    v = fft(np.asarray(signal)) / nbins / df
+    s = fft(np.asarray(template)) / nbins / df
 
     # check for compatibility between PSD and DFT
     if(len(psd) != len(v)):
@@ -1527,9 +1526,9 @@ def chi2lowfreq(signal, template, amp, t0, inputpsd, fs, fcutoff=10000,
     df = fs / nbins
 
     v = fft(signal, axis=-1) / nbins / df
-    s = fft(template) / nbins / df
+    s = fft(np.asarray(template)) / nbins / df
 
-    f = fftfreq(nbins, d=1 / fs)
+    f = fftfreq(nbins, fs)
 
     chi2tot = df*np.abs(
         v - amp[:, np.newaxis] * np.exp(
@@ -1663,7 +1662,7 @@ class OFnonlin(object):
 
         self.fs = fs
         self.df = fs / len(psd)
-        self.freqs = np.fft.fftfreq(len(psd), 1 / fs)
+        self.freqs = fftfreq(len(psd), fs)
         self.time = np.arange(len(psd)) / fs
         self.template = template
 
@@ -2160,7 +2159,7 @@ class OFnonlin(object):
 
         """
 
-        self.data = np.fft.fft(pulse) / self.norm
+        self.data = fft(np.asarray(pulse)) / self.norm
         self.error = np.sqrt(self.psd / errscale)
 
         self.npolefit = npolefit
@@ -2433,7 +2432,7 @@ class MuonTailFit(object):
 
         self.fs = fs
         self.df = self.fs / len(self.psd)
-        self.freqs = np.fft.fftfreq(len(psd), d=1 / self.fs)
+        self.freqs = fftfreq(len(psd), self.fs)
         self.time = np.arange(len(self.psd)) / self.fs
 
         self.data = None
@@ -2536,7 +2535,7 @@ class MuonTailFit(object):
             The chi squared statistic evaluated at the fit
         """
 
-        self.data = np.fft.fft(signal) / self.norm
+        self.data = fft(np.asarray(signal)) / self.norm
         self.error = np.sqrt(self.psd / errscale)
 
         ampguess = np.max(signal) - np.min(signal)
@@ -1,5 +1,4 @@
 import numpy as np
-from scipy.optimize import curve_fit
 import qetpy.plotting as utils
 
 
@@ -309,11 +308,63 @@ class IBIS(object):
         return (ibias - ibias_off) * rsh / (dites - ioff) - (rsh + rp)
     
     @staticmethod
-    def _rtes_err(ibias, ibias_off, rsh, dites, ioff, rp,  cov):
+    def _linfit(x, y, yerr):
         """
-        Static method to calculate error in TES resistance. The rows of
-        the covariance matrix must be in the following order: ibias,
-        ibias_off, dites, ioff, rsh, rp.
+        Static method to fit data to a straight line (see `_fitfunc`),
+        using the closed form weighted least squares solution. The fit
+        is done along the last axis, for all the other axes at once.
+
+        Parameters
+        ----------
+        x : ndarray
+            x-values of the data.
+        y : ndarray
+            y-values of the data, same shape as x.
+        yerr : ndarray
+            The error in y, same shape as y.
+
+        Returns
+        -------
+        b : ndarray
+            y-intercept of the line.
+        m : ndarray
+            slope of the line.
+        b_err : ndarray
+            The error in the y-intercept.
+        m_err : ndarray
+            The error in the slope.
+
+        """
+
+        if not (np.all(np.isfinite(x)) and np.all(np.isfinite(y))
+                and np.all(np.isfinite(yerr))):
+            raise ValueError('ERROR: Data to fit contains NaNs or infs!')
+
+        # weighted means, then fit of the centered data
+        # (better conditioned than the normal equations)
+        w = 1 / yerr**2
+        wsum = np.sum(w, axis=-1)
+        xmean = np.sum(w * x, axis=-1) / wsum
+        ymean = np.sum(w * y, axis=-1) / wsum
+
+        dx = x - xmean[..., np.newaxis]
+        sxx = np.sum(w * dx**2, axis=-1)
+
+        m = np.sum(w * dx * y, axis=-1) / sxx
+        b = ymean - m * xmean
+
+        # covariance matrix: inverse of the normal matrix
+        m_err = np.sqrt(1 / sxx)
+        b_err = np.sqrt(1 / wsum + xmean**2 / sxx)
+
+        return b, m, b_err, m_err
+
+    @staticmethod
+    def _rtes_jac(ibias, ibias_off, rsh, dites, ioff, rp):
+        """
+        Static method to calculate the derivatives of the TES
+        resistance, stacked along the last axis in the following
+        order: ibias, ibias_off, dites, ioff, rsh, rp.
 
         """
 
@@ -322,20 +373,27 @@ class IBIS(object):
         dimeas = -(ibias - ibias_off) * rsh / ((dites - ioff)**2)
         dioff = (ibias - ibias_off) * rsh / ((dites-ioff)**2)
         drsh = (ibias - ibias_off) / (dites - ioff) - 1
-        drp = -1
+        drp = -np.ones_like(drsh)
 
-        jac = np.zeros((6, 6))
+        return np.stack(
+            np.broadcast_arrays(
+                dibias, dibias_off, dimeas, dioff, drsh, drp,
+            ),
+            axis=-1,
+        )
 
-        jac[0,0] = dibias
-        jac[1,1] = dibias_off
-        jac[2,2] = dimeas
-        jac[3,3] = dioff
-        jac[4,4] = drsh
-        jac[5,5] = drp
+    @staticmethod
+    def _rtes_err(ibias, ibias_off, rsh, dites, ioff, rp,  cov):
+        """
+        Static method to calculate error in TES resistance. The rows of
+        the covariance matrix must be in the following order: ibias,
+        ibias_off, dites, ioff, rsh, rp. The inputs can be arrays, in
+        which case cov should have shape (..., 6, 6).
 
-        covout = jac.dot(cov.dot(jac.transpose()))
+        """
 
-        rtes_err = np.sqrt(np.sum(covout))
+        jac = IBIS._rtes_jac(ibias, ibias_off, rsh, dites, ioff, rp)
+        rtes_err = np.sqrt(np.einsum('...i,...ij,...j->...', jac, cov, jac))
         return rtes_err
 
     @staticmethod 
@@ -370,11 +428,11 @@ class IBIS(object):
         return ptes
 
     @staticmethod
-    def _ptes_err(ibias, ibias_off, rsh, dites, ioff, rp,  cov):
+    def _ptes_jac(ibias, ibias_off, rsh, dites, ioff, rp):
         """
-        Static method to calculate error in TES power. The rows of the
-        covariance matrix must be in the following order: ibias,
-        ibias_off, dites, ioff, rsh, rload.
+        Static method to calculate the derivatives of the TES power,
+        stacked along the last axis in the following order: ibias,
+        ibias_off, dites, ioff, rsh, rp.
 
         """
 
@@ -385,16 +443,25 @@ class IBIS(object):
         drsh = (ibias - ibias_off) * (dites - ioff) - (dites - ioff)**2
         drp = -1 * (dites - ioff)**2
 
-        jac = np.zeros((6,6))
-        jac[0,0] = dibias
-        jac[1,1] = dibias_off
-        jac[2,2] = dimeas
-        jac[3,3] = dioff
-        jac[4,4] = drsh
-        jac[5,5] = drp
+        return np.stack(
+            np.broadcast_arrays(
+                dibias, dibias_off, dimeas, dioff, drsh, drp,
+            ),
+            axis=-1,
+        )
+
+    @staticmethod
+    def _ptes_err(ibias, ibias_off, rsh, dites, ioff, rp,  cov):
+        """
+        Static method to calculate error in TES power. The rows of the
+        covariance matrix must be in the following order: ibias,
+        ibias_off, dites, ioff, rsh, rload. The inputs can be arrays,
+        in which case cov should have shape (..., 6, 6).
+
+        """
 
-        covout = jac.dot(cov.dot(jac.transpose()))
-        ptes_err = np.sqrt(np.sum(covout))
+        jac = IBIS._ptes_jac(ibias, ibias_off, rsh, dites, ioff, rp)
+        ptes_err = np.sqrt(np.einsum('...i,...ij,...j->...', jac, cov, jac))
         return ptes_err
 
     def analyze(self, yoff=None, yoff_err=None, xoff=None, xoff_err=None):
@@ -429,174 +496,88 @@ class IBIS(object):
 
         ntemps, nch, niters = self.dites.shape
 
-        ioff = np.zeros((ntemps, nch, niters))
-        ioff_err = np.zeros((ntemps, nch, niters))
-        rfit = np.zeros((ntemps, nch, niters))
-        rfit_err = np.zeros((ntemps, nch, niters))
-        rnorm = np.zeros((ntemps, nch, niters))
-        rnorm_err = np.zeros((ntemps, nch, niters))
-        ibias_off = np.zeros((ntemps, nch, niters))
-        ibias_off_err = np.zeros((ntemps, nch, niters))
-        rp = np.zeros((ntemps, nch, niters))
-        rp_err = np.zeros((ntemps, nch, niters))
-
-        slope_n = np.zeros((ntemps, nch, niters))
-        int_n = np.zeros((ntemps, nch, niters))
-        slope_sc = np.zeros((ntemps, nch, niters))
-        int_sc = np.zeros((ntemps, nch, niters))
-
-        slope_sc_err = np.zeros((ntemps, nch, niters))
-        int_sc_err = np.zeros((ntemps, nch, niters))
-        slope_n_err = np.zeros((ntemps, nch, niters))
-        int_n_err = np.zeros((ntemps, nch, niters))
-
-        # Do normal Fit
-        for t in range(ntemps):
-            for ch in range(nch):
-                x, xcov = curve_fit(
-                    IBIS._fitfunc,
-                    self.ibias[t, ch, self.normalinds], 
-                    self.dites[t, ch, self.normalinds],
-                    sigma=self.dites_err[t, ch, self.normalinds],
-                    absolute_sigma=True,
-                )
-
-                slope_n[t, ch] = x[1]
-                int_n[t, ch] = x[0]
-                slope_n_err[t, ch] = np.sqrt(np.diag(xcov))[1]
-                int_n_err[t, ch] = np.sqrt(np.diag(xcov))[0]
+        # Do normal Fit (closed form weighted least squares, for
+        # all bath temperatures and channels at once)
+        int_n, slope_n, int_n_err, slope_n_err = IBIS._linfit(
+            self.ibias[..., self.normalinds],
+            self.dites[..., self.normalinds],
+            self.dites_err[..., self.normalinds],
+        )
 
-                jac = np.zeros((2,2))
-                jac[0, 0] = 1
-                jac[1, 1] = -1 / x[1]**2
+        # error of 1/slope_n (variance of slope_n / slope_n**4)
+        rfit = self.rsh / slope_n
+        rfit_err = np.sqrt(
+            (self.rsh * slope_n_err**2 / slope_n**4)**2
+            + (self.rsh_err / slope_n)**2,
+        )
 
-                xout = np.array([x[0], 1 / x[1]])
-                covout = jac.dot(xcov.dot(jac.transpose()))
-                rfit[t, ch] = xout[1] * self.rsh
-                rfit_err[t, ch] = np.sqrt(
-                    (self.rsh * covout[1,1])**2 + (xout[1] * self.rsh_err)**2,
-                )
-                
         # Do SC fit
         if self.fitsc:
-            for t in range(ntemps):
-                for ch in range(nch):
-                    try:
-                        x, xcov = curve_fit(
-                            IBIS._fitfunc,
-                            self.ibias[t, ch, self.scinds],
-                            self.dites[t, ch, self.scinds],
-                            sigma=self.dites_err[t, ch, self.scinds],
-                            absolute_sigma=True,
-                        )
-                    except ValueError:
-                        raise ValueError(
-                            'SC fit failed, make sure scinds are correct, '
-                            'or that there are no NaNs in the data'
-                        )
-
-                    slope_sc[t, ch] = x[1]
-                    int_sc[t, ch] = x[0]
-                    slope_sc_err[t, ch] = np.sqrt(np.diag(xcov))[1]
-                    int_sc_err[t, ch] = np.sqrt(np.diag(xcov))[0]
-
-                    jac = np.zeros((2,2))
-                    jac[0, 0] = 1
-                    jac[1, 1] = -1 / x[1]**2
-                    xout = np.array([x[0], 1 / x[1]])
-                    covout = jac.dot(xcov.dot(jac.transpose()))
-                    rp[t, ch] = xout[1] * self.rsh - self.rsh
-                    rp_err[t, ch] = np.sqrt(
-                        (
-                            self.rsh * covout[1,1]
-                        )**2 + (
-                            (xout[1] - 1) * self.rsh_err
-                        )**2,
-                    )
-                    dfdb = -1 / x[1] 
-                    dfdm = x[0] / (x[1]**2)
-                    jac1 = np.zeros((2, 2))
-                    jac1[0, 0] = dfdb
-                    jac1[1, 1] = dfdm
-                    # Calculate the intersection point of the linear regions of 
-                    # the normal and SC regions
-                    int_point_x = (int_n - int_sc) / (slope_sc - slope_n)
-                    int_point_y = slope_n * int_point_x + int_n
+            try:
+                int_sc, slope_sc, int_sc_err, slope_sc_err = IBIS._linfit(
+                    self.ibias[..., self.scinds],
+                    self.dites[..., self.scinds],
+                    self.dites_err[..., self.scinds],
+                )
+            except ValueError:
+                raise ValueError(
+                    'SC fit failed, make sure scinds are correct, '
+                    'or that there are no NaNs in the data'
+                )
+
+            rp = self.rsh / slope_sc - self.rsh
+            rp_err = np.sqrt(
+                (
+                    self.rsh * slope_sc_err**2 / slope_sc**4
+                )**2 + (
+                    (1 / slope_sc - 1) * self.rsh_err
+                )**2,
+            )
+            rp = np.repeat(rp[..., np.newaxis], niters, axis=-1)
+            rp_err = np.repeat(rp_err[..., np.newaxis], niters, axis=-1)
+
+            # Calculate the intersection point of the linear regions of 
+            # the normal and SC regions
+            int_point_x = (int_n - int_sc) / (slope_sc - slope_n)
+            int_point_y = slope_n * int_point_x + int_n
         else:
-            ibias_off = np.zeros_like(int_n)
-            ibias_off_err = np.zeros_like(int_n)
+            slope_sc = np.zeros_like(int_n)
+            int_sc = np.zeros_like(int_n)
+            slope_sc_err = np.zeros_like(int_n)
+            int_sc_err = np.zeros_like(int_n)
             rp = self.rp_guess
             rp_err = self.rp_err_guess
             int_point_y = int_n
             int_point_x = np.zeros_like(int_n)
 
         # error prop for x_int
-        for t in range(ntemps):
-            for ch in range(nch):
-                jac_int = np.zeros((4, 4))
-                cov_int = np.zeros((4, 4))
-                dint_n = 1 / (slope_sc[t, ch, 0] - slope_n[t, ch, 0])
-                dint_sc = -1 / (slope_sc[t, ch, 0] - slope_n[t, ch, 0])
-                dslope_n = (
-                    int_n[t, ch, 0] - int_sc[t, ch, 0]
-                ) / (
-                    (slope_sc[t, ch, 0] - slope_n[t, ch, 0])**2
-                )
-                dslope_sc = -(
-                    int_n[t, ch, 0] - int_sc[t, ch, 0]
-                ) / (
-                    (slope_sc[t, ch, 0] - slope_n[t, ch, 0])**2
-                )
-
-                jac_int[0,0] = dint_n
-                jac_int[1,1] = dslope_n
-                jac_int[2,2] = dint_sc
-                jac_int[3,3] = dslope_sc
-
-                cov_int[0,0] = int_n_err[t, ch, 0]**2
-                cov_int[1,1] = slope_n_err[t, ch, 0]**2
-                cov_int[2,2] = int_sc_err[t, ch, 0]**2
-                cov_int[3,3] = slope_sc_err[t, ch, 0]**2
-                covout = jac_int.dot(cov_int.dot(jac_int.transpose()))
-                ibias_off_err[t,ch] = np.sqrt(np.sum(covout))
+        dslope = slope_sc - slope_n
+        dint = int_n - int_sc
+
+        ibias_off_err = np.sqrt(
+            (int_n_err / dslope)**2
+            + (dint / dslope**2 * slope_n_err)**2
+            + (int_sc_err / dslope)**2
+            + (dint / dslope**2 * slope_sc_err)**2
+        )
 
         # error prop for y_int
-        for t in range(ntemps):
-            for ch in range(nch):
-                jac_int = np.zeros((4, 4))
-                cov_int = np.zeros((4, 4))
-                dint_n = slope_n[t, ch, 0] / (
-                    slope_sc[t, ch, 0] - slope_n[t, ch, 0]
-                ) + 1
-                dint_sc = -slope_n[t, ch, 0] / (
-                    slope_sc[t, ch, 0] - slope_n[t, ch, 0]
-                )
-                dslope_n = (
-                    int_n[t, ch, 0] - int_sc[t, ch, 0]
-                ) / (
-                    slope_sc[t, ch, 0] - slope_n[t, ch, 0]
-                ) + (
-                    int_n[t, ch, 0] - int_sc[t, ch, 0]
-                ) / (
-                    (slope_sc[t, ch, 0] - slope_n[t, ch, 0])**2
-                )
-                dslope_sc = -slope_n[t, ch, 0] * (
-                    int_n[t, ch, 0] - int_sc[t, ch, 0]
-                ) / (
-                    (slope_sc[t, ch, 0] - slope_n[t, ch, 0])**2
-                )
+        ioff_err = np.sqrt(
+            ((slope_n / dslope + 1) * int_n_err)**2
+            + ((dint / dslope + dint / dslope**2) * slope_n_err)**2
+            + (slope_n / dslope * int_sc_err)**2
+            + (slope_n * dint / dslope**2 * slope_sc_err)**2
+        )
 
-                jac_int[0, 0] = dint_n
-                jac_int[1, 1] = dslope_n
-                jac_int[2, 2] = dint_sc
-                jac_int[3, 3] = dslope_sc
+        # same shape as data (ntemps, nch, niters)
+        def _expand(arr):
+            return np.repeat(arr[..., np.newaxis], niters, axis=-1)
 
-                cov_int[0, 0] = int_n_err[t, ch, 0]**2
-                cov_int[1, 1] = slope_n_err[t, ch, 0]**2
-                cov_int[2, 2] = int_sc_err[t, ch, 0]**2
-                cov_int[3, 3] = slope_sc_err[t, ch, 0]**2
-                covout = jac_int.dot(cov_int.dot(jac_int.transpose()))
-                ioff_err[t,ch] = np.sqrt(np.sum(covout))
+        slope_n, int_n = _expand(slope_n), _expand(int_n)
+        slope_sc, int_sc = _expand(slope_sc), _expand(int_sc)
+        rfit, rfit_err = _expand(rfit), _expand(rfit_err)
+        int_point_x, int_point_y = _expand(int_point_x), _expand(int_point_y)
+        ibias_off_err, ioff_err = _expand(ibias_off_err), _expand(ioff_err)
 
         # if yoff and xoff are specified, use these instead of the
         # calculated values
@@ -630,51 +611,32 @@ class IBIS(object):
         self.rp = rp[..., 0]
         self.rp_err = rp_err[..., 0]
 
-        # Propagate fit errors to paramters
-        for t in range(ntemps):
-            for ch in range(nch):
-                for ii in range(self.dites.shape[-1]):
-                    cov = np.zeros((6, 6))
-                    cov[0,0] = self.ibias_err[t, ch, ii]**2
-                    cov[1,1] = self.ibias_off_err[t, ch]**2
-                    cov[2,2] = self.dites_err[t,ch, ii]**2
-                    cov[3,3] = self.ioff_err[t, ch]**2
-                    cov[4,4] = self.rsh_err**2
-                    cov[5,5] = self.rp_err[t, ch]**2
-                    self.r0[t, ch, ii] = IBIS._rtes(
-                        self.ibias[t, ch, ii],
-                        self.ibias_off[t, ch],
-                        self.rsh,
-                        self.dites[t, ch, ii],
-                        self.ioff[t, ch],
-                        self.rp[t, ch],
-                    )
-                    self.r0_err[t, ch, ii] = IBIS._rtes_err(
-                        self.ibias[t, ch, ii],
-                        self.ibias_off[t, ch],
-                        self.rsh,
-                        self.dites[t, ch, ii],
-                        self.ioff[t, ch],
-                        self.rp[t, ch],
-                        cov,
-                    )
-                    self.ptes[t, ch, ii] = IBIS._ptes(
-                        self.ibias[t, ch, ii],
-                        self.ibias_off[t, ch],
-                        self.rsh,
-                        self.dites[t, ch, ii],
-                        self.ioff[t, ch],
-                        self.rp[t, ch],
-                    )
-                    self.ptes_err[t, ch, ii] = IBIS._ptes_err(
-                        self.ibias[t, ch, ii],
-                        self.ibias_off[t, ch],
-                        self.rsh,
-                        self.dites[t, ch, ii],
-                        self.ioff[t, ch],
-                        self.rp[t, ch],
-                        cov,
-                    )
+        # Propagate fit errors to paramters (all bias points at once,
+        # the covariance matrix is diagonal)
+        args = (
+            self.ibias,
+            np.reshape(self.ibias_off, (ntemps, nch, 1)),
+            self.rsh,
+            self.dites,
+            np.reshape(self.ioff, (ntemps, nch, 1)),
+            np.reshape(self.rp, (ntemps, nch, 1)),
+        )
+        var = np.stack(
+            np.broadcast_arrays(
+                self.ibias_err**2,
+                np.reshape(self.ibias_off_err, (ntemps, nch, 1))**2,
+                self.dites_err**2,
+                np.reshape(self.ioff_err, (ntemps, nch, 1))**2,
+                self.rsh_err**2,
+                np.reshape(self.rp_err, (ntemps, nch, 1))**2,
+            ),
+            axis=-1,
+        )
+
+        self.r0 = IBIS._rtes(*args)
+        self.r0_err = np.sqrt(np.sum(IBIS._rtes_jac(*args)**2 * var, axis=-1))
+        self.ptes = IBIS._ptes(*args)
+        self.ptes_err = np.sqrt(np.sum(IBIS._ptes_jac(*args)**2 * var, axis=-1))
 
         rnorm = rfit - self.rsh - self.rp[..., np.newaxis]
         rnorm_err = (rfit_err**2 + self.rp_err[..., np.newaxis]**2)**0.5
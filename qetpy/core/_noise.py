@@ -1,5 +1,5 @@
 import numpy as np
-from scipy.signal import savgol_filter, csd
+from scipy.signal import savgol_filter, get_window
 from math import ceil
 from scipy.optimize import least_squares
 from scipy.interpolate import interp1d
@@ -8,13 +8,14 @@ import scipy.constants as constants
 import pickle 
 import matplotlib.pyplot as plt
 import qetpy.plotting as utils
-from qetpy.utils import slope, fill_negatives, make_decreasing, fold_spectrum
-from qetpy.utils import fft, ifft, fftfreq, rfftfreq
+from qetpy.utils import fill_negatives, make_decreasing, fold_spectrum
+from qetpy.utils import fft, ifft, rfft, irfft, fftfreq, rfftfreq
 
 __all__ = ["foldpsd", "foldcsd", "calc_psd",
            "calc_csd","calc_corrcoeff_from_csd",
-           "smooth_psd", "gen_noise",
+           "smooth_psd", "gen_noise", "gen_noise_batches",
            "gen_noise_from_psd",
+           "NoiseAccumulator",
            "Noise"]
 
 
@@ -123,7 +124,8 @@ def foldcsd(csd, fs):
     return fold_spectrum(csd, fs)
 
 
-def calc_csd(array, fs=1.0, folded_over=False, use_hann_window=False):
+def calc_csd(array, fs=1.0, folded_over=False, use_hann_window=False,
+             chunk_size=256):
     """
     Calculate and return the CSD of in Amps^2/Hz
 
@@ -144,6 +146,13 @@ def calc_csd(array, fs=1.0, folded_over=False, use_hann_window=False):
     use_hann_window : bool, optional
         Specifies whether to use a Hann window on the CSD calculation.
         If false, defaults to a boxcar window, identical to no window.
+
+    chunk_size : int, optional
+        Number of traces FFT'ed and accumulated at once (memory
+        usage is proportional to chunk_size*channels*samples
+        and independent of the total number of traces, so
+        array can also be a memory-mapped array)
+        Default: 256
             
     Returns
     -------
@@ -173,39 +182,76 @@ def calc_csd(array, fs=1.0, folded_over=False, use_hann_window=False):
     if nchannels == 1:
         raise ValueError('ERROR: Need more than one channel to calculate csd')
 
-    # number of frequencies
-    nfreqs = nsamples
-    if folded_over:
-        if nsamples % 2 != 0:
-            nfreqs = int((nsamples + 1)/2)
-        else:
-            nfreqs = int(nsamples/2 + 1)
+    # window
+    window = _csd_window(nsamples, use_hann_window)
       
-    # initialize output
-    traces_csd = np.zeros(shape=(nchannels, nchannels, ntraces, nfreqs),
-                          dtype=np.complex128)
-    csd_mean = np.zeros(shape=(nchannels, nchannels, nfreqs),
-                        dtype=np.complex128)
-        
-    csd_freqs = None
-    for irow, jcolumn in product(list(range(nchannels)),repeat=2):
-        for n in range(ntraces):
-            if use_hann_window:
-                csd_freqs, temp_csd = csd(array[n, irow, :], array[n, jcolumn, :],
-                                      nperseg=nsamples, fs=fs, nfft=nsamples,
-                                      return_onesided=folded_over)
-            else:
-                csd_freqs, temp_csd = csd(array[n, irow, :], array[n, jcolumn, :],
-                                      nperseg=nsamples, fs=fs, nfft=nsamples,
-                                      return_onesided=folded_over, window='boxcar')
+    # accumulate sum of conj(fft_i)*fft_j over traces
+    csd_sum = 0
+    for istart in range(0, ntraces, chunk_size):
+        csd_sum = csd_sum + _calc_csd_sum(array[istart:istart+chunk_size],
+                                          window, folded_over)
 
-            traces_csd[irow][jcolumn][n] = temp_csd
-                
-        csd_mean[irow][jcolumn] =  np.mean(traces_csd[irow][jcolumn], axis=0)
+    # normalize
+    csd_freqs, csd_norm = _spectrum_normalization(window, fs, folded_over)
+    csd_mean = csd_sum / ntraces * csd_norm
            
     return  csd_freqs, csd_mean
 
 
+def _csd_window(nsamples, use_hann_window):
+    """
+    CSD window (same as scipy.signal.csd)
+    """
+
+    if use_hann_window:
+        return get_window('hann', nsamples)
+
+    return np.ones(nsamples)
+
+
+def _calc_csd_sum(array, window, folded_over):
+    """
+    Sum over traces of the (mean subtracted, windowed)
+    conj(fft_i)*fft_j, dim [channels, channels, freqs]
+    """
+
+    array = array - np.mean(array, axis=-1, keepdims=True)
+    array = array * window
+
+    if folded_over:
+        array_fft = rfft(array, axis=-1)
+    else:
+        array_fft = fft(array, axis=-1)
+
+    return np.einsum('tif,tjf->ijf', array_fft.conjugate(), array_fft)
+
+
+def _spectrum_normalization(window, fs, folded_over):
+    """
+    Frequencies and normalization to convert conj(fft_i)*fft_j
+    to PSD/CSD in Amps^2/Hz (same normalization as
+    scipy.signal.csd with scaling="density", including the
+    factor 2 for one-sided spectra)
+    """
+
+    nsamples = len(window)
+    
+    if folded_over:
+        freqs = rfftfreq(nsamples, fs)
+    else:
+        freqs = fftfreq(nsamples, fs)
+
+    norm = np.full(len(freqs), 1/(fs * np.sum(window**2)))
+
+    if folded_over:
+        if nsamples % 2 == 0:
+            norm[1:-1] *= 2
+        else:
+            norm[1:] *= 2
+
+    return freqs, norm
+
+
 def calc_corrcoeff_from_csd(csd):
     """
     Calculate the correlation coefficient from a csd
@@ -316,7 +362,7 @@ def gen_noise_from_psd(psd, fs=1.0, ntraces=1):
 
 
 
-def gen_noise(csd, fs=1.0, n_traces=1):
+def gen_noise(csd, fs=1.0, n_traces=1, rng=None, chunk_size=None):
     """
     Function to generate noise traces with random phase from a given CSD. The CSD calculated from
     the generated noise traces should be the equivalent to the inputted CSD as the number of traces
@@ -331,6 +377,13 @@ def gen_noise(csd, fs=1.0, n_traces=1):
         Sample rate of the data being taken, assumed to be in units of Hz.
     ntraces : int, optional
         The number of noise traces that should be generated. Default is 1.
+    rng : int or numpy.random.Generator, optional
+        Seed or random number generator. Default is None (use
+        numpy.random global state, see numpy.random.seed)
+    chunk_size : int, optional
+        Number of traces generated at once (memory usage of the
+        intermediate arrays is proportional to chunk_size). Default
+        is None (traces x channels x samples < 2^24 per chunk)
     
     Returns
     -------
@@ -339,50 +392,518 @@ def gen_noise(csd, fs=1.0, n_traces=1):
         (ntraces, n_channels, len(csd)). 
     """
 
+    # Cholesky decomposition (all positive frequencies at once)
+    csd_factors = _calc_noise_factors(csd, fs)
+    n_channels = csd_factors.shape[1]
+    n_samples = csd.shape[-1]
+
+    # random number generator
+    if rng is None:
+        rng = np.random
+    elif not isinstance(rng, np.random.Generator):
+        rng = np.random.default_rng(rng)
+
+    # generate by chunk
+    if chunk_size is None:
+        chunk_size = max(1, 2**24 // (n_channels * n_samples))
+
+    random_trace_td = np.zeros((n_traces, n_channels, n_samples))
+    for istart in range(0, n_traces, chunk_size):
+        nchunk = min(chunk_size, n_traces - istart)
+        random_trace_td[istart:istart+nchunk] = _gen_noise_from_factors(
+            csd_factors, n_samples, nchunk, rng
+        )
+    
+    return random_trace_td
+
+
+def gen_noise_batches(csd, fs=1.0, n_traces=None, batch_size=1000,
+                      seed=None, templates=None, amplitudes=None,
+                      t0s=None):
+    """
+    Generator yielding batches of noise traces (see gen_noise) with
+    a fixed memory footprint, optionally with injected templates.
+    Each batch uses its own random number generator derived from
+    the seed (numpy.random.SeedSequence spawn key = batch index),
+    so that batches are reproducible independently of each other.
+
+    Parameters
+    ----------
+    csd : ndarray
+        The two-sided cross spectral density [channels, channels, samples]
+        that will be used to generate the noise. If 1D, it's assumed to
+        be the PSD.
+    fs : float, optional
+        Sample rate of the data being taken, assumed to be in units of Hz.
+    n_traces : int, optional
+        Total number of traces. Default is None (length of amplitudes
+        or t0s arrays if provided, infinite otherwise)
+    batch_size : int, optional
+        Number of traces per batch. Default is 1000.
+    seed : int, optional
+        Random seed. Default is None (random entropy)
+    templates : ndarray, optional
+        Templates to inject [channels, samples] (or [samples], same
+        template for all channels). Default is None (noise only)
+    amplitudes : float or ndarray, optional
+        Amplitude(s) of the injected templates, float or 1D array
+        [n_traces]. Required if templates is not None.
+    t0s : float or ndarray, optional
+        Time shift(s) in seconds of the injected templates (circular,
+        sub-sample shift in frequency domain), float or 1D array
+        [n_traces]. Default is 0.
+
+    Yields
+    ------
+    noise : ndarray
+        Batch of generated traces, shape (batch_size, n_channels, len(csd))
+        (last batch can be smaller)
+    """
+
+    # Cholesky decomposition (all positive frequencies at once)
+    csd_factors = _calc_noise_factors(csd, fs)
+    n_channels = csd_factors.shape[1]
+    n_samples = csd.shape[-1]
+
+    # templates fft
+    templates_fft = None
+    if templates is not None:
+
+        if amplitudes is None:
+            raise ValueError('ERROR: "amplitudes" required to '
+                             'inject templates!')
+
+        templates = np.asarray(templates, dtype=np.float64)
+        if templates.shape[-1] != n_samples:
+            raise ValueError('ERROR: templates and csd should have the '
+                             'same number of samples!')
+
+        templates_fft = rfft(np.broadcast_to(templates,
+                                             (n_channels, n_samples)),
+                             axis=-1)
+        freqs = rfftfreq(n_samples, fs)
+
+        amplitudes = np.asarray(amplitudes, dtype=np.float64)
+        t0s = np.asarray(0.0 if t0s is None else t0s, dtype=np.float64)
+
+        # number of traces from arrays
+        for array in [amplitudes, t0s]:
+            if array.ndim == 1:
+                if n_traces is None:
+                    n_traces = len(array)
+                elif len(array) < n_traces:
+                    raise ValueError('ERROR: "amplitudes" and "t0s" arrays '
+                                     'should have n_traces elements!')
+
+    # batches
+    seed_sequence = np.random.SeedSequence(seed)
+
+    ibatch = 0
+    while n_traces is None or ibatch*batch_size < n_traces:
+
+        istart = ibatch*batch_size
+        nbatch = batch_size
+        if n_traces is not None:
+            nbatch = min(batch_size, n_traces - istart)
+
+        # random generator for this batch
+        rng = np.random.default_rng(
+            np.random.SeedSequence(seed_sequence.entropy,
+                                   spawn_key=(ibatch,))
+        )
+
+        traces = _gen_noise_from_factors(csd_factors, n_samples,
+                                         nbatch, rng)
+
+        # inject templates
+        if templates_fft is not None:
+
+            batch_amps = amplitudes
+            if amplitudes.ndim == 1:
+                batch_amps = amplitudes[istart:istart+nbatch]
+            batch_t0s = t0s
+            if t0s.ndim == 1:
+                batch_t0s = t0s[istart:istart+nbatch]
+
+            phases = np.exp(-2j*np.pi*np.multiply.outer(
+                np.broadcast_to(batch_t0s, (nbatch,)), freqs))
+            pulses_fft = (np.broadcast_to(batch_amps, (nbatch,))[:, None, None]
+                          * phases[:, np.newaxis, :]
+                          * templates_fft)
+            traces += irfft(pulses_fft, n=n_samples, axis=-1)
+
+        yield traces
+
+        ibatch += 1
+
+
+def _calc_noise_factors(csd, fs):
+    """
+    Cholesky decomposition of the CSD (times frequency
+    spacing) for all strictly positive frequencies,
+    dim [nfreqs, channels, channels]
+    """
 
     # Convert PSD to 3D if needed
     if csd.ndim == 1:
         csd = np.reshape(csd, (1, 1, len(csd)))
-        
-        # Check if the PSD is infinite at 0 Hz
-        if np.isinf(csd[0,0,0]):
-            csd[0,0,0] = 0
 
     # Read CSD matrix shape
     n_channels, _, f_freqs = csd.shape
-    freqs = fftfreq(f_freqs, fs)
-    dfreq = np.diff(freqs)[0]
+    dfreq = fs / f_freqs
 
-    # Initialize the Fourier-domain noise realizations
-    random_trace_fd = np.zeros((n_traces, n_channels, f_freqs), dtype=complex)
-    
-    # Loop over the frequencies, randomly generate the noise in each frequency
-    for i, freq in enumerate(freqs):
-        
-        # Ignore DC term; negative frequencies will be calculated by symmetry
-        if freq <= 0:
-            continue
-        
-        # Cholesky decomposition for Hermitian matrices
-        L = np.linalg.cholesky(csd[:, :, i] * dfreq)
+    # Ignore DC term (and Nyquist frequency); negative frequencies
+    # are calculated by symmetry
+    n_positive = (f_freqs - 1) // 2
+    csd_positive = np.moveaxis(csd[:, :, 1:n_positive+1], -1, 0)
+   
+    # Cholesky decomposition for Hermitian matrices
+    return np.linalg.cholesky(csd_positive * dfreq)
 
-        # Generate standard normal random variables (mean=0, variance=1)
-        z = np.random.normal(size=(n_channels, n_traces)) + \
-            1j * np.random.normal(size=(n_channels, n_traces))
-        z *= 1 / np.sqrt(2)
 
-        # Get the desired distribution of Fourier amplitudes
-        random_trace_fd[:, :, i] = (L @ z).T
-        
-        # Calculate the negative frequency by symmetry
-        i_neg = np.where(freqs == -freq)[0][0]
-        random_trace_fd[:, :, i_neg] = np.conj(random_trace_fd[:, :, i])
+def _gen_noise_from_factors(csd_factors, n_samples, n_traces, rng):
+    """
+    Generate noise traces [traces, channels, samples] from the
+    CSD Cholesky factors (see _calc_noise_factors)
+    """
 
-    # Inverse Fourier transform to convert to time domain
-    random_trace_td = ifft(random_trace_fd, axis=-1).real * f_freqs
-    
-    return random_trace_td
+    n_positive, n_channels, _ = csd_factors.shape
+
+    # Generate standard normal random variables (mean=0, variance=1)
+    # (trace first: same random numbers independently of chunk size)
+    z = rng.standard_normal(size=(n_traces, n_positive, n_channels, 2))
+    z = (z[..., 0] + 1j*z[..., 1]) / np.sqrt(2)
+
+    # Get the desired distribution of Fourier amplitudes
+    # (positive frequencies, DC and Nyquist = 0)
+    random_trace_fd = np.zeros((n_traces, n_channels, n_samples//2 + 1),
+                               dtype=complex)
+    random_trace_fd[:, :, 1:n_positive+1] = np.swapaxes(
+        (csd_factors @ z[..., np.newaxis])[..., 0], 1, 2
+    )
+
+    # Inverse Fourier transform (Hermitian symmetric spectrum)
+    # to convert to time domain
+    return irfft(random_trace_fd, n=n_samples, axis=-1) * n_samples
+
+
+
+class NoiseAccumulator:
+    """
+    Streaming (online) PSD and CSD calculation: traces are
+    added in chunks with update() and running sums are kept
+    (memory independent of the number of traces). PSD, CSD
+    (mean and standard deviation of real/imaginary parts) and
+    correlation coefficients can be obtained at any time.
+    The PSD follows calc_psd convention (no window) and the
+    CSD follows calc_csd convention (mean subtracted, optional
+    Hann window).
+    """
+
+    def __init__(self, fs, folded_over=True, use_hann_window=False,
+                 lgc_csd_std=True):
+        """
+        Initialize NoiseAccumulator
+
+        Parameters
+        ----------
+        fs : float
+            Sample rate of the data being taken, assumed to be in units of Hz.
+
+        folded_over : bool, optional
+            If True, one-sided PSD/CSD (positive frequencies only),
+            otherwise two-sided. Default is True.
+
+        use_hann_window : bool, optional
+            Use a Hann window for the CSD calculation (boxcar
+            otherwise). Default is False.
+
+        lgc_csd_std : bool, optional
+            If True, also accumulate the variance of the
+            real and imaginary parts of the CSD (Welford/Chan
+            algorithm). Default is True.
+        """
 
+        self._fs = fs
+        self._folded_over = folded_over
+        self._use_hann_window = use_hann_window
+        self._lgc_csd_std = lgc_csd_std
+
+        self.reset()
+
+
+    @property
+    def ntraces(self):
+        return self._ntraces
+
+    @property
+    def nchans(self):
+        return self._nchans
+
+    @property
+    def nsamples(self):
+        return self._nsamples
+
+
+    def reset(self):
+        """
+        Reset running sums
+        """
+
+        self._ntraces = 0
+        self._nchans = None
+        self._nsamples = None
+        self._window = None
+
+        # sum of |fft|^2 [nchans, nfreqs]
+        self._psd_sum = None
+
+        # sum of conj(fft_i)*fft_j [nchans, nchans, nfreqs]
+        self._csd_sum = None
+
+        # mean and sum of squared deviations (real and imaginary parts)
+        # of conj(fft_i)*fft_j [nchans, nchans, nfreqs]
+        self._csd_real_mean = None
+        self._csd_real_m2 = None
+        self._csd_imag_mean = None
+        self._csd_imag_m2 = None
+
+
+    def update(self, traces):
+        """
+        Add traces to the running sums
+
+        Parameters
+        ----------
+        traces : ndarray
+            Traces in units of Amps, same number of channels and
+            samples for all calls:
+            1D [num_samples]
+            2D [num_traces, num_samples] (single channel)
+            3D [num_traces, num_channels, num_samples]
+        """
+
+        traces = np.asarray(traces)
+        if traces.ndim == 1:
+            traces = traces[np.newaxis, np.newaxis, :]
+        elif traces.ndim == 2:
+            traces = traces[:, np.newaxis, :]
+        elif traces.ndim != 3:
+            raise ValueError('ERROR: The input array should be a '
+                             'numpy 1D, 2D or 3D array!')
+
+        ntraces, nchans, nsamples = traces.shape
+        if ntraces == 0:
+            return
+
+        # first call
+        if self._nchans is None:
+            self._nchans = nchans
+            self._nsamples = nsamples
+            self._window = _csd_window(nsamples, self._use_hann_window)
+        elif nchans != self._nchans or nsamples != self._nsamples:
+            raise ValueError(
+                f'ERROR: Inconsistent traces shape, expecting '
+                f'{self._nchans} channels and {self._nsamples} samples!')
+
+        # psd (calc_psd convention)
+        if self._folded_over:
+            traces_fft = rfft(traces, axis=-1)
+        else:
+            traces_fft = fft(traces, axis=-1)
+
+        psd_sum = np.sum(np.abs(traces_fft)**2, axis=0)
+
+        if self._psd_sum is None:
+            self._psd_sum = psd_sum
+        else:
+            self._psd_sum += psd_sum
+
+        # csd (calc_csd convention)
+        if nchans > 1:
+
+            traces = traces - np.mean(traces, axis=-1, keepdims=True)
+            if self._use_hann_window:
+                traces = traces * self._window
+
+            if self._folded_over:
+                traces_fft = rfft(traces, axis=-1)
+            else:
+                traces_fft = fft(traces, axis=-1)
+
+            real = np.real(traces_fft)
+            imag = np.imag(traces_fft)
+            csd_sum = np.einsum('tif,tjf->ijf',
+                                traces_fft.conjugate(), traces_fft)
+
+            if self._lgc_csd_std:
+                self._update_csd_variance(ntraces, csd_sum, real, imag)
+
+            if self._csd_sum is None:
+                self._csd_sum = csd_sum
+            else:
+                self._csd_sum += csd_sum
+
+        self._ntraces += ntraces
+
+
+    def get_psd(self):
+        """
+        Get PSD
+
+        Returns
+        -------
+        f : ndarray
+            Array of sample frequencies
+        psd : ndarray
+            Power spectral density in units of Amps^2/Hz,
+            dim [num_freqs] (single channel) or
+            [num_channels, num_freqs]
+        """
+
+        self._check_traces()
+
+        freqs, norm = _spectrum_normalization(
+            np.ones(self._nsamples), self._fs, self._folded_over)
+        psd = self._psd_sum / self._ntraces * norm
+
+        if self._nchans == 1:
+            psd = psd[0]
+
+        return freqs, psd
+
+
+    def get_csd(self):
+        """
+        Get CSD
+
+        Returns
+        -------
+        f : ndarray
+            Array of sample frequencies
+        csd : 3darray
+            mean cross power spectral density in units of Amps^2/Hz,
+            dim [num_channels, num_channels, num_freqs]
+        """
+
+        self._check_traces(lgc_csd=True)
+
+        freqs, norm = _spectrum_normalization(
+            self._window, self._fs, self._folded_over)
+        csd = self._csd_sum / self._ntraces * norm
+
+        return freqs, csd
+
+
+    def get_csd_std(self):
+        """
+        Get standard deviation (over traces) of the real and
+        imaginary parts of the CSD
+
+        Returns
+        -------
+        real_csd_std : 3darray
+            standard deviation of the real part of the CSD in Amps^2/Hz
+        imag_csd_std : 3darray
+            standard deviation of the imaginary part of the CSD in Amps^2/Hz
+        """
+
+        self._check_traces(lgc_csd=True)
+
+        if not self._lgc_csd_std:
+            raise ValueError('ERROR: CSD variance not accumulated, '
+                             'use "lgc_csd_std=True"!')
+
+        _, norm = _spectrum_normalization(
+            self._window, self._fs, self._folded_over)
+
+        real_csd_std = np.sqrt(self._csd_real_m2 / self._ntraces) * norm
+        imag_csd_std = np.sqrt(self._csd_imag_m2 / self._ntraces) * norm
+
+        return real_csd_std, imag_csd_std
+
+
+    def get_corrcoeff(self):
+        """
+        Get correlation coefficients from CSD
+        (see calc_corrcoeff_from_csd)
+
+        Returns
+        -------
+        f : ndarray
+            Array of sample frequencies
+        corrcoeff : 3darray
+            correlation coefficients, dim [num_channels,
+            num_channels, num_freqs]
+        """
+
+        freqs, csd = self.get_csd()
+
+        return freqs, calc_corrcoeff_from_csd(csd)
+
+
+    def _check_traces(self, lgc_csd=False):
+        """
+        Check traces have been added
+        """
+
+        if self._ntraces == 0:
+            raise ValueError('ERROR: No traces added, use update()!')
+
+        if lgc_csd and self._nchans == 1:
+            raise ValueError('ERROR: Need more than one channel '
+                             'to calculate csd')
+
+
+    def _update_csd_variance(self, ntraces, csd_sum, real, imag):
+        """
+        Update mean and sum of squared deviations of the real
+        and imaginary parts of conj(fft_i)*fft_j (chunk statistics
+        merged with Chan et al. parallel version of Welford
+        algorithm)
+        """
+
+        real_mean = np.real(csd_sum) / ntraces
+        imag_mean = np.imag(csd_sum) / ntraces
+
+        # chunk sum of squared deviations from the chunk mean,
+        # one channel at a time (per trace csd not stored for
+        # all channel pairs):
+        # re(conj(xi)xj) = ai*aj + bi*bj
+        # im(conj(xi)xj) = ai*bj - bi*aj
+        real_m2 = np.zeros_like(real_mean)
+        imag_m2 = np.zeros_like(imag_mean)
+        for ichan in range(real.shape[1]):
+            areal = real[:, ichan:ichan+1, :]
+            aimag = imag[:, ichan:ichan+1, :]
+            real_dev = areal*real + aimag*imag - real_mean[ichan]
+            imag_dev = areal*imag - aimag*real - imag_mean[ichan]
+            real_m2[ichan] = np.sum(real_dev**2, axis=0)
+            imag_m2[ichan] = np.sum(imag_dev**2, axis=0)
+
+        # imaginary part of the diagonal (psd) = 0
+        # (remove rounding errors)
+        np.einsum('iif->if', imag_mean)[:] = 0
+        np.einsum('iif->if', imag_m2)[:] = 0
+
+        if self._csd_real_mean is None:
+            self._csd_real_mean = real_mean
+            self._csd_real_m2 = real_m2
+            self._csd_imag_mean = imag_mean
+            self._csd_imag_m2 = imag_m2
+            return
+
+        # merge
+        ntot = self._ntraces + ntraces
+        weight = self._ntraces * ntraces / ntot
+
+        delta = real_mean - self._csd_real_mean
+        self._csd_real_mean += delta * ntraces / ntot
+        self._csd_real_m2 += real_m2 + delta**2 * weight
+
+        delta = imag_mean - self._csd_imag_mean
+        self._csd_imag_mean += delta * ntraces / ntot
+        self._csd_imag_m2 += imag_m2 + delta**2 * weight
 
 
 class Noise(object):
@@ -501,11 +1022,12 @@ class Noise(object):
         Function to remove the slope from each trace. self.traces is changed to be the slope subtracted traces.
         """
       
-        tracenoslope = np.empty_like(self.traces)
-        for ichan in range(self.traces.shape[1]):
-            for itrace in range(self.traces.shape[0]):
-                s = slope(self.time, self.traces[itrace][ichan])
-                tracenoslope[itrace][ichan] = self.traces[itrace][ichan] - s*self.time
+        # least-squares slope of all traces at once
+        # (same as utils.slope)
+        time_centered = self.time - np.mean(self.time)
+        slopes = (self.traces @ time_centered) / np.sum(time_centered**2)
+
+        tracenoslope = self.traces - slopes[..., np.newaxis]*self.time
         
         self.traces = tracenoslope
         
@@ -552,20 +1074,17 @@ class Noise(object):
         if nsizematrix == 1:
             raise ValueError("Need more than one channel to calculate cross channel correlations")
             
-        if self.traces.shape[2] % 2 != 0:
-            lenpsd = int((self.traces.shape[2] + 1)/2)
-        else:
-            lenpsd = int(self.traces.shape[2]/2 + 1)
-                
-        nDataPoints = self.traces.shape[0]
-        #initialize empty array                           
-        corr_coeff = np.empty(shape=(lenpsd, nsizematrix, nsizematrix)) 
+        # correlation (over traces) of the fft magnitudes,
+        # all frequencies at once, dim [nchans, nchans, nfreqs]
         traces_fft_chan = np.abs(np.fft.rfft(self.traces))
-        traces_fft_chan = np.swapaxes(traces_fft_chan, 0,1)
-        for n in range(lenpsd):
-            corr_coeff[n] = np.corrcoef(traces_fft_chan[:,:,n])
-        
-        self.corrcoeff = np.swapaxes(corr_coeff, 0, 2)
+        traces_fft_chan -= np.mean(traces_fft_chan, axis=0)
+        cov = np.einsum('tif,tjf->ijf', traces_fft_chan, traces_fft_chan)
+        norm = np.sqrt(np.einsum('iif->if', cov))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            corr_coeff = cov / norm[:, np.newaxis, :] / norm[np.newaxis, :, :]
+
+        # same as numpy.corrcoef
+        self.corrcoeff = np.clip(corr_coeff, -1, 1)
     
     def calculate_uncorr_noise(self):
         """
@@ -603,43 +1122,27 @@ class Noise(object):
         if traceshape[1] == 1:
             raise ValueError("Need more than one channel to calculate csd")
 
-        lencsd = traceshape[2]
-        nfreqs = lencsd
-      
-        if not twosided:
-            if lencsd % 2 != 0:
-                nfreqs = int((lencsd + 1)/2)
-            else:
-                nfreqs = int(lencsd/2 + 1)
-        else:
-            nfreqs = lencsd
-       
         nrows = traceshape[1]
         ntraces = traceshape[0]
-           
-        # initialize ndarrays
-        trace_csd = np.zeros(shape=(nrows,nrows,ntraces,nfreqs),dtype = np.complex128)
-        csd_mean = np.zeros(shape=(nrows,nrows,nfreqs),dtype = np.complex128)
-        real_csd_mean = np.zeros(shape=(nrows,nrows,nfreqs),dtype = np.float64)
-        imag_csd_mean = np.zeros(shape=(nrows,nrows,nfreqs),dtype = np.float64)
-        real_csd_std = np.zeros(shape=(nrows,nrows,nfreqs),dtype = np.float64)
-        imag_csd_std = np.zeros(shape=(nrows,nrows,nfreqs),dtype = np.float64)
-
-        csd_freqs = None
+
+        # accumulate csd (and real/imag variances) by chunk of traces
+        # (Hann window, same as scipy.signal.csd default)
+        accumulator = NoiseAccumulator(self.fs, folded_over=not twosided,
+                                       use_hann_window=True)
+        nchunk = 256
+        for istart in range(0, ntraces, nchunk):
+            accumulator.update(self.traces[istart:istart+nchunk])
+
+        csd_freqs, csd_mean = accumulator.get_csd()
+        real_csd_std, imag_csd_std = accumulator.get_csd_std()
+        real_csd_mean = np.real(csd_mean).copy()
+        imag_csd_mean = np.imag(csd_mean).copy()
+
+        # we use fill_negatives() because there are many missing data points in the calculation of csd
         for irow, jcolumn in product(list(range(nrows)),repeat = 2):
-            for n in range(ntraces):
-                csd_freqs, temp_csd = csd(self.traces[n,irow,:], self.traces[n,jcolumn,:],
-                                          nperseg=lencsd, fs=self.fs, nfft=lencsd,
-                                          return_onesided=not twosided)
-                trace_csd[irow][jcolumn][n] = temp_csd
-                
-            csd_mean[irow][jcolumn] =  np.mean(trace_csd[irow][jcolumn],axis = 0)
-            # we use fill_negatives() because there are many missing data points in the calculation of csd
-            real_csd_mean[irow][jcolumn] = fill_negatives(np.mean(np.real(trace_csd[irow][jcolumn]),axis = 0))
-            imag_csd_mean[irow][jcolumn] = fill_negatives(np.mean(np.imag(trace_csd[irow][jcolumn]),axis = 0))   
-            real_csd_std[irow][jcolumn] = fill_negatives(np.std(np.real(trace_csd[irow][jcolumn]),axis = 0))
-            imag_csd_std[irow][jcolumn] = fill_negatives(np.std(np.imag(trace_csd[irow][jcolumn]),axis = 0))
-            
+            for array in [real_csd_mean, imag_csd_mean,
+                          real_csd_std, imag_csd_std]:
+                fill_negatives(array[irow][jcolumn])
             
         self.csd = csd_mean
         self.real_csd = real_csd_mean
@@ -335,7 +335,72 @@ class OF1x1:
             self.plot(lgc_plot_withdelay=True,
                       lgc_plot_nodelay=lgc_fit_nodelay)
                 
-                
+
+    def calc_batch(self, signals,
+                   window_min_from_trig_usec=None,
+                   window_max_from_trig_usec=None,
+                   window_min_index=None,
+                   window_max_index=None,
+                   lowchi2_fcutoff=10000,
+                   lgc_outside_window=False,
+                   pulse_direction_constraint=0,
+                   interpolate_t0=False,
+                   lgc_fit_nodelay=True):
+        """
+        Calculate OF with delay (and no delay if
+        lgc_fit_nodelay=True) for a batch of events at once
+        (stacked FFT/iFFT and 2D chisq/amp arrays).
+        Results are then available as arrays [nevents]
+        using get_result_withdelay/get_result_nodelay
+
+        Parameters
+        ----------
+
+        signals : 2D ndarray [nevents, nbins]
+          signal traces
+
+        (other parameters: see calc)
+
+        Return
+        ------
+        None
+
+        """
+
+        # check signals
+        if (not isinstance(signals, np.ndarray)
+            or signals.ndim != 2):
+            raise ValueError('ERROR: Expecting "signals" to be '
+                             'a 2D array [nevents, nbins]')
+
+        # clear
+        self._of_base.clear_signal()
+        
+        # update all events
+        self._of_base.update_signal(
+            self._channel_name,
+            signals,
+            calc_signal_filt=True,
+            calc_signal_filt_td=True,
+            calc_chisq_amp=True,
+            template_tags=self._template_tag
+        )
+
+        # with delay fit -> arrays
+        self.calc(
+            signal=None,
+            window_min_from_trig_usec=window_min_from_trig_usec,
+            window_max_from_trig_usec=window_max_from_trig_usec,
+            window_min_index=window_min_index,
+            window_max_index=window_max_index,
+            lowchi2_fcutoff=lowchi2_fcutoff,
+            lgc_outside_window=lgc_outside_window,
+            pulse_direction_constraint=pulse_direction_constraint,
+            interpolate_t0=interpolate_t0,
+            lgc_fit_nodelay=lgc_fit_nodelay,
+            lgc_plot=False
+        )
+        
                 
 
     def calc_nodelay(self, signal=None,
@@ -612,6 +677,10 @@ class OF1x1:
         
         # signal
         signal = self._of_base.signal(self._channel_name)
+        if signal.ndim > 1:
+            print('WARNING: Unable to plot batch of events!')
+            return
+        
         template = self._of_base.template(self._channel_name)
         fs = self._of_base.sample_rate
         nbins = len(signal)
@@ -105,6 +105,7 @@ class OF1x2:
         self._transformation_matrix_inv  = None
         self._wedge_matrix  = None
         self._time_combinations = None
+        self._fit_window = fit_window
 
         # intialize signal related parameters
         self._q_vector = None
@@ -226,13 +227,34 @@ class OF1x2:
 
         
     def calc(self, signal=None, flag_polarity_constraints=False,
-             method='easy', lgc_plot=False):
+             method='easy', lgc_plot=False,
+             decimation=None, nb_candidates=10, chi2_tolerance=None):
         """
         Runs the pileup optimum filter algorithm for 1 channel 2 pulses.
         Parameters
         ----------
         signal:  the raw data
         fit window: when the grid search is done, typically get this form back of the envelope calculation
+
+        decimation : int, optional
+           If not None (and > 1), coarse-to-fine search: chi2 is first
+           evaluated on a decimated grid of time combinations (every
+           "decimation" samples for both pulses), then exhaustively
+           in the neighbourhood (+/- decimation-1 samples) of the
+           best candidates only
+           Default: None (exhaustive search)
+
+        nb_candidates : int, optional
+           coarse-to-fine search: number of best coarse time
+           combinations refined
+           Default: 10
+
+        chi2_tolerance : float, optional
+           coarse-to-fine search: also refine all coarse time
+           combinations with chi2 within chi2_tolerance of the
+           coarse minimum (np.inf = exhaustive search)
+           Default: None
+
         Returns
         -------
         None
@@ -249,16 +271,24 @@ class OF1x2:
                 template_tags=[self._template_1_tag , self._template_2_tag]
             )
            
+        # time combinations (all or coarse-to-fine)
+        t0s = self._time_combinations
+        if decimation is not None and decimation > 1:
+            t0s = self._calc_coarse_to_fine_t0s(
+                flag_polarity_constraints, method,
+                decimation, nb_candidates, chi2_tolerance
+            )
+
         # calculate amplitudes
-        amps1, amps2 = self._calc_amps(flag_polarity_constraints, method)
+        amps1, amps2 = self._calc_amps(flag_polarity_constraints, method,
+                                       t0s=t0s)
 
         # get chis2
-        chi2s = self._calc_chi2(amps1, amps2)
+        chi2s = self._calc_chi2(amps1, amps2, t0s=t0s)
 
         min_index = np.argmin(chi2s)
         self._chi2 = chi2s[min_index]
 
-        t0s = self._time_combinations.copy()
         self._time_diff_two_pulses = (t0s[min_index, 1]/self._fs
                                       - t0s[min_index, 0]/self._fs)
         self._amplitude[self._template_1_tag] = amps1[min_index]
@@ -352,7 +382,9 @@ class OF1x2:
             
     def _calc_p_matrix(self, fit_window):
         """
-        calc p matrix
+        calc p matrix and its inverse per time lag t1-t2
+        (the p matrix only depends on the time difference
+        between the two pulses) and time combinations
         """
 
         # get optimal filter and template ffts
@@ -375,22 +407,23 @@ class OF1x2:
 
         # intialize
         p = np.zeros((nbins, M, M))
-        allowed_boundary = np.zeros((nbins, M, M))
-        scaling = np.zeros((nbins, M, M))
 
         np.einsum('jii->ji', p)[:] = 1
 
         for i in range(M):
             p[:, i, i] = norms[i]
-            allowed_boundary[:, i, i] = 1.0 #diagonal by definiation
             for j in range(i+1,M):
                 p[:, i, j] = p[:, j, i] = (
-                    np.real(np.fft.ifft(template_ffts[j] * phis[i]) * self._fs)
+                    self._of_base._ifft_real(template_ffts[j] * phis[i]) * self._fs
                 )
-                allowed_boundary[:, i, j] = allowed_boundary[:, j, i] = 0
 
         p_inv = np.linalg.pinv(p)
 
+        # symmetric (same as upper triangle)
+        for i in range(M):
+            for j in range(i+1,M):
+                p_inv[:, j, i] = p_inv[:, i, j]
+
 
         # time combinations
         if fit_window is  None:
@@ -407,29 +440,39 @@ class OF1x2:
         indices = np.where(mask)
         t0s = np.column_stack(( X[indices] ,Y[indices]))
 
-        # initialize
-        p_matrix_inv   = np.zeros((t0s[:,0].shape[0], M, M ))
-        np.einsum('jii->ji', p_matrix_inv )[:] = 1
+        # save (p matrix and inverse [nbins, M, M] indexed
+        # by time lag t1-t2, negative lags wrap around)
+        self._time_combinations = t0s
+        self._p_matrix  =  p
+        self._p_matrix_inv =  p_inv
+
+        # polarity constraint ("hard" method) matrices,
+        # calculated when needed
+        self._transformation_matrix  = None
+        self._transformation_matrix_inv = None
+        self._wedge_matrix = None
 
-        # calculate
-        for i in range(M):
-            if i == M-1:
-                p_matrix_inv[:, i, i] = p_inv[t0s[:,0]-t0s[:,i]][:, i, i]
-            else:
-                p_matrix_inv[:, i, i] = p_inv[t0s[:,i]-t0s[:,i+1]][:, i, i]
 
-            for j in range(i+1,M):
-                p_matrix_inv[:, i, j] = p_matrix_inv[:, j, i] = (
-                    p_inv[t0s[:,i]-t0s[:,j]][:, i, j]
-                )
-       
-        eigenvalues , eigenvectors = np.linalg.eig(p_matrix_inv.reshape(-1,M,M) )
+    def _calc_transformation_matrix(self):
+        """
+        calc transformation and wedge matrices per time lag
+        (eigen decomposition of p matrix inverse), used by
+        "hard" polarity constraint method
+        """
+
+        if self._transformation_matrix is not None:
+            return
+
+        M = self._p_matrix_inv.shape[-1]
+        nlags = self._p_matrix_inv.shape[0]
+
+        eigenvalues , eigenvectors = np.linalg.eig(self._p_matrix_inv)
         scaling = np.einsum('...ij,...j->...ij',
                             np.eye(M), 1/(np.sqrt(np.abs(eigenvalues)))).reshape(
-                                t0s[:,0].shape[0] ,M,M
+                                nlags, M, M
                             )
     
-        rotation = eigenvectors.reshape(t0s[:,0].shape[0] ,M,M)
+        rotation = eigenvectors.reshape(nlags, M, M)
         transformation_matrix = np.matmul(rotation, scaling)
         wedge_matrix = transformation_matrix/np.linalg.norm(
             transformation_matrix, axis=1
@@ -438,20 +481,57 @@ class OF1x2:
         transformation_matrix_inv = np.linalg.pinv(transformation_matrix)
 
         # save
-        self._time_combinations = t0s
-        self._p_matrix  =  p
-        self._p_matrix_inv =  p_matrix_inv
         self._transformation_matrix  = transformation_matrix
         self._transformation_matrix_inv = transformation_matrix_inv
         self._wedge_matrix =  wedge_matrix
         
         
-    def _calc_amps(self, flag_polarity_constraints, method): 
+    def _calc_coarse_to_fine_t0s(self, flag_polarity_constraints, method,
+                                 decimation, nb_candidates,
+                                 chi2_tolerance):
+        """
+        Coarse-to-fine search: evaluate chi2 on a decimated grid of
+        time combinations, then return the time combinations in the
+        neighbourhood of the best candidates (all time combinations
+        if not smaller)
+        """
+
+        # coarse grid
+        t0s_coarse = self._of_base.calc_time_combinations_coarse(
+            self._fit_window, True, decimation
+        )
+
+        amps1, amps2 = self._calc_amps(flag_polarity_constraints, method,
+                                       t0s=t0s_coarse)
+        chi2s = self._calc_chi2(amps1, amps2, t0s=t0s_coarse)
+
+        # refine best candidates
+        candidates = self._of_base.select_time_candidates(
+            chi2s, nb_candidates, chi2_tolerance
+        )
+
+        # exhaustive search if not smaller
+        if (len(candidates)*(2*decimation-1)**2
+            >= self._time_combinations.shape[0]):
+            return self._time_combinations
+
+        return self._of_base.calc_time_combinations_refined(
+            t0s_coarse[candidates], self._fit_window, True, decimation-1
+        )
+
+
+    def _calc_amps(self, flag_polarity_constraints, method, t0s=None):
         """
         Hidden function to calculate the amplitudes that correspond to
-        the inputted time offsets.
+        the inputted time offsets (default: all time combinations)
         """
 
+        if t0s is None:
+            t0s = self._time_combinations
+
+        # time lags (p matrix inverse index)
+        lags = t0s[:,0] - t0s[:,1]
+
         # get filtered signal from OF base
         signal_filt_tds = [self._of_base.signal_filt_td(self._channel,
                                                         self._template_1_tag),
@@ -465,7 +545,6 @@ class OF1x2:
              signal_filt_tds[1]*norms[1]]
         
         M = len(q)
-        t0s = self._time_combinations
         self._q_vector = np.zeros((M, t0s[:,0].shape[0]))
         for i in range(M):
             self._q_vector[i,:] = q[i][t0s[:,i]]
@@ -474,7 +553,7 @@ class OF1x2:
         amps  = np.zeros((t0s[:,0].shape[0], M))
         for i in range(M):
             for j in range(M):
-                amps[:,i] = amps[:,i]  + self._p_matrix_inv[:,i,j]*self._q_vector[j,:]
+                amps[:,i] = amps[:,i]  + self._p_matrix_inv[lags,i,j]*self._q_vector[j,:]
                 
         amps0 = amps[:,0]
         amps1 = amps[:,1]
@@ -493,7 +572,7 @@ class OF1x2:
             #set all the amps0 value to zero, where amp0 before transforming was negative. Only amps1 can move and amps0=0, if amps0 is negative
             amps0 = np.where(((amps[:,0]<0)*(amps[:,1]>0)), 0, amps[:,0])
             amps1 = np.where(((amps[:,0]<0)*(amps[:,1]>0)),
-                             self._p_matrix_inv[:,1,1]*self._q_vector[1,:],
+                             self._p_matrix_inv[lags,1,1]*self._q_vector[1,:],
                              amps[:,1])
             amps1 = np.where(((amps[:,0]<0)*(amps[:,1]>0)*(amps1<0)), 0, amps1)
 
@@ -521,7 +600,7 @@ class OF1x2:
             #set all the amps1 value to zero, where amp1 before transforming was negative. Only amps0 can move and amps1=0, if amps1 is negative
             amps1 = np.where( ((amps[:,1]<0)*(amps[:,0]>0)) ,0,amps1)
             amps0 = np.where( ((amps[:,1]<0)*(amps[:,0]>0)),
-                              self._p_matrix_inv[:,0,0]*self._q_vector[0,:],
+                              self._p_matrix_inv[lags,0,0]*self._q_vector[0,:],
                               amps0)
             amps0 = np.where( ((amps[:,1]<0)*(amps[:,0]>0)*(amps0<0)), 0, amps0)
 
@@ -545,16 +624,21 @@ class OF1x2:
 
 
         if(flag_polarity_constraints and method == 'hard'):
-            transformed_vector = np.einsum('nij,nj->ni',self._transformation_matrix, amps)
+            self._calc_transformation_matrix()
+            transformation_matrix = self._transformation_matrix[lags]
+            transformation_matrix_inv = self._transformation_matrix_inv[lags]
+            wedge_matrix = self._wedge_matrix[lags]
+
+            transformed_vector = np.einsum('nij,nj->ni',transformation_matrix, amps)
             dot_wedge_vectors_with_transformed_vector = np.einsum('...ij,...j->...i',
-                                                                  self._wedge_matrix.transpose(0,M,1),
+                                                                  wedge_matrix.transpose(0,M,1),
                                                                   transformed_vector)
             along_which_wedge_vector_index = np.argmin(
                 np.abs(dot_wedge_vectors_with_transformed_vector),
                 axis=1
             )
-            along_which_wedge_vector =  self._wedge_matrix.transpose(0,M,1)[
-                np.arange(len(self._wedge_matrix.transpose(0,M,1))),
+            along_which_wedge_vector =  wedge_matrix.transpose(0,M,1)[
+                np.arange(len(wedge_matrix.transpose(0,M,1))),
                 along_which_wedge_vector_index
             ]
             final_dot_wedge_vectors_with_transformed_vector = (
@@ -570,7 +654,7 @@ class OF1x2:
             )
 
             new_amps = np.einsum('nij,nj->ni',
-                                 self._transformation_matrix_inv,
+                                 transformation_matrix_inv,
                                  constrained_transformed_vector)
             
             negative_mask = np.any(amps<0,axis=1)
@@ -586,14 +670,17 @@ class OF1x2:
 
 
 
-    def _calc_chi2(self, amps1, amps2 ): 
+    def _calc_chi2(self, amps1, amps2, t0s=None): 
         """
         Hidden function to calculate the chi-square of the inputted
-        amplitude and time offsets.
+        amplitude and time offsets (default: all time combinations,
+        same as _calc_amps)
         """
 
         q_vector_conj = np.conjugate(self._q_vector)
-        t0s = self._time_combinations.copy()
+        if t0s is None:
+            t0s = self._time_combinations
+        lags = t0s[:,0] - t0s[:,1]
 
         # calculate chi2
         chi2 = (self._of_base._chisq0[self._channel]
@@ -601,10 +688,10 @@ class OF1x2:
                 - q_vector_conj[1,:] * amps2
                 - self._q_vector[0,:] * amps1
                 - self._q_vector[1,:] * amps2 
-                + self._p_matrix[t0s[:,0] - t0s[:,1]][:, 0, 0]* amps1* amps1
-                + self._p_matrix[t0s[:,0]- t0s[:,1]][:, 1, 1]* amps2* amps2
-                + amps1*amps2*self._p_matrix[t0s[:,0] - t0s[:,1]][:, 0, 1]
-                + amps1*amps2*self._p_matrix[t0s[:,0] - t0s[:,1]][:, 1, 0])
+                + self._p_matrix[lags, 0, 0]* amps1* amps1
+                + self._p_matrix[lags, 1, 1]* amps2* amps2
+                + amps1*amps2*self._p_matrix[lags, 0, 1]
+                + amps1*amps2*self._p_matrix[lags, 1, 0])
 
         return chi2 
 
@@ -109,6 +109,7 @@ class  OF1x3:
         self._transformation_matrix_inv  = None
         self._wedge_matrix  = None
         self._time_combinations = None
+        self._fit_window = None
 
         
         # intialize signal related parameters
@@ -220,7 +221,11 @@ class  OF1x3:
 
 
         # calculate p matrix
-        self._calc_p_matrix(fit_window)
+        self._calc_p_matrix()
+
+        # time combinations
+        if fit_window is not None:
+            self._calc_time_combinations(fit_window)
 
     
     def clear(self):
@@ -236,13 +241,43 @@ class  OF1x3:
         self._time_third_pulse = None
      
         
-    def calc(self, signal=None,fit_window = None, lgc_plot=False):
+    def calc(self, signal=None,fit_window = None, lgc_plot=False,
+             min_separation=None, block_size=100000, lgc_prune=True):
         """
         Runs the pileup optimum filter algorithm for 1 channel 2 pulses.
         Parameters
         ----------
         signal:  the raw data
         fit window: when the grid search is done, typically get this form back of the envelope calculation
+
+        min_separation : int, optional
+           If not None, ordered search: only time combinations
+           with t1 + min_separation <= t2 and t2 + min_separation
+           <= t3 (in samples), and t3 <= t1 + nbins - min_separation
+           (circular separation), are evaluated, generated in blocks
+           (fit_window not required, default = full trace for
+           the three pulses). The time combination with minimum
+           chi2 is returned.
+           Note: the ordered search uses the exact 3x3 least
+           squares amplitudes and chi2 (P matrix built from the
+           time differences of each combination). The default
+           search keeps the original per time lag P matrix inverse
+           model (minimum |chi2|), so amplitudes and chi2 of a
+           given time combination can differ between the two
+           searches.
+           Default: None (all combinations in fit_window)
+
+        block_size : int, optional
+           ordered search: maximum number of time combinations
+           evaluated at once
+           Default: 100000
+
+        lgc_prune : bool, optional
+           ordered search: branch-and-bound, skip (t1) and (t1,t2)
+           time combinations whose chi2 lower bound is larger than
+           the current minimum chi2 (same result as without pruning)
+           Default: True
+
         Returns
         -------
         None
@@ -259,8 +294,19 @@ class  OF1x3:
                                self._template_2_tag,
                                self._template_3_tag]
             )
+
+        # ordered search
+        if min_separation is not None:
+            self._calc_ordered(fit_window, min_separation, block_size,
+                               lgc_prune)
+            if lgc_plot:
+                self.plot()
+            return
+
         if fit_window is not None:
-           self._calc_p_matrix(fit_window)
+            if (self._fit_window is None
+                or not np.array_equal(fit_window, self._fit_window)):
+                self._calc_time_combinations(fit_window)
         else:
             raise ValueError('ERROR in OF1x3: fit_window required cannot handle such big matrices!')
 
@@ -391,9 +437,11 @@ class  OF1x3:
         fig.tight_layout()
 
 
-    def _calc_p_matrix(self, fit_window):
+    def _calc_p_matrix(self):
         """
-        calc p matrix
+        calc p matrix and its inverse per time lag
+        (nbins entries, indexed by time difference
+        between pulses)
         """
 
         # get optimal filter and template ffts
@@ -426,60 +474,278 @@ class  OF1x3:
             p[:, i, i] = norms[i]
             for j in range(i+1,M):
                 p[:, i, j] = p[:, j, i] = (
-                    np.real(np.fft.ifft(template_ffts[j] * phis[i]) * self._fs)
+                    self._of_base._ifft_real(template_ffts[j] * phis[i]) * self._fs
                 )
               
         p_inv = np.linalg.pinv(p)
 
-        # time combination
-        if fit_window is  None:
-            time_combinations1 = np.arange(int(-nbins/2), int(nbins/2))
-            time_combinations2 = np.arange(int(-nbins/2), int(nbins/2))
-            time_combinations3 = np.arange(int(-nbins/2), int(nbins/2))
-        else:
-            time_combinations1 = np.arange(int(fit_window[0][0]), int(fit_window[0][1]))
-            time_combinations2 = np.arange(int(fit_window[1][0]), int(fit_window[1][1]))
-            time_combinations3 = np.arange(int(fit_window[2][0]), int(fit_window[2][1]))
+        # symmetric (same as upper triangle)
+        for i in range(M):
+            for j in range(i+1,M):
+                p_inv[:, j, i] = p_inv[:, i, j]
+
+        self._p_matrix = p
+        self._p_matrix_inv = p_inv
+
+
+    def _calc_time_combinations(self, fit_window):
+        """
+        calc time combinations
+        """
+
+        time_combinations1 = np.arange(int(fit_window[0][0]), int(fit_window[0][1]))
+        time_combinations2 = np.arange(int(fit_window[1][0]), int(fit_window[1][1]))
+        time_combinations3 = np.arange(int(fit_window[2][0]), int(fit_window[2][1]))
 
-                   
         self._time_combinations = np.stack(
             np.meshgrid(time_combinations1,
                         time_combinations2,
-                        time_combinations3), -1).reshape(-1, M)
+                        time_combinations3), -1).reshape(-1, 3)
 
-        t0s = self._time_combinations
+        self._fit_window = np.array(fit_window)
 
-        # calculate p matrix inv with time constraints
-        p_matrix_inv   = np.zeros((t0s[:,0].shape[0], M, M ))
-        np.einsum('jii->ji', p_matrix_inv )[:] = 1
 
-        for i in range(M):
-            if i ==  M-1:
-                p_matrix_inv[:, i, i] = (
-                    p_inv[t0s[:,i]-t0s[:,0]][:, i, i]
-                )
-            else:
-                p_matrix_inv[:, i, i] = (
-                    p_inv[t0s[:,i]-t0s[:,i+1]][:, i, i]
+    def _get_p_matrix_inv_lags(self, t0s, i, j):
+        """
+        Time lags used to index the (i,j) element of the
+        p matrix inverse for each time combination (with
+        time constraints)
+        """
+
+        M = t0s.shape[1]
+
+        if i == j:
+            return t0s[:, i] - t0s[:, (i+1) % M]
+
+        return t0s[:, min(i, j)] - t0s[:, max(i, j)]
+
+
+    def _calc_ordered(self, fit_window, min_separation, block_size,
+                      lgc_prune):
+        """
+        Ordered search (t1 <= t2 <= t3 with minimum separation,
+        including circular separation between t3 and t1):
+        time combinations are generated lazily, in blocks of up to
+        "block_size" combinations, for each t1 (t2 rows of t3 values
+        are split across blocks).
+        Amplitudes are the least squares solution with p matrix
+        P_ij = p[t_i-t_j][i,j] (p matrix per time lag).
+
+        With branch-and-bound pruning, t1 values are processed by
+        increasing chi2 lower bound and t1 / (t1, t2) values with
+        lower bound larger than the current minimum chi2 are skipped.
+        With R the normalized p matrix and q_i' = q_i/sqrt(P_ii):
+        chi2 = chi2_0 - q.P^-1.q >= chi2_0 - |q'|^2/lambda_min(R),
+        lambda_min(R) >= 1 - max_i sum_j!=i |R_ij| (Gershgorin),
+        with |R_ij| and |q_i| bounded by their maximum over the
+        remaining time lags / pulse times. No pruning if templates
+        are too correlated (lambda_min lower bound <= 0).
+        """
+
+        if min_separation < 0:
+            raise ValueError('ERROR: "min_separation" should be >= 0!')
+
+        if block_size < 1:
+            raise ValueError('ERROR: "block_size" should be >= 1!')
+
+        M = 3
+        nbins = self._of_base.nb_samples()
+        sep = int(min_separation)
+        p = self._p_matrix
+        norms = np.einsum('ii->i', p[0]).copy()
+
+        # time windows (default full trace)
+        if fit_window is None:
+            fit_window = [[int(-nbins/2), int(nbins/2)]]*M
+        windows = [np.arange(int(window[0]), int(window[1]))
+                   for window in fit_window]
+
+        # normalized q vector (all times) within windows, and
+        # maximum absolute value for t >= t_i
+        q = self._get_q_vector_allt()
+        q_norm = [np.abs(q[i][windows[i]])/np.sqrt(norms[i])
+                  for i in range(M)]
+        q_norm_max = [np.maximum.accumulate(val[::-1])[::-1]
+                      for val in q_norm]
+
+        def _max_after(i, tmin):
+            # -1 if no time t >= tmin in window
+            ind = np.searchsorted(windows[i], tmin)
+            return np.where(ind < len(windows[i]),
+                            q_norm_max[i][np.minimum(ind, len(windows[i])-1)],
+                            -1)
+
+        chisq0 = np.real(self._of_base._chisq0[self._channel])
+
+        # maximum normalized p matrix elements |R_ij| (i < j)
+        # over allowed time lags t_i - t_j
+        corr_max = np.zeros((M, M))
+        if lgc_prune:
+            for i in range(M):
+                for j in range(i+1, M):
+                    lag_min = max(windows[i][0] - windows[j][-1],
+                                  -(nbins - sep*(M-j+i)))
+                    lag_max = min(windows[i][-1] - windows[j][0],
+                                  -sep*(j-i))
+                    if lag_max >= lag_min:
+                        lags = np.arange(lag_min, lag_max+1) % nbins
+                        corr_max[i, j] = corr_max[j, i] = np.max(
+                            np.abs(p[lags, i, j])
+                        )/np.sqrt(norms[i]*norms[j])
+
+        def _lower_bound(q_vec, corr_01):
+            # q_vec [n, M]: upper bound |q'| / corr_01 [n]: |R_01|
+            if not lgc_prune:
+                return np.full(q_vec.shape[0], -np.inf)
+            row_sums = np.max(np.column_stack((
+                corr_01 + corr_max[0, 2],
+                corr_01 + corr_max[1, 2],
+                np.full(len(corr_01), corr_max[0, 2] + corr_max[1, 2])
+            )), axis=1)
+            eigenvalue_min = 1 - row_sums
+            with np.errstate(divide='ignore'):
+                return np.where(
+                    eigenvalue_min > 0,
+                    chisq0 - np.sum(q_vec**2, axis=1)/eigenvalue_min,
+                    -np.inf
                 )
-           
-            for j in range(i+1,M):
-                p_matrix_inv[:, i, j] = p_matrix_inv[:, j, i] =  (
-                    p_inv[t0s[:,i] - t0s[:,j]][:, i, j]
+
+        # best fit
+        best_chi2 = np.inf
+        best_t0s = None
+        best_amps = None
+
+        # t1 values (best lower bound first)
+        q2_max = _max_after(1, windows[0] + sep)
+        q3_max = _max_after(2, windows[0] + 2*sep)
+        valid = (q2_max >= 0) & (q3_max >= 0)
+        it1s = np.flatnonzero(valid)
+        lower_bounds_t1 = _lower_bound(
+            np.column_stack((q_norm[0][it1s], q2_max[it1s], q3_max[it1s])),
+            np.full(len(it1s), corr_max[0, 1])
+        )
+        order = np.argsort(lower_bounds_t1, kind='stable')
+
+        for ind in order:
+
+            if lower_bounds_t1[ind] >= best_chi2:
+                break
+
+            it1 = it1s[ind]
+            t1 = windows[0][it1]
+
+            # t2 values with at least one t3
+            it3_end = np.searchsorted(windows[2], t1 + nbins - sep,
+                                      side='right')
+            it2s = np.arange(np.searchsorted(windows[1], t1 + sep),
+                             len(windows[1]))
+            it3_start = np.searchsorted(windows[2], windows[1][it2s] + sep)
+            valid = it3_start < it3_end
+            it2s = it2s[valid]
+            it3_start = it3_start[valid]
+
+            corr_01 = (np.abs(p[(t1 - windows[1][it2s]) % nbins, 0, 1])
+                       / np.sqrt(norms[0]*norms[1]))
+            lower_bounds_t2 = _lower_bound(
+                np.column_stack((np.full(len(it2s), q_norm[0][it1]),
+                                 q_norm[1][it2s],
+                                 q_norm_max[2][it3_start])),
+                corr_01
+            )
+
+            keep = lower_bounds_t2 < best_chi2
+            it2s = it2s[keep]
+            it3_start = it3_start[keep]
+            lower_bounds_t2 = lower_bounds_t2[keep]
+
+            if len(it2s) == 0:
+                continue
+
+            # blocks of at most block_size (t2, t3) combinations
+            # (flattened over t2 rows, rows can span several blocks)
+            counts = it3_end - it3_start
+            starts = np.cumsum(counts) - counts
+            ncombs = starts[-1] + counts[-1]
+
+            for first in range(0, int(ncombs), int(block_size)):
+
+                combs = np.arange(first, min(first + int(block_size), ncombs))
+                rows = np.searchsorted(starts, combs, side='right') - 1
+
+                keep = lower_bounds_t2[rows] < best_chi2
+                combs = combs[keep]
+                rows = rows[keep]
+                if len(rows) == 0:
+                    continue
+
+                t0s = np.column_stack((
+                    np.full(len(rows), t1),
+                    windows[1][it2s[rows]],
+                    windows[2][it3_start[rows] + combs - starts[rows]]
+                ))
+
+                amps, chi2s = self._calc_amps_chi2_lsq(t0s, q, chisq0)
+
+                min_index = np.argmin(chi2s)
+                if chi2s[min_index] < best_chi2:
+                    best_chi2 = chi2s[min_index]
+                    best_t0s = t0s[min_index]
+                    best_amps = amps[min_index]
+
+        if best_t0s is None:
+            raise ValueError('ERROR: No time combination allowed '
+                             '(check fit_window and min_separation)!')
+
+        # save results
+        self._chi2 = best_chi2
+        self._time_diff_two_pulses = (best_t0s[1]/self._fs
+                                      - best_t0s[0]/self._fs)
+        self._amplitude[self._template_1_tag] = best_amps[0]
+        self._amplitude[self._template_2_tag] = best_amps[1]
+        self._amplitude[self._template_3_tag] = best_amps[2]
+        self._time_first_pulse = best_t0s[0]
+        self._time_second_pulse = best_t0s[1]
+        self._time_third_pulse = best_t0s[2]
+
+
+    def _calc_amps_chi2_lsq(self, t0s, q, chisq0):
+        """
+        Hidden function to calculate least squares amplitudes
+        [ncombinations, M] and chi2 [ncombinations] for the
+        inputted time offsets, p matrix P_ij = p[t_i-t_j][i,j]
+        """
+
+        M = len(q)
+        nbins = self._p_matrix.shape[0]
+
+        q_vector = np.column_stack([q[i][t0s[:,i]] for i in range(M)])
+
+        p_matrix = np.zeros((t0s.shape[0], M, M))
+        for i in range(M):
+            p_matrix[:, i, i] = self._p_matrix[0, i, i]
+            for j in range(i+1, M):
+                p_matrix[:, i, j] = p_matrix[:, j, i] = (
+                    self._p_matrix[(t0s[:,i] - t0s[:,j]) % nbins, i, j]
                 )
-                
-        self._p_matrix = p
-        self._p_matrix_inv = p_matrix_inv
 
+        # pseudo-inverse if singular (such as time lags
+        # wrapping around)
+        try:
+            amps = np.linalg.solve(p_matrix,
+                                   q_vector[..., np.newaxis])[..., 0]
+        except np.linalg.LinAlgError:
+            amps = np.einsum('kij,kj->ki', np.linalg.pinv(p_matrix),
+                             q_vector)
+        chi2 = chisq0 - np.sum(q_vector*amps, axis=1)
 
-                
-    def _calc_amps(self): 
+        return amps, chi2
+
+
+    def _get_q_vector_allt(self):
         """
-        Hidden function to calculate the amplitudes that correspond to
-        the inputted time offsets.
+        Hidden function to calculate q vector for all times
         """
 
-        # calc q vector
         signal_filt_tds = [self._of_base.signal_filt_td(self._channel,
                                                         self._template_1_tag),
                            self._of_base.signal_filt_td(self._channel,
@@ -497,7 +763,18 @@ class  OF1x3:
              signal_filt_tds[1]*norms[1],
              signal_filt_tds[2]*norms[2]]
 
-        
+        return q
+
+
+    def _calc_amps(self): 
+        """
+        Hidden function to calculate the amplitudes that correspond to
+        the inputted time offsets.
+        """
+
+        # calc q vector
+        q = self._get_q_vector_allt()
+
         M = len(q)
         t0s = self._time_combinations
         self._q_vector = np.zeros((M, t0s[:,0].shape[0]))
@@ -509,7 +786,8 @@ class  OF1x3:
         amps  = np.zeros((t0s[:,0].shape[0], M))
         for i in range(M):
             for j in range(M):
-                amps[:,i] = amps[:,i]  + self._p_matrix_inv[:,i,j]*self._q_vector[j,:]
+                lags = self._get_p_matrix_inv_lags(t0s, i, j)
+                amps[:,i] = amps[:,i]  + self._p_matrix_inv[lags,i,j]*self._q_vector[j,:]
                 
         return amps[:,0],amps[:,1],amps[:,2]
 
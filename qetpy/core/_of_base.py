@@ -1,8 +1,10 @@
 import numpy as np
 from math import ceil, floor
+from multiprocessing import shared_memory
 from qetpy.utils import shift, interpolate_of, argmin_chisq
-from qetpy.utils import fft, ifft, fftfreq, rfftfreq
+from qetpy.utils import fft, ifft, rfft, irfft, fftfreq, rfftfreq, invert_csd
 from qetpy.utils import convert_channel_name_to_list, convert_channel_list_to_name
+from qetpy.core._of_cache import OFCache
 from numpy.linalg import pinv as pinv
 import time
 import copy
@@ -10,6 +12,19 @@ import uuid
 
 __all__ = ['OFBase']
 
+
+# signal dependent (reset by clear_signal) or process
+# specific attributes, not exported by export_shared()
+_SHARED_EXCLUDED_ATTRIBUTES = ['_signals', '_signals_fft',
+                               '_signals_filts', '_signals_filts_td',
+                               '_template_filts', '_template_filts_td',
+                               '_chisq0', '_chisqs_alltimes_rolled',
+                               '_amps_alltimes_rolled', '_workspaces',
+                               '_shared_buffers']
+
+# shared arrays alignment (bytes)
+_SHARED_ALIGNMENT = 64
+
 class OFBase:
     """
     Multiple channels - multiple templates optimal filter base class.
@@ -20,7 +35,10 @@ class OFBase:
 
     """
     def __init__(self, sample_rate,
-                 verbose=True):
+                 verbose=True,
+                 lgc_rfft=False,
+                 lgc_workspace=False,
+                 cache=None):
         """
         Initialization of the optimum filter base class
 
@@ -34,6 +52,33 @@ class OFBase:
             Display information
             Default=True
 
+        lgc_rfft : bool, optional
+            If True, use real FFT (rfft/irfft): template FFTs,
+            psd, optimal filters and signal FFTs are stored
+            for the non-negative frequencies only (one-sided
+            arrays, not folded). Only single channel
+            algorithms (1x1, 1x2, 1x3) are available in
+            this mode.
+            Default=False
+
+        lgc_workspace : bool, optional
+            If True, the single channel signal FFT, filtered
+            signal (frequency and time domain) and rolled
+            chisq/amp arrays are written in place in
+            per-channel/per-tag arrays allocated once and
+            reused for each event. Arrays returned by
+            signal_fft(), signal_filt(), signal_filt_td() are
+            then overwritten by the next update_signal()
+            call (copy if needed).
+            Default=False
+
+        cache : OFCache object or str, optional
+            On-disk cache (or cache directory) used to store
+            and reload the NxM pre-calculations (inverted csd,
+            phi matrix, weight matrix, p matrices), keyed
+            by a hash of their inputs
+            Default=None (no cache)
+
 
         Return
         ------
@@ -43,6 +88,13 @@ class OFBase:
         self._debug = False
         self._verbose = verbose
         self._fs = sample_rate
+        self._lgc_rfft = lgc_rfft
+        self._lgc_workspace = lgc_workspace
+
+        # on-disk pre-calculations cache
+        self._cache = cache
+        if isinstance(cache, str):
+            self._cache = OFCache(cache, verbose=verbose)
 
         # initialize frequency spacing of FFT and frequencies
         self._df = None
@@ -82,6 +134,12 @@ class OFBase:
         self._iw_matrix = dict()
         self._p_matrix  = dict()
         self._p_matrix_inv  = dict()
+
+        # NxMx2 p matrix and its inverse per time lag
+        # (t1-t2) [nbins, ntmps, ntmps]
+        # dict key = channel name, matrix tag, time tags
+        self._p_matrix_lags = dict()
+        self._p_matrix_inv_lags = dict()
       
         # initialize signal
         self._signals = dict()
@@ -105,6 +163,16 @@ class OFBase:
         self._chisqs_alltimes_rolled = dict() # chisq all times
         self._amps_alltimes_rolled = dict() # amps all times
 
+        # preallocated arrays (if lgc_workspace=True),
+        # not cleared by clear_signal()
+        # dict key = channel, then array name, then template tag
+        self._workspaces = dict()
+
+        # shared memory blocks / memory-mapped files
+        # (export_shared() or attach_shared())
+        # dict key = shared memory name or file name
+        self._shared_buffers = dict()
+
 
     @property
     def verbose(self):
@@ -114,6 +182,17 @@ class OFBase:
     def sample_rate(self):
         return self._fs
 
+    @property
+    def lgc_rfft(self):
+        return self._lgc_rfft
+
+    @property
+    def cache(self):
+        return self._cache
+
+    @property
+    def lgc_workspace(self):
+        return self._lgc_workspace
 
     def nb_samples(self):
         """
@@ -651,6 +730,34 @@ class OFBase:
         return self._p_matrix[channel_name][matrix_tag][constraints_tag]
 
 
+    def p_matrix_lags(self, channels,
+                      template_tags,
+                      template_time_tags):
+        """
+        Get NxMx2 p_matrix for each time lag (t1-t2),
+        (see calc_p_matrix_lags)
+
+        dim: [nbins, ntmps, ntmps]
+        """
+
+        return self._get_p_matrix_lags(self._p_matrix_lags, channels,
+                                       template_tags, template_time_tags)
+
+
+    def p_matrix_inv_lags(self, channels,
+                          template_tags,
+                          template_time_tags):
+        """
+        Get NxMx2 p_matrix INVERTED for each time lag (t1-t2),
+        (see calc_p_matrix_lags)
+
+        dim: [nbins, ntmps, ntmps]
+        """
+
+        return self._get_p_matrix_lags(self._p_matrix_inv_lags, channels,
+                                       template_tags, template_time_tags)
+
+
 
     
  
@@ -871,18 +978,9 @@ class OFBase:
         """
                 
         # time constraints
-        time_combinations1 = None
-        time_combinations2 = None
-        if fit_window is None:
-            time_combinations1 = np.arange(int(-self._nbins/2),
-                                           int(self._nbins/2))
-            time_combinations2 = np.arange(int(-self._nbins/2),
-                                           int(self._nbins/2))
-        else:
-            time_combinations1 = np.arange(int(fit_window[0][0]),
-                                           int(fit_window[0][1]))
-            time_combinations2 = np.arange(int(fit_window[1][0]),
-                                           int(fit_window[1][1]))
+        time_combinations1, time_combinations2 = (
+            self._get_fit_window_ranges(fit_window)
+        )
 
         time_combinations = None
         if restrict_time_flag:
@@ -900,6 +998,249 @@ class OFBase:
         return time_combinations
 
 
+    def iterate_time_combinations(self,
+                                  fit_window,
+                                  restrict_time_flag,
+                                  block_size):
+        """
+        Generator of OF NxMx2 time combinations in blocks, same
+        combinations and same order as calc_time_combinations
+        without building the full array
+
+        Parameters
+        ----------
+
+        fit_window :   array-likein integer
+           used for preparing the time window for nxmx2 fit
+           in samples. Ex:  [[-625,625],[-625,1250]]
+
+        restrict_time_flag : bool
+           if True, only combinations with t1 <= t2
+
+        block_size : int
+           maximum number of combinations per block (at least
+           one full row of t1 values)
+
+
+        Return
+        ------
+
+        time_combinations : 2D ndarray [<=block_size, 2]
+           (yield) block of time combinations
+
+        """
+
+        time_combinations1, time_combinations2 = (
+            self._get_fit_window_ranges(fit_window)
+        )
+
+        # blocks of t2 values (t1 varies faster)
+        nrows = max(int(block_size) // max(len(time_combinations1), 1), 1)
+
+        for irow in range(0, len(time_combinations2), nrows):
+
+            X, Y = np.meshgrid(time_combinations1,
+                               time_combinations2[irow:irow+nrows])
+
+            if restrict_time_flag:
+                mask = X <= Y
+                time_combinations = np.column_stack((X[mask], Y[mask]))
+            else:
+                time_combinations = np.column_stack((X.ravel(), Y.ravel()))
+
+            if time_combinations.shape[0] > 0:
+                yield time_combinations
+
+
+    def count_time_combinations(self,
+                                fit_window,
+                                restrict_time_flag):
+        """
+        Number of OF NxMx2 time combinations (same as
+        calc_time_combinations) without building them
+
+        Parameters
+        ----------
+
+        fit_window :   array-likein integer
+           used for preparing the time window for nxmx2 fit
+           in samples. Ex:  [[-625,625],[-625,1250]]
+
+        restrict_time_flag : bool
+           if True, only combinations with t1 <= t2
+
+
+        Return
+        ------
+
+        nb_combinations : int
+
+        """
+
+        time_combinations1, time_combinations2 = (
+            self._get_fit_window_ranges(fit_window)
+        )
+
+        if not restrict_time_flag:
+            return len(time_combinations1) * len(time_combinations2)
+
+        # number of t2 >= t1 for each t1 (ranges are sorted)
+        nb_before = np.searchsorted(time_combinations2,
+                                    time_combinations1, side='left')
+
+        return int(np.sum(len(time_combinations2) - nb_before))
+
+
+    def calc_time_combinations_coarse(self,
+                                      fit_window,
+                                      restrict_time_flag,
+                                      decimation):
+        """
+        Calc OF NxMx2 (or 1x2) time combinations on a decimated
+        grid (every "decimation" samples from the start of the fit
+        window), same order as calc_time_combinations. Used for the
+        coarse step of the coarse-to-fine search.
+
+        Parameters
+        ----------
+
+        fit_window :   array-likein integer
+           used for preparing the time window for nxmx2 fit
+           in samples. Ex:  [[-625,625],[-625,1250]]
+
+        restrict_time_flag : bool
+           if True, only combinations with t1 <= t2
+
+        decimation : int
+           grid step in samples
+
+
+        Return
+        ------
+
+        time_combinations : 2D ndarray [ncombinations, 2]
+
+        """
+
+        time_combinations1, time_combinations2 = (
+            self._get_fit_window_ranges(fit_window)
+        )
+
+        X, Y = np.meshgrid(time_combinations1[::int(decimation)],
+                           time_combinations2[::int(decimation)])
+
+        if restrict_time_flag:
+            mask = X <= Y
+            return np.column_stack((X[mask], Y[mask]))
+
+        return np.column_stack((X.ravel(), Y.ravel()))
+
+
+    def calc_time_combinations_refined(self,
+                                       time_combinations,
+                                       fit_window,
+                                       restrict_time_flag,
+                                       radius):
+        """
+        Calc OF NxMx2 (or 1x2) time combinations in the neighbourhood
+        (+/- radius samples for both delays) of the specified time
+        combinations, within the fit window, without duplicates and
+        in the same order as calc_time_combinations. Used for the
+        refinement step of the coarse-to-fine search.
+
+        Parameters
+        ----------
+
+        time_combinations : 2D ndarray [ncandidates, 2]
+           candidate time combinations (t1, t2)
+
+        fit_window :   array-likein integer
+           used for preparing the time window for nxmx2 fit
+           in samples. Ex:  [[-625,625],[-625,1250]]
+
+        restrict_time_flag : bool
+           if True, only combinations with t1 <= t2
+
+        radius : int
+           neighbourhood size in samples
+
+
+        Return
+        ------
+
+        time_combinations : 2D ndarray [ncombinations, 2]
+
+        """
+
+        time_combinations1, time_combinations2 = (
+            self._get_fit_window_ranges(fit_window)
+        )
+
+        offsets = np.arange(-int(radius), int(radius)+1)
+        t1s = (time_combinations[:, 0, np.newaxis, np.newaxis]
+               + offsets[np.newaxis, np.newaxis, :])
+        t2s = (time_combinations[:, 1, np.newaxis, np.newaxis]
+               + offsets[np.newaxis, :, np.newaxis])
+        t1s, t2s = np.broadcast_arrays(t1s, t2s)
+        t1s = t1s.ravel()
+        t2s = t2s.ravel()
+
+        mask = ((t1s >= time_combinations1[0])
+                & (t1s <= time_combinations1[-1])
+                & (t2s >= time_combinations2[0])
+                & (t2s <= time_combinations2[-1]))
+        if restrict_time_flag:
+            mask &= t1s <= t2s
+
+        # unique, ordered by t2 then t1
+        nb1 = len(time_combinations1)
+        keys = np.unique((t2s[mask] - time_combinations2[0]) * nb1
+                         + (t1s[mask] - time_combinations1[0]))
+
+        return np.column_stack((keys % nb1 + time_combinations1[0],
+                                keys // nb1 + time_combinations2[0]))
+
+
+    @staticmethod
+    def select_time_candidates(chi2, nb_candidates, chi2_tolerance=None):
+        """
+        Select candidates of the coarse-to-fine search: the
+        "nb_candidates" lowest chi2 and, if "chi2_tolerance" is not
+        None, all chi2 within chi2_tolerance of the minimum
+
+        Parameters
+        ----------
+
+        chi2 : 1D ndarray
+           chi2 of the coarse time combinations
+
+        nb_candidates : int
+           minimum number of candidates
+
+        chi2_tolerance : float, optional
+           chi2 tolerance (np.inf = all coarse combinations)
+           Default: None
+
+
+        Return
+        ------
+
+        inds : 1D ndarray
+          indices of the candidates (sorted)
+
+        """
+
+        nb_candidates = min(max(int(nb_candidates), 1), len(chi2))
+
+        mask = np.zeros(len(chi2), dtype=bool)
+        mask[np.argpartition(chi2, nb_candidates-1)[:nb_candidates]] = True
+
+        if chi2_tolerance is not None:
+            mask |= chi2 <= np.min(chi2) + chi2_tolerance
+
+        return np.flatnonzero(mask)
+
+
 
     
     def add_template(self, channel, template,
@@ -986,7 +1327,7 @@ class OFBase:
 
 
         # FFT
-        self._fft_freqs, template_fft = fft(template, self._fs, axis=-1)
+        self._fft_freqs, template_fft = self._fft(template)
         if integralnorm:
             template_fft /= template_fft[0]
 
@@ -1151,6 +1492,11 @@ class OFBase:
         None
 
         """
+
+        # multiple channels algorithms not available with rfft
+        if self._lgc_rfft:
+            raise ValueError('ERROR: Multiple channels OF not available '
+                             'with "lgc_rfft=True"!')
         
         # convert to string if needed (if str, return same string)
         channel_name = convert_channel_list_to_name(channels)
@@ -1184,7 +1530,8 @@ class OFBase:
           channel name
 
         psd : ndarray
-           psd 1d array
+           psd 1d array (two-sided). If "lgc_rfft" is True, 
+           only the non-negative frequencies are stored.
 
         coupling : str, optional [default='AC']
             String that determines if the zero frequency bin of the psd
@@ -1215,6 +1562,10 @@ class OFBase:
                 f'psd/template with same tag must have same '
                 f'number of samples!')
 
+        # one-sided
+        if self._lgc_rfft:
+            psd = psd[:nbins//2+1]
+        
         # add to dictionary
         self._psd[channel] = psd
 
@@ -1270,7 +1621,9 @@ class OFBase:
 
         signal : ndarray
            the signal that we want to apply the optimum filter to
-           (units should be Amps).
+           (units should be Amps). Either a single trace [nbins]
+           or a batch of traces [nevents, nbins], in which case
+           all calculations are done for all events at once
 
         calc_signal_filt : bool, optional
            If true calculate signal filt for tags specified with "template_tags" or
@@ -1317,8 +1670,15 @@ class OFBase:
         self._signals[channel] = signal
 
         # FFT
-        f, signal_fft = fft(signal, self._fs, axis=-1)
-        self._signals_fft[channel] = signal_fft/self._nbins/self._df
+        if self._lgc_workspace:
+            f, signal_fft = self._fft(signal, name='signal_fft',
+                                      channel=channel)
+            signal_fft /= self._nbins
+            signal_fft /= self._df
+            self._signals_fft[channel] = signal_fft
+        else:
+            f, signal_fft = self._fft(signal)
+            self._signals_fft[channel] = signal_fft/self._nbins/self._df
 
         if calc_signal_filt or calc_signal_filt_td:
 
@@ -1502,8 +1862,9 @@ class OFBase:
 
             # calculate norm
             self._norms[channel][tag] = (
-                np.real(np.dot(self._phis[channel][tag],
-                               self._templates_fft[channel][tag]))*self._df
+                np.real(self._sum_freqs(self._phis[channel][tag]
+                                        * self._templates_fft[channel][tag]))
+                * self._df
             )
 
 
@@ -1580,12 +1941,21 @@ class OFBase:
             # calculate
             template_fft = self._templates_fft[channel_name][matrix_tag]
             temp_icovf = self._icovf[channel_name]
+
+            cache_key, cached = self._cache_load('phi_matrix',
+                                                 template_fft,
+                                                 temp_icovf)
+            if cached is not None:
+                self._phis[channel_name][matrix_tag] = cached['phi']
+                continue
                 
             self._phis[channel_name][matrix_tag] = (
                 np.array([(template_fft[:,:,jnu].T).conjugate()
                           @ temp_icovf[:,:,jnu] for jnu in range(self._nbins)
-                ], dtype='complex_')
+                ], dtype='complex128')
             )
+            self._cache_save(cache_key,
+                             phi=self._phis[channel_name][matrix_tag])
 
         
     def calc_weight_matrix(self, channels, template_tags=None):
@@ -1643,10 +2013,24 @@ class OFBase:
                 or matrix_tag not in self._phis[channel_name]):
                 self.calc_phi_matrix(channel_name, tags)
 
+            # initialize
+            if channel_name not in self._iw_matrix:
+                self._iw_matrix[channel_name] = dict()
+
             # calculate weigth matrix
-            temp_w = np.zeros((ntmps, ntmps), dtype='complex_')
+            temp_w = np.zeros((ntmps, ntmps), dtype='complex128')
             temp_phi_mat = self._phis[channel_name][matrix_tag]
             temp_templ_fft = self._templates_fft[channel_name][matrix_tag]
+
+            cache_key, cached = self._cache_load('iw_matrix',
+                                                 temp_phi_mat,
+                                                 temp_templ_fft)
+            if cached is not None:
+                self._iw_matrix[channel_name][matrix_tag] = (
+                    cached['iw_matrix']
+                )
+                continue
+            
             for itmp in range(ntmps):
                 for jtmp in range(ntmps):
                     for jchan in range(nchans):
@@ -1657,10 +2041,9 @@ class OFBase:
             temp_w = np.real(temp_w)
 
             # store
-            if channel_name not in self._iw_matrix:
-                self._iw_matrix[channel_name] = dict()
-            
             self._iw_matrix[channel_name][matrix_tag] = pinv(temp_w)
+            self._cache_save(cache_key,
+                             iw_matrix=self._iw_matrix[channel_name][matrix_tag])
 
 
             
@@ -1772,51 +2155,21 @@ class OFBase:
                 t0s = constraints['time_combinations']
                 template_time_tags = constraints['template_time_tags']
 
-                # calculate 
-                time_diff_mat = np.zeros((template_time_tags.shape[0] ,
-                                          template_time_tags.shape[0] ))
-                for i in range(template_time_tags.shape[0]):
-                    for j in range(template_time_tags.shape[0]):
-                        time_diff_mat[i,j] = (template_time_tags[i]
-                                              -template_time_tags[j])
-
-                p = np.zeros((self._nbins, ntmps, ntmps ), dtype='complex_')
-                np.einsum('jii->ji', p)[:] = 1
-                for itmp in range(ntmps):
-                    for jtmp in range(ntmps):
-                        sum = 0.0 + 0.0j
-                        for jchan in range(nchans):
-                            if (time_diff_mat[itmp, jtmp] != 0):
-                                sum += np.fft.ifft(
-                                    phi_mat[:,itmp, jchan]\
-                                    * template_fft_mat[jchan,jtmp,:]
-                                )*self._nbins
-                            if (time_diff_mat[itmp,jtmp] == 0):
-                                sum += np.sum(
-                                    phi_mat[:,itmp,jchan]\
-                                    * template_fft_mat[jchan,jtmp,:]
-                                )
-                                
-                        if (jtmp >= itmp):
-                            p[:,itmp,jtmp] = p[:,jtmp,itmp] = np.real(sum)
-
-                p_inv = np.linalg.pinv(p)
-
-                # add constraint
-                p_matrix =  np.zeros((t0s[:,0].shape[0], ntmps, ntmps))
-                p_matrix_inv =  np.zeros((t0s[:,0].shape[0], ntmps, ntmps))
-                        
-                np.einsum('jii->ji', p_matrix_inv)[:] = 1
-
-                for itmps in range(ntmps):
-                    for jtmps in range(ntmps):
-                        p_matrix[:, itmps, jtmps] = (
-                            p[t0s[:,0]-t0s[:,1]][:, itmps, jtmps]
-                        )
-                        p_matrix_inv[:, itmps, jtmps] = (
-                            p_inv[t0s[:,0]- t0s[:,1]][:, itmps, jtmps]
-                        )
-
+                # check cache
+                cache_key, cached = self._cache_load('p_matrix',
+                                                     phi_mat,
+                                                     template_fft_mat,
+                                                     template_time_tags,
+                                                     t0s)
+                if cached is not None:
+                    p_matrix = cached['p_matrix']
+                    p_matrix_inv = cached['p_matrix_inv']
+                else:
+                    p_matrix, p_matrix_inv = self._calc_p_matrix_constraints(
+                        phi_mat, template_fft_mat,
+                        template_time_tags, t0s)
+                    self._cache_save(cache_key, p_matrix=p_matrix,
+                                     p_matrix_inv=p_matrix_inv)
                         
                 # save
                 if channel_name not in self._p_matrix:
@@ -1840,6 +2193,94 @@ class OFBase:
                 
 
                 
+    def calc_p_matrix_lags(self, channels,
+                           template_tags,
+                           template_time_tags):
+        """
+        P matrix calculation for NxMx2 for each time lag (t1-t2)
+        instead of each time combination (the p matrix only depends
+        on the time difference between the 2 delays). Used by the
+        NxMx2 tiled time combinations search.
+
+        Parameters
+        ----------
+
+        channels : str or array-like
+                array-like or  "|" separated string
+                such as "channel1|channel2"
+
+        template_tags : 2D numpy array
+            template tags  [nchans, ntmps]
+
+        template_time_tags : 1D numpy array
+             time tage used for multi-template array with each having
+             2 time degree of freedom, Ex [0,1,0,0] -> 1st,3rd, 4th template
+             move together
+
+        Return
+        ------
+        None
+
+        """
+
+        # convert to name/list
+        channel_list = convert_channel_name_to_list(channels)
+        channel_name = convert_channel_list_to_name(channels)
+
+        # check template tags
+        if (not isinstance(template_tags, np.ndarray)
+            or  template_tags.ndim != 2):
+            raise ValueError('ERROR: Expecting "template_tags" '
+                             'to be a (2D) numpy array')
+
+        if template_tags.shape[0] != len(channel_list):
+            raise ValueError('ERROR: Wrong number of channels for '
+                             '"template_tags" argument!')
+
+        # check if already available!
+        if self.p_matrix_lags(channel_name, template_tags,
+                              template_time_tags) is not None:
+            return
+
+        # matrix tag
+        matrix_tag = self._get_template_matrix_tag(
+            channel_name, template_tags
+        )
+
+        # calculate optimal filter matrix if needed
+        if (channel_name not in self._phis
+            or matrix_tag not in self._phis[channel_name]):
+            self.calc_phi_matrix(channel_name, template_tags)
+
+        phi_mat = self._phis[channel_name][matrix_tag]
+
+        # template mat
+        template_fft_mat = self.template_fft(channel_name, template_tags)
+
+        # check cache
+        template_time_tags = np.asarray(template_time_tags)
+        cache_key, cached = self._cache_load('p_matrix_lags',
+                                             phi_mat,
+                                             template_fft_mat,
+                                             template_time_tags)
+        if cached is not None:
+            p, p_inv = cached['p_matrix'], cached['p_matrix_inv']
+        else:
+            p, p_inv = self._calc_p_matrix_lags(
+                phi_mat, template_fft_mat, template_time_tags)
+            self._cache_save(cache_key, p_matrix=p, p_matrix_inv=p_inv)
+
+        # save
+        time_tag = self._get_time_tags_tag(template_time_tags)
+        for store, val in [(self._p_matrix_lags, p),
+                           (self._p_matrix_inv_lags, p_inv)]:
+            if channel_name not in store:
+                store[channel_name] = dict()
+            if matrix_tag not in store[channel_name]:
+                store[channel_name][matrix_tag] = dict()
+            store[channel_name][matrix_tag][time_tag] = val
+
+
     def calc_icovf(self, channels, coupling='AC'):
         """
         A function that inverts the csd or covariance noise matrix between channels. 
@@ -1867,19 +2308,26 @@ class OFBase:
         
         # convert to name/list
         channel_name = convert_channel_list_to_name(channels)
+
+        # check cache
+        cache_key, cached = self._cache_load('icovf',
+                                             self.csd(channel_name),
+                                             coupling)
+        if cached is not None:
+            self._icovf[channel_name] = cached['icovf']
+            return
         
         #I should add lines that make sure csd is instantiated first
         covf = np.copy(self.csd(channel_name)) #an ndarray for a combination of channels
         covf *= self._df #[A^2/Hz] -> [A^2]
 
-        temp_icovf = np.zeros_like(covf, dtype='complex')
-        for ii in range(self._nbins):
-            temp_icovf[:,:,ii] = pinv(covf[:,:,ii]) #1/A^2
+        temp_icovf = invert_csd(covf, method='pinv') #1/A^2
 
         if coupling == 'AC':
             temp_icovf[:,:,0] = 0.0
             
         self._icovf[channel_name] = temp_icovf
+        self._cache_save(cache_key, icovf=temp_icovf)
         
         
     def calc_signal_filt(self, channel, template_tags=None):
@@ -1926,9 +2374,20 @@ class OFBase:
 
             # filtered signal
             norm = self._norms[channel][tag]
-            self._signals_filts[channel][tag] = (
-                self._phis[channel][tag] * self._signals_fft[channel] / norm
-            )
+            if self._lgc_workspace:
+                signal_filt = self._get_workspace(
+                    'signal_filt', channel, tag,
+                    self._signals_fft[channel].shape, np.complex128
+                )
+                np.multiply(self._phis[channel][tag],
+                            self._signals_fft[channel],
+                            out=signal_filt)
+                signal_filt /= norm
+                self._signals_filts[channel][tag] = signal_filt
+            else:
+                self._signals_filts[channel][tag] = (
+                    self._phis[channel][tag] * self._signals_fft[channel] / norm
+                )
 
             # debug
             if self._debug:
@@ -2000,7 +2459,7 @@ class OFBase:
             signal_fft = self.signal_fft(channel_name)
              
             # calculate
-            temp_sign_mat = np.zeros((ntmps, self._nbins), dtype='complex_')
+            temp_sign_mat = np.zeros((ntmps, self._nbins), dtype='complex128')
             for itmp in range(ntmps):
                 for jchan in range(nchans):
                     temp_sign_mat[itmp,:] += (
@@ -2062,9 +2521,26 @@ class OFBase:
                 self.calc_signal_filt(channel, template_tags=tag)
 
             # calc signal filt ifft
-            self._signals_filts_td[channel][tag] = np.real(
-                ifft(self._signals_filts[channel][tag]*self._nbins, axis=-1)
-            )*self._df
+            if self._lgc_workspace:
+                signal_filt = self._signals_filts[channel][tag]
+                signal_filt_scaled = self._get_workspace(
+                    'signal_filt_scaled', channel, tag,
+                    signal_filt.shape, np.complex128
+                )
+                np.multiply(signal_filt, self._nbins,
+                            out=signal_filt_scaled)
+                signal_filt_td = self._get_workspace(
+                    'signal_filt_td', channel, tag,
+                    signal_filt.shape[:-1] + (self._nbins,), np.float64
+                )
+                np.multiply(self._ifft_real(signal_filt_scaled,
+                                            overwrite_x=True),
+                            self._df, out=signal_filt_td)
+                self._signals_filts_td[channel][tag] = signal_filt_td
+            else:
+                self._signals_filts_td[channel][tag] = self._ifft_real(
+                    self._signals_filts[channel][tag]*self._nbins
+                )*self._df
 
             # debug
             if self._debug:
@@ -2175,9 +2651,11 @@ class OFBase:
                              f'channel {channel}')
 
         # "no pulse chisq" (doesn't depend on template)
+        # (sum along last axis -> also work for batch of events)
         self._chisq0[channel] = np.real(
-            np.dot(self._signals_fft[channel].conjugate()/self._psd[channel],
-                   self._signals_fft[channel])*self._df
+            self._sum_freqs(self._signals_fft[channel].conjugate()
+                            / self._psd[channel]
+                            * self._signals_fft[channel])*self._df
         )
 
 
@@ -2235,6 +2713,11 @@ class OFBase:
                                          template_tags=tag
                 )
 
+            # preallocated arrays
+            if self._lgc_workspace:
+                self._calc_chisq_amp_workspace(channel, tag)
+                continue
+            
             # build chi2
             chisq_t0 = (
                 (self._signals_filts_td[channel][tag]**2) * self._norms[channel][tag]
@@ -2242,7 +2725,7 @@ class OFBase:
 
 
             # total chisq
-            chisq = self._chisq0[channel] - chisq_t0
+            chisq = np.expand_dims(self._chisq0[channel], axis=-1) - chisq_t0
 
 
             # shift so that 0 delay is at pre-trigger bin
@@ -2266,6 +2749,38 @@ class OFBase:
                       tag + '"')
 
 
+    def _calc_chisq_amp_workspace(self, channel, tag):
+        """
+        Calculate rolled chi2/amp for all times using
+        preallocated arrays (lgc_workspace=True)
+        """
+
+        signal_filt_td = self._signals_filts_td[channel][tag]
+        
+        amps_rolled = self._get_workspace(
+            'amps_rolled', channel, tag,
+            signal_filt_td.shape, np.float64
+        )
+        chisqs_rolled = self._get_workspace(
+            'chisqs_rolled', channel, tag,
+            signal_filt_td.shape, np.float64
+        )
+
+        # shift so that 0 delay is at pre-trigger bin
+        # (same as np.roll)
+        nshift = self._pretrigger_samples[channel][tag] % self._nbins
+        amps_rolled[..., nshift:] = signal_filt_td[..., :self._nbins-nshift]
+        amps_rolled[..., :nshift] = signal_filt_td[..., self._nbins-nshift:]
+
+        # chisq = chisq0 - amp**2 * norm
+        np.square(amps_rolled, out=chisqs_rolled)
+        chisqs_rolled *= -self._norms[channel][tag]
+        chisqs_rolled += np.expand_dims(self._chisq0[channel], axis=-1)
+
+        self._amps_alltimes_rolled[channel][tag] = amps_rolled
+        self._chisqs_alltimes_rolled[channel][tag] = chisqs_rolled
+
+
     def get_fit_nodelay(self, channel,
                         template_tag='default',
                         shift_usec=None,
@@ -2342,8 +2857,10 @@ class OFBase:
                 or template_tag not in self._chisqs_alltimes_rolled[channel].keys()):
                 self.calc_chisq_amp(channel, template_tags=template_tag)
 
-            amp = self._amps_alltimes_rolled[channel][template_tag][t0_ind]
-            chisq = self._chisqs_alltimes_rolled[channel][template_tag][t0_ind]
+            amp = np.take(self._amps_alltimes_rolled[channel][template_tag],
+                          t0_ind, axis=-1)
+            chisq = np.take(self._chisqs_alltimes_rolled[channel][template_tag],
+                            t0_ind, axis=-1)
 
         else:
 
@@ -2360,19 +2877,20 @@ class OFBase:
 
             # amplitude
             if shift_usec is not None:
-                amp = np.real(np.sum(
-                    signal_filt*np.exp(2.0j*np.pi*t0*self._fft_freqs),
-                    axis=-1,
+                amp = np.real(self._sum_freqs(
+                    signal_filt*np.exp(2.0j*np.pi*t0*self._fft_freqs)
                 ))*self._df
 
             else:
-                amp = np.real(np.sum(
-                    signal_filt, axis=-1
-                ))*self._df
+                amp = np.real(self._sum_freqs(signal_filt))*self._df
 
             # total chisq
             chisq = self._chisq0[channel] - (amp**2)*self._norms[channel][template_tag]
 
+        # batch of events
+        if np.ndim(amp) > 0:
+            t0 = np.full(np.shape(amp), t0)
+            
         return amp, t0, chisq
 
 
@@ -2505,7 +3023,16 @@ class OFBase:
         if  window_max is not None:
              window_max = int(window_max)
 
-            
+        # batch of events
+        if chisqs_all.ndim > 1:
+            return self._get_fit_withdelay_batch(
+                channel, chisqs_all, amps_all, pretrigger_samples,
+                window_min=window_min,
+                window_max=window_max,
+                lgc_outside_window=lgc_outside_window,
+                constraint_mask=constraint_mask,
+                interpolate_t0=interpolate_t0
+            )
             
         bestind = argmin_chisq(
             chisqs_all,
@@ -2519,7 +3046,7 @@ class OFBase:
         if np.isnan(bestind):
             amp = 0.0
             t0 = 0.0
-            chisq = self._chisq0
+            chisq = self._chisq0[channel]
         elif interpolate_t0:
             amp, dt_interp, chisq = interpolate_of(
                 amps_all, chisqs_all, bestind, 1/self._fs,
@@ -2533,6 +3060,91 @@ class OFBase:
         return amp, t0, chisq
 
 
+    def _get_fit_withdelay_batch(self, channel, chisqs_all, amps_all,
+                                 pretrigger_samples,
+                                 window_min=None,
+                                 window_max=None,
+                                 lgc_outside_window=False,
+                                 constraint_mask=None,
+                                 interpolate_t0=False):
+        """
+        Find OF with delay results for a batch of events
+        (see get_fit_withdelay). The pulse direction constraint
+        is event dependent, so bins failing the constraint are
+        excluded by setting their chisq to infinity.
+
+        Parameters
+        ----------
+        channel : str
+          channel name
+
+        chisqs_all : 2D ndarray [nevents, nbins]
+          rolled chisq for all times
+
+        amps_all : 2D ndarray [nevents, nbins]
+          rolled amplitudes for all times
+
+        pretrigger_samples : int
+          number of pretrigger samples
+
+        (other parameters: see get_fit_withdelay)
+
+        Returns
+        -------
+        amp : 1D ndarray
+            The optimum amplitudes (in Amps).
+        t0 : 1D ndarray
+            The time shifts (in s).
+        chi2 : 1D ndarray
+            The chi^2 values.
+
+        """
+
+        nevents = chisqs_all.shape[0]
+        
+        chisqs_masked = chisqs_all
+        if constraint_mask is not None:
+            chisqs_masked = np.where(constraint_mask, chisqs_all, np.inf)
+
+        bestind = argmin_chisq(
+            chisqs_masked,
+            window_min=window_min,
+            window_max=window_max,
+            lgc_outside_window=lgc_outside_window
+        )
+
+        # empty window
+        if np.isscalar(bestind):
+            bestind = np.zeros(nevents, dtype=np.int64)
+            is_valid = np.zeros(nevents, dtype=bool)
+        else:
+            is_valid = np.isfinite(
+                chisqs_masked[np.arange(nevents), bestind]
+            )
+
+        # extract chisq/amp (interpolate if requested)
+        if interpolate_t0:
+            inds = np.mod(bestind[:, np.newaxis] + np.arange(-1, 2),
+                          self._nbins)
+            amp, dt_interp, chisq = interpolate_of(
+                np.take_along_axis(amps_all, inds, axis=-1).T,
+                np.take_along_axis(chisqs_all, inds, axis=-1).T,
+                1, 1/self._fs,
+            )
+            t0 = (bestind-pretrigger_samples)/self._fs + dt_interp
+        else:
+            amp = amps_all[np.arange(nevents), bestind]
+            t0 = (bestind-pretrigger_samples)/self._fs
+            chisq = chisqs_all[np.arange(nevents), bestind]
+
+        # no valid index -> no pulse
+        amp = np.where(is_valid, amp, 0.0)
+        t0 = np.where(is_valid, t0, 0.0)
+        chisq = np.where(is_valid, chisq, self._chisq0[channel])
+
+        return amp, t0, chisq
+    
+
     def get_amplitude_resolution(self,  channel, template_tag='default'):
         """
         Method to return the energy resolution for the optimum filter.
@@ -2600,7 +3212,7 @@ class OFBase:
 
         template_fft = self._templates_fft[channel][template_tag]
 
-        sigma = 1.0 / np.sqrt(amp**2 * np.sum(
+        sigma = 1.0 / np.sqrt(amp**2 * self._sum_freqs(
             (2*np.pi*self._fft_freqs)**2 * np.abs(template_fft)**2 / self._psd[channel]
         ) * self._df)
 
@@ -2637,9 +3249,10 @@ class OFBase:
 
         Parameters
         ----------
-        amp : float
+        amp : float or 1D ndarray
             The optimum amplitude calculated for the trace (in Amps).
-        t0 : float, optional
+            (array [nevents] if batch of events)
+        t0 : float or 1D ndarray, optional
             The time shift calculated for the pulse (in s).
             default: 0 (np shift)
         lowchi2_fcutoff : float, optional
@@ -2652,7 +3265,7 @@ class OFBase:
 
         Returns
         -------
-        chi2low : float
+        chi2low : float or 1D ndarray
             The low frequency chi^2 value (cut off at lowchi2_fcutoff) for the
             inputted values.
 
@@ -2672,17 +3285,22 @@ class OFBase:
         template_fft = self._templates_fft[channel][template_tag]
         signal_fft = self._signals_fft[channel]
 
-        # calc chisq
-        chi2tot = self._df * np.abs(
-            signal_fft - amp * np.exp(-2.0j * np.pi * t0 * self._fft_freqs) * template_fft
-        )**2 / self._psd[channel]
-
+        # amp/t0 can be arrays (batch of events)
+        amp = np.expand_dims(amp, axis=-1)
+        t0 = np.expand_dims(t0, axis=-1)
 
         # find low freq indices
         chi2inds = np.abs(self._fft_freqs) <= lowchi2_fcutoff
 
+        # calc chisq
+        chi2tot = self._df * np.abs(
+            signal_fft[..., chi2inds]
+            - amp * np.exp(-2.0j * np.pi * t0 * self._fft_freqs[chi2inds])
+            * template_fft[chi2inds]
+        )**2 / self._psd[channel][chi2inds]
+
         # sum
-        chi2low = np.sum(chi2tot[chi2inds])
+        chi2low = self._sum_freqs(chi2tot, freq_inds=chi2inds)
 
         return chi2low
 
@@ -2720,11 +3338,15 @@ class OFBase:
             raise ValueError('ERROR: more than one channel needed '
                              'to build signal matrix')
 
+        if self._lgc_rfft:
+            raise ValueError('ERROR: Multiple channels OF not available '
+                             'with "lgc_rfft=True"!')
+
         # let's build matrix
         if signal_fft:
 
             signal_matrix = np.zeros((nchans, self._nbins),
-                                     dtype='complex_')
+                                     dtype='complex128')
             
             for ichan, chan in enumerate(channel_list):
                 if chan not in self._signals_fft:
@@ -2783,6 +3405,10 @@ class OFBase:
         channel_list = convert_channel_name_to_list(channels)
         nchans = len(channel_list)
 
+        if self._lgc_rfft:
+            raise ValueError('ERROR: Multiple channels OF not available '
+                             'with "lgc_rfft=True"!')
+
         # check template tags
         if (not isinstance(template_tags, np.ndarray)
             or  template_tags.ndim != 2):
@@ -2858,7 +3484,7 @@ class OFBase:
             or matrix_tag not in self._templates_fft[channel_name]):
 
             template_matrix = np.zeros((nchans, ntmps, self._nbins),
-                                       dtype='complex_')
+                                       dtype='complex128')
 
             # loop channel
             for ichan, chan in enumerate(channel_list):
@@ -2883,10 +3509,407 @@ class OFBase:
                 self._templates_fft[channel_name] = dict()
 
             self._templates_fft[channel_name][matrix_tag] = template_matrix
-            
+
+
+    def export_shared(self, filename=None):
+        """
+        Export pre-calculations arrays (templates and templates
+        FFT, psd/csd, icovf, phi, norm, weight matrix, p matrix
+        and its inverse, ...) in a single shared memory block
+        (multiprocessing.shared_memory) or, if filename
+        provided, a memory-mapped file. Other processes can then
+        instantiate an OFBase object with all pre-calculations
+        attached read-only, without copy, using
+        OFBase.attach_shared(shared_info). Signal dependent
+        arrays are not exported.
+
+        The shared memory block is owned by this object, call
+        release_shared() when not needed anymore.
+
+        Parameters
+        ----------
+
+        filename : str, optional
+          memory-mapped file name (file is overwritten)
+          Default: None (use shared memory)
+
+
+        Return
+        ------
+
+        shared_info : dict
+          information (picklable) needed to attach the
+          pre-calculations (see attach_shared)
+
+        """
+
+        # replace arrays with [index, shape, dtype]
+        arrays = []
+
+        def _replace(val):
+            if isinstance(val, dict):
+                return {key: _replace(item) for key, item in val.items()}
+            if (isinstance(val, np.ndarray)
+                and not val.dtype.hasobject):
+                arrays.append(val)
+                return _SharedArray(len(arrays)-1, val.shape,
+                                    val.dtype.str)
+            return val
+
+        state = dict()
+        for key, val in self.__dict__.items():
+            if key not in _SHARED_EXCLUDED_ATTRIBUTES:
+                state[key] = _replace(val)
+
+        # offsets (index -> offset)
+        offsets = []
+        size = 0
+        for array in arrays:
+            offsets.append(size)
+            size += ceil(array.nbytes/_SHARED_ALIGNMENT)*_SHARED_ALIGNMENT
+        size = max(size, 1)
+
+        def _offset(val):
+            if isinstance(val, dict):
+                return {key: _offset(item) for key, item in val.items()}
+            if isinstance(val, _SharedArray):
+                return _SharedArray(offsets[val.offset], val.shape,
+                                    val.dtype)
+            return val
+
+        state = {key: _offset(val) for key, val in state.items()}
+
+        # create buffer
+        if filename is None:
+            shm = shared_memory.SharedMemory(create=True, size=size)
+            buffer = shm.buf
+            name = shm.name
+        else:
+            shm = np.memmap(filename, dtype=np.uint8,
+                            mode='w+', shape=(size,))
+            buffer = shm
+            name = filename
+
+        # copy
+        for array, offset in zip(arrays, offsets):
+            np.ndarray(array.shape, dtype=array.dtype,
+                       buffer=buffer, offset=offset)[...] = array
+
+        if filename is not None:
+            shm.flush()
+
+        self._shared_buffers[name] = (shm, True)
+
+        if self._verbose:
+            print(f'INFO: {len(arrays)} pre-calculation arrays '
+                  f'({size/1e6:.1f} MB) exported to "{name}"')
+
+        shared_info = {'name': name,
+                       'lgc_memmap': filename is not None,
+                       'size': size,
+                       'state': state}
+
+        return shared_info
+
+
+    @staticmethod
+    def attach_shared(shared_info):
+        """
+        Instantiate OFBase object with pre-calculations
+        attached (read-only, without copy) from shared memory
+        or memory-mapped file (see export_shared). Signal
+        dependent calculations are then done as usual.
+
+        Parameters
+        ----------
+
+        shared_info : dict
+          dictionary returned by export_shared()
+
+
+        Return
+        ------
+
+        of_base : OFBase object
+
+        """
+
+        name = shared_info['name']
+
+        if shared_info['lgc_memmap']:
+            shm = np.memmap(name, dtype=np.uint8, mode='r',
+                            shape=(shared_info['size'],))
+            buffer = shm
+        else:
+            shm = shared_memory.SharedMemory(name=name)
+            buffer = shm.buf
+
+        def _attach(val):
+            if isinstance(val, dict):
+                return {key: _attach(item) for key, item in val.items()}
+            if isinstance(val, _SharedArray):
+                array = np.ndarray(val.shape, dtype=np.dtype(val.dtype),
+                                   buffer=buffer, offset=val.offset)
+                array.flags.writeable = False
+                return array
+            return val
+
+        of_base = OFBase.__new__(OFBase)
+        for key, val in shared_info['state'].items():
+            setattr(of_base, key, _attach(val))
+
+        # signal dependent and process specific
+        of_base.clear_signal()
+        of_base._workspaces = dict()
+
+        # keep buffer reference (not owner)
+        of_base._shared_buffers = {name: (shm, False)}
+
+        return of_base
+
+
+    def release_shared(self, shared_info=None):
+        """
+        Release shared memory blocks / memory-mapped files
+        exported (or attached) by this object. Shared memory blocks
+        owned by this object (export_shared) are destroyed
+        (memory-mapped files are kept on disk), other processes
+        should not attach them anymore.
+
+        Parameters
+        ----------
+
+        shared_info : dict, optional
+          dictionary returned by export_shared()
+          Default: release all
+
+
+        Return
+        ------
+        None
+
+        """
+
+        names = list(self._shared_buffers.keys())
+        if shared_info is not None:
+            names = [shared_info['name']]
+
+        for name in names:
+
+            if name not in self._shared_buffers:
+                continue
+
+            shm, lgc_owner = self._shared_buffers.pop(name)
+
+            # attached buffers are closed when no
+            # arrays are using them anymore
+            if (lgc_owner
+                and isinstance(shm, shared_memory.SharedMemory)):
+                shm.close()
+                shm.unlink()
+
+
+    def _calc_p_matrix_constraints(self, phi_mat, template_fft_mat,
+                                   template_time_tags, t0s):
+        """
+        Calculate NxMx2 p matrix and its inverse for
+        the specified time combinations (see calc_p_matrix)
+        """
+
+        ntmps = template_fft_mat.shape[1]
+
+        # p matrix and its inverse for each time lag
+        p, p_inv = self._calc_p_matrix_lags(phi_mat, template_fft_mat,
+                                            template_time_tags)
+
+        # add constraint
+        p_matrix =  np.zeros((t0s[:,0].shape[0], ntmps, ntmps))
+        p_matrix_inv =  np.zeros((t0s[:,0].shape[0], ntmps, ntmps))
+                
+        np.einsum('jii->ji', p_matrix_inv)[:] = 1
+
+        for itmps in range(ntmps):
+            for jtmps in range(ntmps):
+                p_matrix[:, itmps, jtmps] = (
+                    p[t0s[:,0]-t0s[:,1]][:, itmps, jtmps]
+                )
+                p_matrix_inv[:, itmps, jtmps] = (
+                    p_inv[t0s[:,0]- t0s[:,1]][:, itmps, jtmps]
+                )
+
+        return p_matrix, p_matrix_inv
+
+
+    def _calc_p_matrix_lags(self, phi_mat, template_fft_mat,
+                            template_time_tags):
+        """
+        Calculate NxMx2 p matrix and its inverse for
+        each time lag t1-t2 (negative lags wrapped)
+        dim: [nbins, ntmps, ntmps]
+        """
+
+        nchans = template_fft_mat.shape[0]
+        ntmps = template_fft_mat.shape[1]
+
+        # calculate 
+        time_diff_mat = np.zeros((template_time_tags.shape[0] ,
+                                  template_time_tags.shape[0] ))
+        for i in range(template_time_tags.shape[0]):
+            for j in range(template_time_tags.shape[0]):
+                time_diff_mat[i,j] = (template_time_tags[i]
+                                      -template_time_tags[j])
+
+        p = np.zeros((self._nbins, ntmps, ntmps ), dtype='complex128')
+        np.einsum('jii->ji', p)[:] = 1
+        for itmp in range(ntmps):
+            for jtmp in range(ntmps):
+                sum = 0.0 + 0.0j
+                for jchan in range(nchans):
+                    if (time_diff_mat[itmp, jtmp] != 0):
+                        sum += ifft(
+                            phi_mat[:,itmp, jchan]\
+                            * template_fft_mat[jchan,jtmp,:]
+                        )*self._nbins
+                    if (time_diff_mat[itmp,jtmp] == 0):
+                        sum += np.sum(
+                            phi_mat[:,itmp,jchan]\
+                            * template_fft_mat[jchan,jtmp,:]
+                        )
+                        
+                if (jtmp >= itmp):
+                    p[:,itmp,jtmp] = p[:,jtmp,itmp] = np.real(sum)
+
+        p_inv = np.linalg.pinv(p)
+
+        # (real valued)
+        return np.real(p), np.real(p_inv)
+
+
+    def _cache_load(self, name, *items):
+        """
+        Get cache key from pre-calculation name and inputs,
+        and load cached arrays. Returns (None, None) if
+        no cache
+        """
+
+        if self._cache is None:
+            return None, None
+
+        key = self._cache.hash_key(name, self._fs, self._nbins,
+                                   self._lgc_rfft, *items)
+
+        return key, self._cache.load(key)
+
+
+    def _cache_save(self, key, **arrays):
+        """
+        Save pre-calculation arrays in cache
+        (if cache enabled)
+        """
+
+        if self._cache is None or key is None:
+            return
+
+        self._cache.save(key, **arrays)
+
+
+    def _get_workspace(self, name, channel, tag, shape, dtype):
+        """
+        Get preallocated array (lgc_workspace=True) with
+        specified name, channel and tag. The array is
+        (re)allocated if not available or if different
+        shape/dtype (for example batch of events)
+        """
+
+        if channel not in self._workspaces:
+            self._workspaces[channel] = dict()
+        if name not in self._workspaces[channel]:
+            self._workspaces[channel][name] = dict()
+
+        array = self._workspaces[channel][name].get(tag)
+        if (array is None
+            or array.shape != shape
+            or array.dtype != dtype):
+            array = np.empty(shape, dtype=dtype)
+            self._workspaces[channel][name][tag] = array
+
+        return array
+
+    
+    def _fft(self, vals, name=None, channel=None):
+        """
+        FFT along last axis (one-sided if lgc_rfft=True)
+        and associated frequencies
+
+        If "name" is not None, the FFT is written in 
+        the preallocated array with that name for 
+        specified channel (frequencies are not re-calculated)
+        """
+
+        if name is None:
+            if self._lgc_rfft:
+                return rfft(vals, self._fs, axis=-1)
+            return fft(vals, self._fs, axis=-1)
+
+        # preallocated array
+        nfreqs = vals.shape[-1]
+        if self._lgc_rfft:
+            nfreqs = nfreqs//2 + 1
+        vals_fft = self._get_workspace(
+            name, channel, None,
+            vals.shape[:-1] + (nfreqs,), np.complex128
+        )
         
+        if self._lgc_rfft:
+            vals_fft[:] = rfft(vals, axis=-1)
+        else:
+            # complex to complex FFT done in place
+            vals_fft[:] = vals
+            vals_fft_out = fft(vals_fft, axis=-1, overwrite_x=True)
+            if (vals_fft_out.ctypes.data != vals_fft.ctypes.data
+                or vals_fft_out.strides != vals_fft.strides):
+                vals_fft[:] = vals_fft_out
+
+        return self._fft_freqs, vals_fft
+
     
+    def _ifft_real(self, vals, overwrite_x=False):
+        """
+        Inverse FFT along last axis of an hermitian spectrum
+        (one-sided if lgc_rfft=True), return real part
+        """
+
+        if self._lgc_rfft:
+            return irfft(vals, n=self._nbins, axis=-1,
+                         overwrite_x=overwrite_x)
+
+        return np.real(ifft(vals, axis=-1, overwrite_x=overwrite_x))
+
+    
+    def _sum_freqs(self, vals, freq_inds=None):
+        """
+        Sum over frequencies (last axis) of an hermitian
+        spectrum, only real part is meaningful.
+
+        If lgc_rfft=True (one-sided), the bins without a negative
+        frequency counterpart (DC and Nyquist) are weighted by 1,
+        all others by 2. "freq_inds" (indices or boolean mask)
+        are the frequency bins already selected in "vals".
+        """
+
+        if not self._lgc_rfft:
+            return np.sum(vals, axis=-1)
+
+        weights = np.full(self._nbins//2+1, 2.0)
+        weights[0] = 1.0
+        if self._nbins % 2 == 0:
+            weights[-1] = 1.0
+        if freq_inds is not None:
+            weights = weights[freq_inds]
             
+        return np.sum(vals*weights, axis=-1)
+
+    
     def _get_template_matrix_tag(self, channels, template_tags):
         """
         Build and return template tag with multiple channels"
@@ -2931,6 +3954,60 @@ class OFBase:
         return matrix_tag
 
     
+    def _get_fit_window_ranges(self, fit_window):
+        """
+        Get OF NxMx2 (or 1x2) ranges of first and
+        second delays (in samples) from fit window
+        (default: full trace)
+        """
+
+        if fit_window is None:
+            time_combinations1 = np.arange(int(-self._nbins/2),
+                                           int(self._nbins/2))
+            time_combinations2 = np.arange(int(-self._nbins/2),
+                                           int(self._nbins/2))
+        else:
+            time_combinations1 = np.arange(int(fit_window[0][0]),
+                                           int(fit_window[0][1]))
+            time_combinations2 = np.arange(int(fit_window[1][0]),
+                                           int(fit_window[1][1]))
+
+        return time_combinations1, time_combinations2
+
+
+    def _get_time_tags_tag(self, template_time_tags):
+        """
+        Get tag for NxMx2 template time tags (p matrix
+        per time lag)
+        """
+
+        time_tags = np.asarray(template_time_tags).astype(int)
+        return 'time_tags_' + '_'.join(str(tag) for tag in time_tags)
+
+
+    def _get_p_matrix_lags(self, store, channels, template_tags,
+                           template_time_tags):
+        """
+        Get NxMx2 p matrix (or its inverse) per time lag
+        from store dictionary, None if not calculated
+        """
+
+        channel_name = convert_channel_list_to_name(channels)
+
+        matrix_tag = self._get_template_matrix_tag(
+            channel_name, template_tags
+        )
+
+        time_tag = self._get_time_tags_tag(template_time_tags)
+
+        if (channel_name not in store
+            or matrix_tag not in store[channel_name]
+            or time_tag not in store[channel_name][matrix_tag]):
+            return None
+
+        return store[channel_name][matrix_tag][time_tag]
+
+
     def _get_time_constraints_tag(self, channels, template_tags,
                                   constraints_dict):
         """
@@ -3029,3 +4106,16 @@ class OFBase:
 
 
     
+
+
+
+class _SharedArray:
+    """
+    Shared array descriptor (offset in bytes,
+    shape, dtype string) used by OFBase.export_shared
+    """
+
+    def __init__(self, offset, shape, dtype):
+        self.offset = offset
+        self.shape = shape
+        self.dtype = dtype
@@ -0,0 +1,266 @@
+import os
+import glob
+import hashlib
+import numpy as np
+
+__all__ = ['OFCache']
+
+
+# cache format version (part of the hash key, modify
+# if the stored pre-calculations change)
+_CACHE_VERSION = 'v1'
+
+
+
+class OFCache:
+    """
+    On-disk cache (one ".npz" file per entry) of optimal filter
+    pre-calculations, keyed by a content hash of the inputs
+    (templates, psd/csd, sample rate, time constraints, ...).
+    The total size of the cache directory is bounded: least
+    recently used entries are deleted first. Can be shared by
+    many jobs (entries are written atomically).
+    """
+
+    def __init__(self, path, max_size_mb=1000, verbose=True):
+        """
+        Initialize OFCache
+
+        Parameters
+        ----------
+
+        path : str
+          cache directory (created if needed)
+
+        max_size_mb : float, optional
+          maximum total size of the cache in MB
+          Default: 1000
+
+        verbose : bool, optional
+          Display information
+          Default=True
+
+
+        Return
+        ------
+        None
+
+        """
+
+        self._path = path
+        self._max_size = max_size_mb * 1e6
+        self._verbose = verbose
+
+        os.makedirs(path, exist_ok=True)
+
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def max_size_mb(self):
+        return self._max_size / 1e6
+
+    @property
+    def size_mb(self):
+        """
+        Current total size of the cache in MB
+        """
+
+        return sum(os.path.getsize(name)
+                   for name in self._entries()) / 1e6
+
+
+    @staticmethod
+    def hash_key(*items):
+        """
+        Calculate content hash key
+
+        Parameters
+        ----------
+
+        items : ndarray, dict, list, str, float, ...
+          inputs of the pre-calculation (arrays are
+          hashed using dtype, shape, and data)
+
+
+        Return
+        ------
+
+        key : str
+          hash key (hexadecimal string)
+
+        """
+
+        sha = hashlib.sha1(_CACHE_VERSION.encode())
+
+        def _update(item):
+            if isinstance(item, np.ndarray):
+                if item.dtype.hasobject:
+                    sha.update(repr(item.tolist()).encode())
+                else:
+                    sha.update(f'{item.dtype.str}{item.shape}'.encode())
+                    sha.update(np.ascontiguousarray(item).data)
+            elif isinstance(item, dict):
+                for key in sorted(item.keys()):
+                    sha.update(repr(key).encode())
+                    _update(item[key])
+            elif isinstance(item, (list, tuple)):
+                sha.update(f'{type(item).__name__}{len(item)}'.encode())
+                for val in item:
+                    _update(val)
+            else:
+                sha.update(repr(item).encode())
+
+        for item in items:
+            _update(item)
+
+        return sha.hexdigest()
+
+
+    def load(self, key):
+        """
+        Load cache entry (and mark it as recently used)
+
+        Parameters
+        ----------
+
+        key : str
+          hash key (see hash_key)
+
+
+        Return
+        ------
+
+        arrays : dict
+          dictionary of arrays or None if not in cache
+
+        """
+
+        filename = self._filename(key)
+
+        try:
+            with np.load(filename) as data:
+                arrays = {name: data[name] for name in data.files}
+            os.utime(filename)
+        except (OSError, ValueError):
+            return None
+
+        if self._verbose:
+            print(f'INFO: Pre-calculations loaded from cache '
+                  f'(key={key[:10]})')
+
+        return arrays
+
+
+    def save(self, key, **arrays):
+        """
+        Save cache entry then delete least recently
+        used entries if maximum size is reached
+
+        Parameters
+        ----------
+
+        key : str
+          hash key (see hash_key)
+
+        arrays : ndarray
+          arrays to store (keyword = name)
+
+
+        Return
+        ------
+        None
+
+        """
+
+        filename = self._filename(key)
+
+        # write in temporary file, then rename (atomic)
+        tmp_filename = f'{filename[:-4]}.{os.getpid()}.tmp.npz'
+        np.savez(tmp_filename, **arrays)
+        os.replace(tmp_filename, filename)
+
+        self._evict(keep=filename)
+
+
+    def clear(self):
+        """
+        Delete all cache entries
+
+        Parameters
+        ----------
+        None
+
+        Return
+        ------
+        None
+
+        """
+
+        for filename in self._entries():
+            _remove(filename)
+
+
+    def _filename(self, key):
+        """
+        Cache entry file name
+        """
+
+        return os.path.join(self._path, f'ofcache_{key}.npz')
+
+
+    def _entries(self):
+        """
+        List of cache entries file names
+        """
+
+        filenames = glob.glob(os.path.join(self._path, 'ofcache_*.npz'))
+        return [name for name in filenames
+                if not name.endswith('.tmp.npz')]
+
+
+    def _evict(self, keep=None):
+        """
+        Delete least recently used entries until
+        the total size is below maximum size
+        """
+
+        entries = []
+        for filename in self._entries():
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, filename))
+
+        size = sum(entry[1] for entry in entries)
+
+        for _, entry_size, filename in sorted(entries):
+
+            if size <= self._max_size:
+                break
+
+            if filename == keep:
+                continue
+
+            _remove(filename)
+            size -= entry_size
+
+            if self._verbose:
+                print(f'INFO: Cache entry {os.path.basename(filename)} '
+                      f'deleted (maximum size reached)')
+
+
+
+def _remove(filename):
+    """
+    Remove file (ignore if already removed,
+    for example by another job)
+    """
+
+    try:
+        os.remove(filename)
+    except FileNotFoundError:
+        pass
@@ -1,8 +1,8 @@
 import numpy as np
+import multiprocessing
 from scipy.optimize import least_squares
-from numpy.fft import rfft, fft, ifft, fftfreq, rfftfreq
 from qetpy.plotting import plotnonlin
-from qetpy.utils import shift
+from qetpy.utils import shift, fft, fftfreq
 
 
 __all__ = ["OFnonlin"]
@@ -81,7 +81,7 @@ class OFnonlin(object):
 
         self.fs = fs
         self.df = fs / len(psd)
-        self.freqs = np.fft.fftfreq(len(psd), 1 / fs)
+        self.freqs = fftfreq(len(psd), fs)
         self.time = np.arange(len(psd)) / fs
         self.template = template
 
@@ -94,6 +94,11 @@ class OFnonlin(object):
         self.dof = None
         self.norm = np.sqrt(fs * len(psd))
 
+        # frequency terms used by the pulse models
+        # (calculated once)
+        self._omega = 2 * np.pi * self.freqs
+        self._sqrtdf = np.sqrt(self.df)
+
 
     def fourpole(self, A, B, C, tau_r, tau_f1, tau_f2, tau_f3, t0):
         """
@@ -136,7 +141,7 @@ class OFnonlin(object):
 
         """
 
-        omega = 2 * np.pi * self.freqs
+        omega = self._omega
         phaseTDelay = np.exp(-(0 + 1j) * omega * t0)
         pulse = (
             (
@@ -149,7 +154,7 @@ class OFnonlin(object):
                 (A + B + C) * (tau_r / (1 + omega * tau_r * (0 + 1j)))
             )
         ) * phaseTDelay
-        return pulse * np.sqrt(self.df)
+        return pulse * self._sqrtdf
 
     def fourpoletime(self, A, B, C, tau_r, tau_f1, tau_f2, tau_f3, t0):
         """
@@ -241,7 +246,7 @@ class OFnonlin(object):
 
         """
 
-        omega = 2 * np.pi * self.freqs
+        omega = self._omega
         phaseTDelay = np.exp(-(0 + 1j) * omega * t0)
         pulse = (
             (
@@ -252,7 +257,7 @@ class OFnonlin(object):
                 (A + B) * (tau_r / (1 + omega * tau_r * (0 + 1j)))
             )
         ) * phaseTDelay
-        return pulse * np.sqrt(self.df)
+        return pulse * self._sqrtdf
 
 
     def threepoletime(self, A, B, tau_r, tau_f1, tau_f2, t0):
@@ -336,7 +341,7 @@ class OFnonlin(object):
 
         """
 
-        omega = 2 * np.pi * self.freqs
+        omega = self._omega
 
         if(self.scale_amplitude):
             delta = tau_r - tau_f
@@ -358,7 +363,7 @@ class OFnonlin(object):
                 )
             ) * np.exp(-omega * t0 * 1.0j)
 
-        return pulse * np.sqrt(self.df)
+        return pulse * self._sqrtdf
 
 
 
@@ -484,6 +489,125 @@ class OFnonlin(object):
 
 
 
+    def jacobian(self, params):
+        """
+        Function to calculate the analytic jacobian of the weighted
+        residuals (see `residuals`) with respect to the fit
+        parameters
+
+        Parameters
+        ----------
+        params : tuple
+            Tuple containing fit parameters
+
+        Returns
+        -------
+        z2d : ndarray
+            Array [2*nbins, nparams] containing the derivatives of the
+            residuals per frequency bin (same ordering as `residuals`)
+
+        """
+
+        dpulse = self._model_jacobian(params)
+
+        z2d = np.zeros((self.data.size * 2, len(params)), dtype=np.float64)
+        z2d[0:z2d.shape[0]:2] = -(dpulse.real / self.error).T
+        z2d[1:z2d.shape[0]:2] = -(dpulse.imag / self.error).T
+
+        return z2d
+
+
+    def _model_jacobian(self, params):
+        """
+        Hidden function to calculate the derivatives of the frequency
+        domain pulse model (fourpole, threepole, twopole, or onepole
+        depending on npolefit) with respect to the fit parameters,
+        returned as an array [nparams, nbins].
+
+        """
+
+        omega = self._omega
+        phase = np.exp(-omega * params[-1] * 1.0j) * self._sqrtdf
+
+        def _pole(tau):
+            # pole term and its derivative with respect to tau
+            denom = 1 + omega * tau * (0 + 1j)
+            return tau / denom, 1 / denom**2
+
+        if self.npolefit == 4 or self.npolefit == 3:
+
+            namps = self.npolefit - 1
+            amps = params[:namps]
+            tau_r = params[namps]
+            taus_f = params[namps+1:-1]
+
+            pole_r, dpole_r = _pole(tau_r)
+
+            dpulse = np.zeros((len(params), len(omega)), dtype=np.complex128)
+            for iamp, (amp, tau_f) in enumerate(zip(amps, taus_f)):
+                pole_f, dpole_f = _pole(tau_f)
+                dpulse[iamp] = (pole_f - pole_r) * phase
+                dpulse[namps+1+iamp] = amp * dpole_f * phase
+            dpulse[namps] = -np.sum(amps) * dpole_r * phase
+
+            pulse = np.sum(
+                np.array(amps)[:, np.newaxis] * dpulse[:namps], axis=0,
+            )
+
+        else:
+
+            if self.npolefit == 2:
+                A, tau_r, tau_f, t0 = params
+            else:
+                A, tau_f, t0 = params
+                tau_r = self.taurise
+
+            dpulse = np.zeros((4, len(omega)), dtype=np.complex128)
+
+            if self.scale_amplitude:
+                # pulse height normalization: value of the pulse shape
+                # at its maximum (time tpeak), the derivative with
+                # respect to tpeak is zero
+                delta = tau_r - tau_f
+                rat = tau_r / tau_f
+                norm = rat**(-tau_r / delta) - rat**(-tau_f / delta)
+                tpeak = tau_r * tau_f / delta * np.log(rat)
+                dnorm_r = -rat**(-tau_f / delta) * tpeak / tau_r**2
+                dnorm_f = rat**(-tau_r / delta) * tpeak / tau_f**2
+
+                shape = phase / (
+                    1 + omega * tau_f * 1j
+                ) / (
+                    1 + omega * tau_r * 1j
+                )
+
+                dpulse[0] = np.abs(delta) / norm * shape
+                pulse = A * dpulse[0]
+                dpulse[1] = pulse * (
+                    -dnorm_r / norm - omega * 1j / (1 + omega * tau_r * 1j)
+                ) + A / norm * np.sign(delta) * shape
+                dpulse[2] = pulse * (
+                    -dnorm_f / norm - omega * 1j / (1 + omega * tau_f * 1j)
+                ) - A / norm * np.sign(delta) * shape
+            else:
+                pole_r, dpole_r = _pole(tau_r)
+                pole_f, dpole_f = _pole(tau_f)
+
+                dpulse[0] = (pole_f - pole_r) * phase
+                pulse = A * dpulse[0]
+                dpulse[1] = -A * dpole_r * phase
+                dpulse[2] = A * dpole_f * phase
+
+            # 1-pole: rise time not a fit parameter
+            if self.npolefit != 2:
+                dpulse = dpulse[[0, 2, 3]]
+
+        # time offset
+        dpulse[-1] = -omega * 1.0j * pulse
+
+        return dpulse
+
+
     def calcchi2(self, model):
         """
         Function to calculate the reduced chi square
@@ -534,7 +658,7 @@ class OFnonlin(object):
     
     def dofit(self, pulse, npolefit=1, errscale=1, guess=None,
               bounds=None, lgcfix=None, taurise=None, scale_amplitude=True,
-              lgcfullrtn=True, lgcplot=False, verbose=0):
+              lgcfullrtn=True, lgcplot=False, verbose=0, max_nfev=None):
         """
         Function to do the fit
 
@@ -584,6 +708,13 @@ class OFnonlin(object):
             matrix, and chi squared statistic are returned as well.
         lgcplot : bool, optional
             If True, diagnostic plots are returned.
+        verbose : int, optional
+            Level of algorithm's verbosity (see
+            `scipy.optimize.least_squares`), default: 0
+        max_nfev : int, optional
+            Maximum number of function evaluations (see
+            `scipy.optimize.least_squares`). Default: None
+            (100 * number of parameters)
 
         Returns
         -------
@@ -611,7 +742,7 @@ class OFnonlin(object):
         """
 
         # FFT pulse 
-        self.data = np.fft.fft(pulse) / self.norm
+        self.data = fft(np.asarray(pulse)) / self.norm
         self.error = np.sqrt(self.psd / errscale)
 
         self.npolefit = npolefit
@@ -626,6 +757,199 @@ class OFnonlin(object):
                 self.taurise = taurise
 
 
+        # initial guess and bounds
+        p0, bounds = self._guessparams(pulse, guess=guess, bounds=bounds)
+
+        # fit
+        variables, errors, cov, chi2, success = self._fit(
+            p0, bounds, lgcfix=lgcfix, verbose=verbose, max_nfev=max_nfev,
+        )
+
+        if lgcplot:
+            plotnonlin(self, pulse, variables, errors)
+
+        if lgcfullrtn:
+            return (variables, errors, cov, chi2, success)
+        else:
+            return variables
+
+
+    def dofit_batch(self, pulses, npolefit=1, errscale=1, guess=None,
+                    bounds=None, lgcfix=None, taurise=None,
+                    scale_amplitude=True, lgc_warm_start=True,
+                    nb_workers=1, verbose=0, max_nfev=None):
+        """
+        Function to fit many pulses with the same model. The error
+        arrays are calculated once, and each fit is (optionally)
+        started from the previous event's solution: rise/fall times
+        from the previous fit, amplitudes rescaled by the ratio of
+        the pulses peak-to-peak values, time offset from the event's
+        own guess. Events can be split in contiguous chunks fitted in
+        parallel by a pool of worker processes (warm starts are
+        done within each chunk).
+
+        Parameters
+        ----------
+        pulses : ndarray
+            Time series traces to be fit, 2D array [nevents, nbins]
+        npolefit: int, optional
+            The number of poles to fit (see `dofit`)
+        errscale : float or int, optional
+            A scale factor for the psd (see `dofit`)
+        guess : 1d numpy array, optional
+            Guess of initial values for the first fit (or all fits
+            if `lgc_warm_start` is False), see `dofit`
+        bounds : 2-tuple of 1D numpy array , optional
+            Lower and upper bounds on independent variables. If None,
+            bounds are calculated for each event from its default
+            guess (see `dofit`)
+        lgcfix : 1D numpy array (boolean)
+            array size of nb parameters. If True, fix parameter using
+            guess value
+        taurise : float, optional
+            The value of the rise time of the pulse if the single pole
+            function is being use for fit
+        scale_amplitude : bool, optional
+            If using the 1- or 2-pole fit, whether the parameter, A,
+            should be treated as the pulse height (see `dofit`)
+        lgc_warm_start : bool, optional
+            If True (default), start each fit from the previous
+            successful fit
+        nb_workers : int, optional
+            Number of worker processes, if 1 (default), the events
+            are fitted in the current process
+        verbose : int, optional
+            Level of algorithm's verbosity (see
+            `scipy.optimize.least_squares`), default: 0
+        max_nfev : int, optional
+            Maximum number of function evaluations per fit (see
+            `scipy.optimize.least_squares`)
+
+        Returns
+        -------
+        variables : ndarray
+            The best fit parameters, array [nevents, nparams]
+        errors : ndarray
+            The corresponding fit errors, array [nevents, nparams]
+        cov : ndarray
+            The covariance matrices, array [nevents, nvar, nvar]
+            (nvar: number of parameters not fixed)
+        chi2 : ndarray
+            The reduced chi squared statistics, array [nevents]
+        success : ndarray
+            The success flags, array [nevents]
+
+        """
+
+        pulses = np.asarray(pulses)
+        if pulses.ndim != 2:
+            raise ValueError('ERROR: Expecting "pulses" to be '
+                             'a 2D array [nevents, nbins]!')
+
+        if (npolefit==1 and taurise is None):
+            raise ValueError(
+                'taurise must not be None if doing 1-pole fit.'
+            )
+
+        kwargs = dict(npolefit=npolefit, errscale=errscale, guess=guess,
+                      bounds=bounds, lgcfix=lgcfix, taurise=taurise,
+                      scale_amplitude=scale_amplitude,
+                      lgc_warm_start=lgc_warm_start,
+                      verbose=verbose, max_nfev=max_nfev)
+
+        nevents = pulses.shape[0]
+
+        # error arrays (same for all events)
+        self.npolefit = npolefit
+        self.scale_amplitude = scale_amplitude
+        self.taurise = taurise
+        self.error = np.sqrt(self.psd / errscale)
+
+        # multi-process: contiguous chunks of events
+        if nb_workers > 1 and nevents > 1:
+
+            # same state as single process (last event)
+            self.data = fft(pulses[-1]) / self.norm
+            self._guessparams(pulses[-1], guess=guess, bounds=bounds)
+
+            nb_workers = min(nb_workers, nevents)
+            chunks = np.array_split(pulses, nb_workers)
+            tasks = [(self, chunk, kwargs) for chunk in chunks]
+
+            with multiprocessing.Pool(processes=nb_workers) as pool:
+                results = pool.map(_dofit_batch_worker, tasks)
+
+            return tuple(
+                np.concatenate([result[ires] for result in results])
+                for ires in range(5)
+            )
+
+        # amplitude parameters (for warm start)
+        namps = npolefit - 1 if npolefit > 2 else 1
+
+        variables = list()
+        errors = list()
+        covs = list()
+        chi2s = np.zeros(nevents)
+        success = np.zeros(nevents, dtype=bool)
+
+        variables_prev = None
+        ptp_prev = None
+
+        for ievent, pulse in enumerate(pulses):
+
+            self.data = fft(pulse) / self.norm
+
+            event_guess = guess if (ievent == 0 or not lgc_warm_start) else None
+            p0, event_bounds = self._guessparams(
+                pulse, guess=event_guess, bounds=bounds,
+            )
+
+            # warm start from previous successful fit
+            if lgc_warm_start and variables_prev is not None:
+
+                p0_warm = variables_prev.copy()
+                p0_warm[:namps] *= np.ptp(pulse) / ptp_prev
+                p0_warm[-1] = p0[-1]
+                p0_warm = np.clip(p0_warm, event_bounds[0], event_bounds[1])
+
+                if lgcfix is not None:
+                    p0[~lgcfix] = p0_warm[~lgcfix]
+                else:
+                    p0 = p0_warm
+
+            result = self._fit(p0, event_bounds, lgcfix=lgcfix,
+                               verbose=verbose, max_nfev=max_nfev)
+
+            variables.append(result[0])
+            errors.append(result[1])
+            covs.append(result[2])
+            chi2s[ievent] = result[3]
+            success[ievent] = result[4]
+
+            if result[4]:
+                variables_prev = result[0]
+                ptp_prev = np.ptp(pulse)
+
+        return (np.array(variables), np.array(errors),
+                np.array(covs), chi2s, success)
+
+
+    def _guessparams(self, pulse, guess=None, bounds=None):
+        """
+        Hidden function to calculate the initial guess and the bounds
+        of the fit parameters (see `dofit`), the number of degrees of
+        freedom is also set.
+
+        Returns
+        -------
+        p0 : ndarray
+            Initial values of the fit parameters
+        bounds : 2-tuple of 1D numpy array
+            Lower and upper bounds on the fit parameters
+
+        """
+
 
         # initial guess
         p0 = None
@@ -889,6 +1213,29 @@ class OFnonlin(object):
                 )
                 bounds = (boundslower, boundsupper)
 
+        return p0, bounds
+
+
+
+    def _fit(self, p0, bounds, lgcfix=None, verbose=0, max_nfev=None):
+        """
+        Hidden function to do the least squares fit of the current
+        data (see `dofit`) starting from the initial parameters p0.
+
+        Returns
+        -------
+        variables : ndarray
+            The best fit parameters
+        errors : ndarray
+            The corresponding fit errors
+        cov : ndarray
+            The covariance matrix of the variable parameters
+        chi2 : float
+            The reduced chi squared statistic
+        success : bool
+            True if the fit converged
+
+        """
 
 
         # fix parameters
@@ -931,6 +1278,20 @@ class OFnonlin(object):
                 return self.residuals(all_params)
 
 
+        def _jacobian_lsq(var_params):
+            """
+            Analytic jacobian of _residual_lsq (only variable
+            parameters columns)
+            """
+
+            if fix_params is None:
+                return self.jacobian(var_params)
+            else:
+                all_params = np.zeros_like(lgcfix, dtype=float)
+                np.place(all_params, lgcfix, fix_params)
+                np.place(all_params, ~lgcfix, var_params)
+                return self.jacobian(all_params)[:, ~lgcfix]
+
             
         # FIT
         result = least_squares(
@@ -938,10 +1299,11 @@ class OFnonlin(object):
             x0=p0,
             bounds=bounds,
             x_scale=p0,
-            jac='3-point',
+            jac=_jacobian_lsq,
             loss='linear',
             xtol=2.3e-16,
             ftol=2.3e-16,
+            max_nfev=max_nfev,
             verbose=verbose
         )
         
@@ -1017,15 +1379,15 @@ class OFnonlin(object):
                 )
             )
 
-        if lgcplot:
-            plotnonlin(self, pulse, variables, errors)
+        return variables, errors, cov, chi2, success
 
-        if lgcfullrtn:
-            return (variables, errors, cov, chi2, success)
-        else:
-            return variables
 
 
-        
-
+def _dofit_batch_worker(task):
+    """
+    Fit chunk of pulses in worker process
+    (see OFnonlin.dofit_batch)
+    """
 
+    ofnonlin, pulses, kwargs = task
+    return ofnonlin.dofit_batch(pulses, nb_workers=1, **kwargs)
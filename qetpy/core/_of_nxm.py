@@ -2,6 +2,7 @@ import numpy as np
 from scipy.optimize import least_squares
 import matplotlib.pyplot as plt
 from qetpy.utils import shift, interpolate_of, argmin_chisq
+from qetpy.utils import fft, ifft
 from qetpy.core import OFBase
 from numpy.linalg import pinv as pinv
 from qetpy.utils import convert_channel_name_to_list, convert_channel_list_to_name
@@ -319,20 +320,108 @@ class OFnxm:
         self._calc_chi2_allt()
 
 
-        
+    def calc_batch(self, signals):
+        """
+        OF NxM calculations for a batch of events at once
+        (stacked FFT/iFFT and matrix products over events,
+        signals are not stored in OF base). Results are
+        then available as arrays [nevents, ...] using
+        get_fit_withdelay/get_fit_nodelay
+
+        Parameters
+        ----------
+
+        signals : 3D ndarray [nevents, nchans, nsamples]
+           NEEDS TO FOLLOW ORDER of channels argument
+           used in the OFnxm instantiation
+
+        Return:
+        -------
+        None
+
+        """
+
+        # check signals
+        if (not isinstance(signals, np.ndarray)
+            or signals.ndim != 3):
+            raise ValueError('ERROR: Expecting "signals" to be '
+                             'a 3D array [nevents, nchans, nsamples]')
+
+        if signals.shape[1] != self._nchans:
+            raise ValueError('ERROR: Wrong number of channels '
+                             'in "signals" array!')
+
+        if signals.shape[-1] != self._nbins:
+            raise ValueError(f'ERROR: Inconsistent number of samples '
+                             f'between signals ({signals.shape[-1]}) '
+                             f'and template/csd ({self._nbins})')
+
+        if self._of_base._lgc_rfft:
+            raise ValueError('ERROR: Multiple channels OF not available '
+                             'with "lgc_rfft=True"!')
+
+        # clear internal (signal) data
+        self.clear()
+        self._of_base.clear_signal()
+
+        # pre-calculations
+        # phi matrix [nbins, ntmps, nchans], inverted weight matrix
+        # [ntmps, ntmps], inverted covariance matrix [nchans, nchans, nbins]
+        phi_mat = self._of_base.phi(self._channel_name,
+                                    template_tag=self._template_tags)
+        iw_mat = self._of_base.iw_matrix(self._channel_name,
+                                         self._template_tags)
+        icov_f = self._of_base.icovf(self._channel_name)
+
+        # signal fft matrix, frequency major [nbins, nchans, nevents]
+        # (same normalization as OF base signal matrix), matrix
+        # products over channels are then stacked over frequencies
+        signal_fft = np.ascontiguousarray(
+            (fft(signals, axis=-1)/self._nbins).transpose(2, 1, 0)
+        )
+
+        # filtered signal matrix [nevents, ntmps, nbins]
+        # (frequency then time domain)
+        signal_filt = np.matmul(phi_mat, signal_fft).transpose(2, 1, 0)
+        signal_filt_td = np.real(ifft(signal_filt*self._nbins, axis=-1))
+
+        # amplitudes all times [nevents, ntmps, nbins]
+        self._amps_alltimes = iw_mat @ signal_filt_td
+        self._amps_alltimes_rolled = np.roll(self._amps_alltimes,
+                                             self._pretrigger_samples,
+                                             axis=-1)
+
+        # chi2 all times [nevents, nbins]
+        icov_signal_fft = np.matmul(
+            np.ascontiguousarray(icov_f.transpose(2, 0, 1)), signal_fft
+        )
+        chi2base = np.real(np.einsum('fke,fke->e', signal_fft.conjugate(),
+                                     icov_signal_fft))
+        chi2_t = np.sum(self._amps_alltimes*signal_filt_td, axis=1)
+
+        self._chi2_alltimes = chi2base[:, np.newaxis] - chi2_t
+        self._chi2_alltimes_rolled = np.roll(self._chi2_alltimes,
+                                             self._pretrigger_samples,
+                                             axis=-1)
+
+
     def get_fit_nodelay(self):
         """
         New nodelay version of NxM fits. Just returns the nxm best fit
         at the index of pretrigger_samples
+        (arrays [nevents, ...] after calc_batch)
         """
 
         amp_all = self._amps_alltimes_rolled
         chi2_all = self._chi2_alltimes_rolled
         pretrigger_samples = self._pretrigger_samples
         
-        amp = amp_all[:,pretrigger_samples]
+        amp = amp_all[...,pretrigger_samples]
         t0 = (pretrigger_samples)/self._fs
-        chi2 = chi2_all[pretrigger_samples]
+        chi2 = chi2_all[...,pretrigger_samples]
+
+        if chi2_all.ndim == 2:
+            t0 = np.full(chi2_all.shape[0], t0)
 
         # save
         self._of_amp_nodelay = amp
@@ -350,20 +439,65 @@ class OFnxm:
                           pulse_direction_constraint=0,
                           interpolate_t0=False):
         """
-        FIXME
-        #docstrings need to be added with dimensions
-        #returns that send back the ofamp chi2 and t need to be added
-        #interpolate option needs to be added
+        NxM best fit with time delay: minimum chi2 (within
+        window if any)
+
+        Parameters
+        ----------
+
+        window_min_from_trig_usec : float, optional
+           OF filter window start in micro seconds from
+           pretrigger (can be negative if prior pretrigger)
+
+        window_max_from_trig_usec : float, optional
+           OF filter window end in micro seconds from
+           pretrigger (can be negative if prior pretrigger)
+
+        window_min_index : int, optional
+           OF filter window start in ADC samples (used
+           if window_min_from_trig_usec is None)
+
+        window_max_index : int, optional
+           OF filter window end in ADC samples (used
+           if window_max_from_trig_usec is None)
+
+        lgc_outside_window : bool, optional
+           If True, minimum chi2 searched outside window
+           Default: False
+
+        pulse_direction_constraint : int, optional
+           If 1 (-1), only time delays where the amplitudes of
+           ALL templates are positive (negative) are allowed
+           Default: 0 (no constraint)
+
+        interpolate_t0 : bool, optional
+           Not implemented yet
+
+        Return
+        ------
+
+        amp : ndarray [ntmps]
+          best fit amplitudes ([nevents, ntmps] after
+          calc_batch, NaN if no time delay allowed)
+
+        t0 : float
+          best fit time delay in seconds ([nevents]
+          after calc_batch)
+
+        chi2 : float
+          best fit chi2 ([nevents] after calc_batch)
+
         """
 
         amp_all = self._amps_alltimes_rolled
         chi2_all = self._chi2_alltimes_rolled
         pretrigger_samples = self._pretrigger_samples
         
-        # mask pulse direction
+        # mask pulse direction (all templates)
         constraint_mask = None
         if (pulse_direction_constraint==1 or pulse_direction_constraint==-1):
-            constraint_mask=(amp_all*pulse_direction_constraint>0)
+            constraint_mask=np.all(amp_all*pulse_direction_constraint>0,
+                                   axis=-2)
 
         # find index minimum chisq within window
         window_min = None
@@ -393,6 +527,13 @@ class OFnxm:
              window_max = int(window_max)
 
             
+        # batch of events
+        if chi2_all.ndim == 2:
+            return self._get_fit_withdelay_batch(
+                window_min, window_max, lgc_outside_window,
+                constraint_mask
+            )
+
         #argmin_chisq will minimize along the last axis
         #chi2_all dim [ntmp,nbins]
            
@@ -416,6 +557,49 @@ class OFnxm:
         return amp, t0, chi2
 
 
+    def _get_fit_withdelay_batch(self, window_min, window_max,
+                                 lgc_outside_window, constraint_mask):
+        """
+        With delay fits for a batch of events (see calc_batch),
+        return arrays amp [nevents, ntmps], t0 [nevents],
+        chi2 [nevents] (NaN if no allowed time)
+        """
+
+        amp_all = self._amps_alltimes_rolled
+        chi2_all = self._chi2_alltimes_rolled
+        nevents = chi2_all.shape[0]
+
+        # pulse direction constraint (per event)
+        chi2_masked = chi2_all
+        if constraint_mask is not None:
+            chi2_masked = np.where(constraint_mask, chi2_all, np.inf)
+
+        bestind = argmin_chisq(
+            chi2_masked,
+            window_min=window_min,
+            window_max=window_max,
+            lgc_outside_window=lgc_outside_window)
+
+        events = np.arange(nevents)
+        amp = amp_all[events, :, bestind]
+        t0 = (bestind-self._pretrigger_samples)/self._fs
+        chi2 = chi2_all[events, bestind]
+
+        # no allowed time
+        is_valid = np.isfinite(chi2_masked[events, bestind])
+        if not np.all(is_valid):
+            amp[~is_valid] = np.nan
+            t0 = np.where(is_valid, t0, np.nan)
+            chi2 = np.where(is_valid, chi2, np.nan)
+
+        # save
+        self._of_amp_withdelay = amp
+        self._of_chi2_withdelay = chi2
+        self._of_t0_withdelay = t0
+
+        return amp, t0, chi2
+
+
     def _calc_amp_allt(self):
         """
         FIXME
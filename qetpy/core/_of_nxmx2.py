@@ -19,7 +19,7 @@ class OFnxmx2:
                  template_time_tags=None, csd=None, sample_rate=None,
                  pretrigger_msec=None, pretrigger_samples=None,
                  integralnorm=False, fit_window=None,
-                 restrict_time_flag=True,
+                 restrict_time_flag=True, block_size=None,
                  verbose=True):
 
         """
@@ -88,6 +88,14 @@ class OFnxmx2:
 
         restrict_time_flag : boolean, optional
         
+        block_size : int, optional
+            If not None, tiled mode: the time combinations are
+            evaluated in blocks of (about) block_size combinations
+            and only the best fit(s) are kept (see calc "nb_best").
+            The full time combinations, p matrix, amplitudes and
+            chi2 arrays are never allocated (the p matrix is stored
+            per time lag t1-t2).
+            Default: None (all time combinations evaluated at once)
 
         verbose : bool, optional
             Display information
@@ -242,20 +250,33 @@ class OFnxmx2:
                              f'and must have length {self._ntmps}!')
         
         
-        time_combinations = self._of_base.calc_time_combinations(
-            fit_window,
-            restrict_time_flag
-        )
+        self._template_time_tags = template_time_tags
+        self._fit_window = fit_window
+        self._restrict_time_flag = restrict_time_flag
+
+        self._block_size = None
+        if block_size is not None:
+            if block_size < 1:
+                raise ValueError('ERROR: "block_size" should be >= 1!')
+            self._block_size = int(block_size)
+
+        # full time combinations (not in tiled mode)
+        self._time_combinations = None
+        if self._block_size is None:
+
+            time_combinations = self._of_base.calc_time_combinations(
+                fit_window,
+                restrict_time_flag
+            )
                 
-        self._of_base.set_time_constraints(
-            channels,
-            template_tags,
-            template_time_tags,
-            time_combinations
-        )
+            self._of_base.set_time_constraints(
+                channels,
+                template_tags,
+                template_time_tags,
+                time_combinations
+            )
         
-        self._template_time_tags = template_time_tags
-        self._time_combinations = time_combinations
+            self._time_combinations = time_combinations
          
         # add noise to base object
         if csd is not None:
@@ -276,6 +297,26 @@ class OFnxmx2:
         # initialize
         self.clear()
         
+        # p matrix per time lag (tiled mode and
+        # coarse-to-fine search)
+        self._p_matrix_lags = None
+        self._p_matrix_inv_lags = None
+
+        # tiled mode: p matrix per time lag only
+        self._p_matrix = None
+        self._p_matrix_inv = None
+        if self._block_size is not None:
+
+            self._of_base.calc_p_matrix_lags(
+                channels,
+                template_tags,
+                template_time_tags
+            )
+
+            self._calc_p_matrix_lags()
+
+            return
+
         # calulate (if not calculated yet)
         self._of_base.calc_p_matrix(channels,
                                     template_tags=template_tags,
@@ -318,13 +359,44 @@ class OFnxmx2:
         self._index_first_pulse = None
         self._index_second_pulse =  None
         self._of_chi2_per_DOF = None
+
+        # best fits (tiled mode)
+        self._best_amps = None
+        self._best_chi2 = None
+        self._best_time_combinations = None
         
         
-    def calc(self, signal=None, polarity_constraint=False):
+    def calc(self, signal=None, polarity_constraint=False, nb_best=1,
+             decimation=None, nb_candidates=10, chi2_tolerance=None):
         """
         FIXME
         docstrings need to be added with dimensions
         update_signal needs to be called ? from of_base
+
+        nb_best : int, optional
+            tiled mode (block_size not None) or coarse-to-fine search
+            only: number of best (lowest chi2) time combinations kept,
+            see get_best_fits
+            Default: 1
+
+        decimation : int, optional
+            If not None (and > 1), coarse-to-fine search: chi2 is
+            first evaluated on a decimated grid of time combinations
+            (every "decimation" samples for both delays), then
+            exhaustively in the neighbourhood (+/- decimation-1
+            samples) of the best candidates only
+            Default: None (exhaustive search)
+
+        nb_candidates : int, optional
+            coarse-to-fine search: number of best coarse time
+            combinations refined
+            Default: 10
+
+        chi2_tolerance : float, optional
+            coarse-to-fine search: also refine all coarse time
+            combinations with chi2 within chi2_tolerance of the
+            coarse minimum (np.inf = exhaustive search)
+            Default: None
         """
         
         # update signal and do preliminary (signal) calculations
@@ -354,6 +426,22 @@ class OFnxmx2:
 
 
 
+        # coarse-to-fine search
+        if decimation is not None and decimation > 1:
+            is_done = self._calc_coarse_to_fine(
+                decimation, nb_candidates, chi2_tolerance,
+                polarity_constraint=polarity_constraint,
+                nb_best=nb_best
+            )
+            if is_done:
+                return
+
+        # tiled mode
+        if self._block_size is not None:
+            self._calc_tiled(polarity_constraint=polarity_constraint,
+                             nb_best=nb_best)
+            return
+
         # calculate Q vector
         self._calc_q_vector()
 
@@ -375,20 +463,82 @@ class OFnxmx2:
         """
 
         # min chi2 index
-        min_index = np.argmin(self._chi2_allt)
+        if self._best_chi2 is not None:
+            amps_allt = self._best_amps
+            chi2_allt = self._best_chi2
+            time_combinations = self._best_time_combinations
+        else:
+            amps_allt = self._amps_allt
+            chi2_allt = self._chi2_allt
+            time_combinations = self._time_combinations
+
+        min_index = np.argmin(chi2_allt)
         
-        self._of_amp = self._amps_allt[min_index]
-        self._of_t0 =  (self._time_combinations[min_index, 1]/self._fs
-                        - self._time_combinations[min_index, 0]/self._fs)
-        self._of_chi2 = self._chi2_allt[min_index]
-        self._index_first_pulse = self._time_combinations[min_index, 0]
-        self._index_second_pulse =  self._time_combinations[min_index, 1]
+        self._of_amp = amps_allt[min_index]
+        self._of_t0 =  (time_combinations[min_index, 1]/self._fs
+                        - time_combinations[min_index, 0]/self._fs)
+        self._of_chi2 = chi2_allt[min_index]
+        self._index_first_pulse = time_combinations[min_index, 0]
+        self._index_second_pulse =  time_combinations[min_index, 1]
 
         nbins = self._of_base.nb_samples()
         self._of_chi2_per_DOF = self._of_chi2/(self._nchans*nbins)
 
         return self._of_amp, self._of_t0, self._of_chi2
 
+    def get_best_fits(self, nb_best=None):
+        """
+        Get the best fits (lowest chi2 time combinations),
+        sorted by increasing chi2
+
+        Parameters
+        ----------
+
+        nb_best : int, optional
+            number of fits, in tiled mode (block_size not None) or
+            coarse-to-fine search at most the "nb_best" argument
+            of calc
+            Default: all fits kept in tiled mode or coarse-to-fine
+                     search, 1 otherwise
+
+
+        Return
+        ------
+
+        amps : 2D ndarray [nb_best, ntmps]
+            fitted amplitudes
+
+        t0s : 1D ndarray [nb_best]
+            time difference between the 2 delays (t2-t1) in seconds
+
+        chi2s : 1D ndarray [nb_best]
+            chi2
+
+        time_combinations : 2D ndarray [nb_best, 2]
+            delays (t1, t2) in samples
+
+        """
+
+        if self._best_chi2 is not None:
+            amps_allt = self._best_amps
+            chi2_allt = self._best_chi2
+            time_combinations = self._best_time_combinations
+            if nb_best is None:
+                nb_best = len(chi2_allt)
+        else:
+            amps_allt = self._amps_allt
+            chi2_allt = self._chi2_allt
+            time_combinations = self._time_combinations
+            if nb_best is None:
+                nb_best = 1
+
+        inds = _argsort_best(chi2_allt, nb_best)
+        t0s = (time_combinations[inds, 1]/self._fs
+               - time_combinations[inds, 0]/self._fs)
+
+        return (amps_allt[inds], t0s, chi2_allt[inds],
+                time_combinations[inds])
+
     def _calc_q_vector(self):
         """
         Calculate Q vector
@@ -450,24 +600,8 @@ class OFnxmx2:
             self._calc_amps()
 
         
-        # get signal matrix fft
-        signal_matrix_fft = self._of_base.signal_fft(self._channel_name)
-
-        # get invert covariant matrix
-        icovf = self._of_base.icovf(self._channel_name)
-        
-        chi2base = 0
-        for kchan in range(self._nchans):
-            for jchan in range(self._nchans):
-                chi2base += np.sum(
-                    np.dot((signal_matrix_fft[kchan,:].conjugate())
-                           * icovf[kchan,jchan,:],
-                           signal_matrix_fft[jchan,:])
-                )
-
-                
         #chi2base is a time independent scalar on the sum over all channels & freq bins
-        chi2base = np.real(chi2base)
+        chi2base = self._calc_chi2base()
 
         #chi2_t is the time dependent part
         chi2_t = np.zeros_like(self._time_combinations[:,0])
@@ -498,3 +632,261 @@ class OFnxmx2:
 
 
     
+
+
+    def _calc_chi2base(self):
+        """
+        Calculate time independent part of chi2 (sum
+        over all channels and frequency bins)
+        """
+
+        # get signal matrix fft
+        signal_matrix_fft = self._of_base.signal_fft(self._channel_name)
+
+        # get invert covariant matrix
+        icovf = self._of_base.icovf(self._channel_name)
+        
+        chi2base = 0
+        for kchan in range(self._nchans):
+            for jchan in range(self._nchans):
+                chi2base += np.sum(
+                    np.dot((signal_matrix_fft[kchan,:].conjugate())
+                           * icovf[kchan,jchan,:],
+                           signal_matrix_fft[jchan,:])
+                )
+
+        return np.real(chi2base)
+
+
+    def _calc_tiled(self, polarity_constraint=False, nb_best=1):
+        """
+        Tiled mode: calculate amplitudes and chi2 for blocks of
+        time combinations and keep the "nb_best" lowest chi2
+        (same results as _calc_q_vector/_calc_amps/_calc_chi2
+        for these combinations)
+        """
+
+        if nb_best < 1:
+            raise ValueError('ERROR: "nb_best" should be >= 1!')
+
+        signal_filt_matrix_td, chi2base = self._get_signal_data()
+
+        self._init_best()
+
+        for time_combinations in self._of_base.iterate_time_combinations(
+                self._fit_window, self._restrict_time_flag,
+                self._block_size):
+
+            amps, chi2 = self._calc_block(time_combinations,
+                                          signal_filt_matrix_td, chi2base,
+                                          polarity_constraint)
+
+            self._update_best(amps, chi2, time_combinations, nb_best)
+
+
+    def _calc_coarse_to_fine(self, decimation, nb_candidates,
+                             chi2_tolerance, polarity_constraint=False,
+                             nb_best=1):
+        """
+        Coarse-to-fine search: calculate chi2 on a decimated
+        grid of time combinations, then amplitudes and chi2
+        in the neighbourhood of the best candidates and keep
+        the "nb_best" lowest chi2. Return False (nothing done)
+        if the refinement is not smaller than the exhaustive
+        search.
+        """
+
+        if nb_best < 1:
+            raise ValueError('ERROR: "nb_best" should be >= 1!')
+
+        signal_filt_matrix_td, chi2base = self._get_signal_data()
+
+        # coarse grid
+        time_combinations = self._of_base.calc_time_combinations_coarse(
+            self._fit_window, self._restrict_time_flag, decimation
+        )
+
+        block_size = self._block_size
+        if block_size is None:
+            block_size = max(time_combinations.shape[0], 1)
+
+        chi2 = np.concatenate([
+            self._calc_block(time_combinations[istart:istart+block_size],
+                             signal_filt_matrix_td, chi2base,
+                             polarity_constraint)[1]
+            for istart in range(0, time_combinations.shape[0], block_size)
+        ])
+
+        # refine best candidates
+        candidates = self._of_base.select_time_candidates(
+            chi2, nb_candidates, chi2_tolerance
+        )
+
+        # exhaustive search if not smaller
+        if self._time_combinations is not None:
+            nb_combinations = self._time_combinations.shape[0]
+        else:
+            nb_combinations = self._of_base.count_time_combinations(
+                self._fit_window, self._restrict_time_flag
+            )
+
+        if len(candidates)*(2*decimation-1)**2 >= nb_combinations:
+            return False
+
+        time_combinations = self._of_base.calc_time_combinations_refined(
+            time_combinations[candidates], self._fit_window,
+            self._restrict_time_flag, decimation-1
+        )
+
+        self._init_best()
+
+        for istart in range(0, time_combinations.shape[0], block_size):
+
+            time_combinations_block = (
+                time_combinations[istart:istart+block_size]
+            )
+
+            amps, chi2 = self._calc_block(time_combinations_block,
+                                          signal_filt_matrix_td, chi2base,
+                                          polarity_constraint)
+
+            self._update_best(amps, chi2, time_combinations_block, nb_best)
+
+        return True
+
+
+    def _calc_p_matrix_lags(self):
+        """
+        Calculate (if needed) and save p matrix and its
+        inverse per time lag t1-t2
+        """
+
+        if self._p_matrix_lags is not None:
+            return
+
+        self._of_base.calc_p_matrix_lags(
+            self._channel_name,
+            self._template_tags,
+            self._template_time_tags
+        )
+
+        self._p_matrix_inv_lags = (
+            self._of_base.p_matrix_inv_lags(
+                self._channel_name,
+                self._template_tags,
+                self._template_time_tags
+            )
+        )
+
+        self._p_matrix_lags = (
+            self._of_base.p_matrix_lags(
+                self._channel_name,
+                self._template_tags,
+                self._template_time_tags
+            )
+        )
+
+
+    def _get_signal_data(self):
+        """
+        Get filtered signal matrix (time domain) and
+        time independent part of chi2
+        """
+
+        # calc filtered signal matrix td
+        # if not yet calculated
+        self._of_base.calc_signal_filt_matrix_td(
+            self._channel_name,
+            self._template_tags
+        )
+
+        signal_filt_matrix_td = np.asarray(
+            self._of_base.signal_filt_td(
+                self._channel_name,
+                template_tag=self._template_tags)
+        )
+
+        return signal_filt_matrix_td, self._calc_chi2base()
+
+
+    def _calc_block(self, time_combinations, signal_filt_matrix_td,
+                    chi2base, polarity_constraint=False):
+        """
+        Calculate amplitudes [ncombinations, ntmps] and chi2
+        [ncombinations] for the specified time combinations,
+        using the p matrix per time lag
+        """
+
+        self._calc_p_matrix_lags()
+
+        time_tags = np.asarray(self._template_time_tags).astype(int)
+
+        # Q vector [ncombinations, ntmps]
+        q_vector = signal_filt_matrix_td[
+            np.arange(self._ntmps), time_combinations[:, time_tags]
+        ]
+
+        # p matrix inverse for each combination (time lag)
+        lags = time_combinations[:, 0] - time_combinations[:, 1]
+        p_matrix_inv = self._p_matrix_inv_lags[lags]
+
+        amps = np.einsum('kij,kj->ki', p_matrix_inv, q_vector)
+
+        chi2_t = np.real(np.sum(np.conjugate(q_vector) * amps, axis=1))
+        chi2 = chi2base - chi2_t
+
+        if polarity_constraint:
+            chi2_polarity = np.einsum('ki,kij,kj->k', amps,
+                                      self._p_matrix_lags[lags], amps)
+            chi2 -= chi2_polarity - chi2_t
+
+        return amps, chi2
+
+
+    def _init_best(self):
+        """
+        Initialize best fits arrays
+        """
+
+        self._best_amps = np.zeros((0, self._ntmps))
+        self._best_chi2 = np.zeros(0)
+        self._best_time_combinations = np.zeros((0, 2), dtype=int)
+
+
+    def _update_best(self, amps, chi2, time_combinations, nb_best):
+        """
+        Update best fits with new time combinations (earlier
+        combinations first if same chi2)
+        """
+
+        inds = _argsort_best(chi2, nb_best)
+        best_amps = np.concatenate((self._best_amps, amps[inds]))
+        best_chi2 = np.concatenate((self._best_chi2, chi2[inds]))
+        best_time_combinations = np.concatenate(
+            (self._best_time_combinations, time_combinations[inds])
+        )
+
+        inds = _argsort_best(best_chi2, nb_best)
+        self._best_amps = best_amps[inds]
+        self._best_chi2 = best_chi2[inds]
+        self._best_time_combinations = best_time_combinations[inds]
+
+
+
+def _argsort_best(chi2, nb_best):
+    """
+    Indices of the "nb_best" lowest chi2, sorted by chi2
+    (lowest index first if same chi2)
+    """
+
+    nb_best = min(int(nb_best), len(chi2))
+
+    if nb_best == 1:
+        return np.array([np.argmin(chi2)])
+
+    inds = np.arange(len(chi2))
+    if nb_best < len(chi2):
+        inds = np.argpartition(chi2, nb_best-1)[:nb_best]
+        inds = np.sort(inds)
+
+    return inds[np.argsort(chi2[inds], kind='stable')]
@@ -0,0 +1,370 @@
+import os
+import numpy as np
+import multiprocessing
+from qetpy.core import OFBase, OF1x1, OFnxm
+from qetpy.utils import convert_channel_name_to_list, convert_channel_list_to_name
+
+__all__ = ['OFProcessor']
+
+# OF object in worker processes (set by pool initializer)
+_worker_data = dict()
+
+
+
+class OFProcessor:
+    """
+    Multi-process driver for optimal filter (OF1x1 or OFnxm)
+    processing of many traces. The OFBase precalculations
+    (templates, psd/csd, phi, norm, weight and p matrices, ...)
+    are placed once in shared memory (OFBase.export_shared) and
+    attached (read-only, without copy) by each worker process.
+    Traces are processed in chunks and results are returned as
+    a structured array in event order.
+    """
+
+    def __init__(self, of_base, channels,
+                 template_tags='default',
+                 nb_workers=None,
+                 verbose=True):
+        """
+        Initialize OFProcessor
+
+        Parameters
+        ----------
+
+        of_base : OFBase object
+           OF base with templates and psd (1x1) or csd (NxM)
+           already added (pre-calculations are done if needed)
+
+        channels : str or list
+          channel name (1x1) or channels as ordered list or
+          "|" separated string such as "channel1|channel2" (NxM)
+
+        template_tags : str or 2D array, optional
+          template tag (1x1) or 2D array [nchans, ntmps] of
+          template tags (NxM), default='default' (1x1)
+
+        nb_workers : int, optional
+          number of worker processes, if 1, traces are processed
+          in the current process
+          Default: os.cpu_count()
+
+        verbose : bool, optional
+            Display information
+            Default=True
+
+
+        Return
+        ------
+        None
+
+        """
+
+        self._verbose = verbose
+        self._of_base = of_base
+
+        # channels
+        self._channel_list = convert_channel_name_to_list(channels)
+        self._channel_name = convert_channel_list_to_name(channels)
+        self._nchans = len(self._channel_list)
+
+        # OF type
+        self._of_type = '1x1'
+        if (self._nchans > 1
+            or not isinstance(template_tags, str)):
+            self._of_type = 'nxm'
+            template_tags = np.asarray(template_tags)
+            if template_tags.ndim != 2:
+                raise ValueError('ERROR: "template_tags" should be a '
+                                 '2D array [nchans, ntmps] for NxM!')
+
+        self._template_tags = template_tags
+
+        # workers
+        if nb_workers is None:
+            nb_workers = os.cpu_count()
+        if nb_workers < 1:
+            raise ValueError('ERROR: "nb_workers" should be >= 1!')
+        self._nb_workers = int(nb_workers)
+
+        # instantiate OF in current process
+        # (pre-calculations done in OFBase if needed)
+        self._of = _instantiate_of(of_base, self._of_type,
+                                   self._channel_name,
+                                   self._template_tags)
+
+        # pool and shared memory
+        self._pool = None
+        self._shared_info = None
+
+
+    @property
+    def nb_workers(self):
+        return self._nb_workers
+
+    @property
+    def of_type(self):
+        return self._of_type
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __del__(self):
+        # no join during garbage collection or interpreter
+        # shutdown (may block), use close() for orderly shutdown
+        if getattr(self, '_pool', None) is not None:
+            self._pool.terminate()
+            self._pool = None
+
+        if getattr(self, '_shared_info', None) is not None:
+            self._of_base.release_shared(self._shared_info)
+            self._shared_info = None
+
+    def close(self):
+        """
+        Terminate worker processes and release
+        shared memory
+
+        Parameters
+        ----------
+        None
+
+        Return
+        ------
+        None
+
+        """
+
+        if getattr(self, '_pool', None) is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+        if getattr(self, '_shared_info', None) is not None:
+            self._of_base.release_shared(self._shared_info)
+            self._shared_info = None
+
+
+    def process(self, traces, chunk_size=None,
+                lgc_fit_nodelay=True,
+                **kwargs):
+        """
+        Process traces and return OF results
+
+        Parameters
+        ----------
+
+        traces : ndarray or iterable
+          1x1: 2D array [nevents, nbins] or iterable of
+               1D arrays [nbins]
+          NxM: 3D array [nevents, nchans, nbins] or iterable
+               of 2D arrays [nchans, nbins] (same channel order
+               as "channels" argument)
+
+        chunk_size : int, optional
+          number of events per task
+          Default: nevents/(4*nb_workers) for arrays (max 500),
+                   100 for iterables
+
+        lgc_fit_nodelay : bool, optional
+          calculate no-delay OF, default=True
+
+        kwargs :
+          OF1x1.calc arguments (1x1) or OFnxm.get_fit_withdelay
+          arguments (NxM), such as window_min_from_trig_usec,
+          window_max_from_trig_usec, pulse_direction_constraint,
+          ...
+
+        Return
+        ------
+
+        results : structured ndarray [nevents]
+          1x1 fields: amp, t0, chi2, lowchi2, chi2_nopulse
+                      (and amp_nodelay, t0_nodelay, chi2_nodelay,
+                      lowchi2_nodelay if lgc_fit_nodelay=True)
+          NxM fields: amp [ntmps], t0, chi2 (and amp_nodelay,
+                      t0_nodelay, chi2_nodelay if
+                      lgc_fit_nodelay=True)
+
+        """
+
+        # chunks
+        if isinstance(traces, np.ndarray):
+
+            ndim = 2 if self._of_type == '1x1' else 3
+            if traces.ndim != ndim:
+                raise ValueError(f'ERROR: Expecting "traces" to be '
+                                 f'a {ndim}D array!')
+
+            nevents = traces.shape[0]
+            if chunk_size is None:
+                chunk_size = int(np.ceil(nevents/(4*self._nb_workers)))
+                chunk_size = min(max(chunk_size, 1), 500)
+
+            chunks = (traces[istart:istart+chunk_size]
+                      for istart in range(0, nevents, chunk_size))
+        else:
+            if chunk_size is None:
+                chunk_size = 100
+            chunks = _iterate_chunks(traces, chunk_size)
+
+        # tasks
+        tasks = ((chunk, lgc_fit_nodelay, kwargs) for chunk in chunks)
+
+        # process
+        if self._nb_workers == 1:
+            results = [_process_chunk(self._of, self._of_type, *task)
+                       for task in tasks]
+        else:
+            if self._pool is None:
+                self._start_pool()
+            results = list(self._pool.imap(_process_chunk_worker, tasks))
+
+        if not results:
+            return np.zeros(0, dtype=_result_dtype(self._of_type,
+                                                   self._of,
+                                                   lgc_fit_nodelay))
+
+        return np.concatenate(results)
+
+
+    def _start_pool(self):
+        """
+        Export OFBase pre-calculations in shared memory
+        and start worker processes
+        """
+
+        self._shared_info = self._of_base.export_shared()
+
+        if self._verbose:
+            print(f'INFO: Starting {self._nb_workers} OF worker processes '
+                  f'({self._shared_info["size"]/1e6:.1f} MB shared memory)')
+
+        self._pool = multiprocessing.Pool(
+            processes=self._nb_workers,
+            initializer=_init_worker,
+            initargs=(self._shared_info, self._of_type,
+                      self._channel_name, self._template_tags)
+        )
+
+
+
+def _instantiate_of(of_base, of_type, channel_name, template_tags):
+    """
+    Instantiate OF1x1 or OFnxm with existing
+    OF base
+    """
+
+    if of_type == '1x1':
+        return OF1x1(of_base=of_base, channel=channel_name,
+                     template_tag=template_tags,
+                     verbose=False)
+
+    return OFnxm(of_base=of_base, channels=channel_name,
+                 template_tags=template_tags,
+                 verbose=False)
+
+
+def _iterate_chunks(traces, chunk_size):
+    """
+    Group iterable of traces in arrays of
+    (up to) chunk_size events
+    """
+
+    chunk = []
+    for trace in traces:
+        chunk.append(trace)
+        if len(chunk) == chunk_size:
+            yield np.asarray(chunk)
+            chunk = []
+    if chunk:
+        yield np.asarray(chunk)
+
+
+def _result_dtype(of_type, of, lgc_fit_nodelay):
+    """
+    Results structured array dtype
+    """
+
+    if of_type == '1x1':
+        names = ['amp', 't0', 'chi2', 'lowchi2']
+        if lgc_fit_nodelay:
+            names += ['amp_nodelay', 't0_nodelay',
+                      'chi2_nodelay', 'lowchi2_nodelay']
+        names += ['chi2_nopulse']
+        return np.dtype([(name, np.float64) for name in names])
+
+    dtype = [('amp', np.float64, (of._ntmps,)),
+             ('t0', np.float64),
+             ('chi2', np.float64)]
+    if lgc_fit_nodelay:
+        dtype += [('amp_nodelay', np.float64, (of._ntmps,)),
+                  ('t0_nodelay', np.float64),
+                  ('chi2_nodelay', np.float64)]
+    return np.dtype(dtype)
+
+
+def _process_chunk(of, of_type, traces, lgc_fit_nodelay, kwargs):
+    """
+    Process chunk of traces and return results
+    structured array
+    """
+
+    nevents = traces.shape[0]
+    results = np.zeros(nevents,
+                       dtype=_result_dtype(of_type, of, lgc_fit_nodelay))
+
+    if of_type == '1x1':
+
+        of.calc_batch(traces, lgc_fit_nodelay=lgc_fit_nodelay, **kwargs)
+
+        (results['amp'], results['t0'],
+         results['chi2'], results['lowchi2']) = of.get_result_withdelay()
+
+        if lgc_fit_nodelay:
+            (results['amp_nodelay'], results['t0_nodelay'],
+             results['chi2_nodelay'],
+             results['lowchi2_nodelay']) = of.get_result_nodelay()
+
+        results['chi2_nopulse'] = of.get_chisq_nopulse()
+
+        return results
+
+    # NxM
+    of.calc_batch(traces)
+
+    (results['amp'], results['t0'],
+     results['chi2']) = of.get_fit_withdelay(**kwargs)
+
+    if lgc_fit_nodelay:
+        (results['amp_nodelay'], results['t0_nodelay'],
+         results['chi2_nodelay']) = of.get_fit_nodelay()
+
+    return results
+
+
+def _process_chunk_worker(task):
+    """
+    Process chunk of traces in worker process
+    """
+
+    return _process_chunk(_worker_data['of'],
+                          _worker_data['of_type'],
+                          *task)
+
+
+def _init_worker(shared_info, of_type, channel_name, template_tags):
+    """
+    Worker process initializer: attach OFBase pre-calculations
+    from shared memory and instantiate OF
+    """
+
+    of_base = OFBase.attach_shared(shared_info)
+    of_base._verbose = False
+
+    _worker_data['of_type'] = of_type
+    _worker_data['of'] = _instantiate_of(of_base, of_type,
+                                         channel_name, template_tags)
@@ -3,3 +3,4 @@ from ._didv import *
 from ._didv_priors import *
 from ._uncertainties_didv import *
 from ._templates_didv import *
+from ._didv_sweep import *
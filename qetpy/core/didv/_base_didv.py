@@ -5,6 +5,7 @@ from scipy.optimize import least_squares, fsolve
 from qetpy.utils import fft, ifft, fftfreq, rfftfreq
 from qetpy.utils import resample_data
 import copy
+from functools import lru_cache
 
 __all__ = [
     "stdcomplex",
@@ -58,7 +59,239 @@ def _pole_extractor(arg_dict):
             return 2
         else:
             return 3
-        
+
+
+@lru_cache(maxsize=16)
+def _squarewavespectrum(fs, nbins, sgamp, rsh, sgfreq, dutycycle):
+    """
+    Hidden helper function to calculate the analytic DFT of a duty
+    cycled square wave. The spectrum only depends on the trace
+    length and the square wave settings, so it is cached and shared
+    between the (de)convolutions of all traces and fit iterations
+    (returned arrays are read-only).
+
+    """
+
+    tracelength = nbins
+    freq = fftfreq(nbins, fs)
+
+    # analytic DFT of a duty cycled square wave
+    sf = np.zeros_like(freq)*0.0j
+
+    # even frequencies are zero unless the duty cycle is not 0.5
+    if (dutycycle==0.5):
+        # due to float precision, np.mod will have errors on the
+        # order of 1e-10 for large numbers, thus we set a bound on
+        # the error (1e-8)
+        oddinds = ((np.abs(np.mod(np.absolute(freq/sgfreq), 2)-1))<1e-8)
+        sf[oddinds] = 1.0j/(
+            pi*freq[oddinds]/sgfreq
+        )*sgamp*rsh*tracelength
+    else:
+        oddinds = ((np.abs(np.mod(np.abs(freq/sgfreq), 2)-1))<1e-8)
+        sf[oddinds] = -1.0j/(
+            2.0*pi*freq[oddinds]/sgfreq
+        )*sgamp*rsh*tracelength*(
+            np.exp(-2.0j*pi*freq[oddinds]/sgfreq*dutycycle)-1
+        )
+        eveninds = ((np.abs(np.mod(np.abs(freq/sgfreq)+1,2)-1))<1e-8)
+        eveninds[0] = False
+        sf[eveninds] = -1.0j/(
+            2.0*pi*freq[eveninds]/sgfreq
+        )*sgamp*rsh*tracelength*(
+            np.exp(-2.0j*pi*freq[eveninds]/sgfreq*dutycycle)-1
+        )
+
+    # harmonic bins (non-zero square wave spectrum)
+    harmonics = oddinds
+    if dutycycle != 0.5:
+        harmonics = oddinds | eveninds
+
+    freq.flags.writeable = False
+    sf.flags.writeable = False
+    harmonics.flags.writeable = False
+
+    return freq, sf, harmonics
+
+
+class _DIDVModel(object):
+    """
+    Hidden class to evaluate the 1, 2, or 3-pole dIdV model and the
+    weighted fit residual at a fixed set of frequencies (in practice
+    only the square wave harmonics, where the dIdV is defined). The
+    frequency dependent terms and the weights are calculated once at
+    initialization, so that each evaluation by the fitter is cheap.
+
+    """
+
+    def __init__(self, freq, didv, yerr=None):
+        """
+        Initialization of the model
+
+        Parameters
+        ----------
+        freq : ndarray
+            The frequencies at which the model is evaluated
+        didv : ndarray
+            The complex dIdV data at these frequencies
+        yerr : ndarray, optional
+            The complex standard deviation of the dIdV data
+            (real and imaginary parts separately). If None,
+            all the weights are 1.
+
+        """
+
+        self._freq = np.asarray(freq)
+        self._didv = np.asarray(didv)
+
+        # 2j*pi*freq, used by all the models
+        self._omega = 2.0j*pi*self._freq
+
+        # get the weights from yerr, these should be
+        # 1/(standard deviation) for real and imaginary parts
+        if yerr is None:
+            self._weights = 1.0+1.0j
+        else:
+            self._weights = 1.0/yerr.real+1.0j/yerr.imag
+
+    @property
+    def freq(self):
+        return self._freq
+
+    def impedance(self, poles, params):
+        """
+        Calculate the impedance (dvdi) for the fit parameters
+        (A, tau2), (A, B, tau1, tau2), or (A, B, C, tau1, tau2,
+        tau3), with an optional time shift dt at the end (ignored).
+
+        """
+
+        if poles == 1:
+            A, tau2 = params[:2]
+            dvdi = (A*(1.0+self._omega*tau2))
+        elif poles == 2:
+            A, B, tau1, tau2 = params[:4]
+            dvdi = (A*(1.0+self._omega*tau2))+(B/(1.0+self._omega*tau1))
+        elif poles == 3:
+            A, B, C, tau1, tau2, tau3 = params[:6]
+            dvdi = (
+                A*(1.0+self._omega*tau2)
+            )+(
+                B/(1.0+self._omega*tau1-C/(1.0+self._omega*tau3))
+            )
+        else:
+            raise ValueError('ERROR: The number of poles should be '
+                             '1, 2, or 3!')
+
+        return dvdi
+
+    def admittance(self, poles, params):
+        """
+        Calculate the admittance (didv) for the fit parameters
+        (A, tau2, dt), (A, B, tau1, tau2, dt), or (A, B, C, tau1,
+        tau2, tau3, dt), including the time shift dt.
+
+        """
+
+        dt = params[-1]
+
+        return (1.0/self.impedance(poles, params)) * np.exp(
+            -self._omega*dt
+        )
+
+    def impedance_jacobian(self, poles, params):
+        """
+        Calculate the derivatives of the impedance (dvdi) with
+        respect to the fit parameters (same closed forms as the
+        dVdI derivatives in _uncertainties_didv), returned as an
+        array [nparams, nfreqs] (the time shift dt is not included).
+
+        """
+
+        omega = self._omega
+
+        if poles == 1:
+            A, tau2 = params[:2]
+            jac = np.empty((2, self._freq.size), dtype=np.complex128)
+            jac[0] = 1.0+omega*tau2
+            jac[1] = A*omega
+        elif poles == 2:
+            A, B, tau1, tau2 = params[:4]
+            pole1 = 1.0/(1.0+omega*tau1)
+            jac = np.empty((4, self._freq.size), dtype=np.complex128)
+            jac[0] = 1.0+omega*tau2
+            jac[1] = pole1
+            jac[2] = -B*omega*pole1**2
+            jac[3] = A*omega
+        elif poles == 3:
+            A, B, C, tau1, tau2, tau3 = params[:6]
+            pole3 = 1.0/(1.0+omega*tau3)
+            pole1 = 1.0/(1.0+omega*tau1-C*pole3)
+            jac = np.empty((6, self._freq.size), dtype=np.complex128)
+            jac[0] = 1.0+omega*tau2
+            jac[1] = pole1
+            jac[2] = B*pole1**2*pole3
+            jac[3] = -B*omega*pole1**2
+            jac[4] = A*omega
+            jac[5] = -B*C*omega*pole1**2*pole3**2
+        else:
+            raise ValueError('ERROR: The number of poles should be '
+                             '1, 2, or 3!')
+
+        return jac
+
+    def admittance_jacobian(self, poles, params):
+        """
+        Calculate the derivatives of the admittance (didv), including
+        the time shift, with respect to the fit parameters (A, tau2,
+        dt), (A, B, tau1, tau2, dt), or (A, B, C, tau1, tau2, tau3,
+        dt), returned as an array [nparams, nfreqs].
+
+        """
+
+        dvdi = self.impedance(poles, params)
+        ci = self.admittance(poles, params)
+
+        # d(1/dvdi)/dp = -1/dvdi^2 d(dvdi)/dp
+        jac = np.empty((len(params), self._freq.size), dtype=np.complex128)
+        jac[:-1] = -(ci/dvdi)*self.impedance_jacobian(poles, params)
+        jac[-1] = -self._omega*ci
+
+        return jac
+
+    def residual(self, ci):
+        """
+        Calculate the weighted residual of the data and the model
+        admittance ci, splitting up real and imaginary parts of the
+        residual separately.
+
+        """
+
+        # the difference between the data and the fit
+        diff = self._didv - ci
+
+        z1d = np.empty(self._freq.size*2, dtype=np.float64)
+        z1d[0::2] = diff.real*np.real(self._weights)
+        z1d[1::2] = diff.imag*np.imag(self._weights)
+        return z1d
+
+    def residual_jacobian(self, jac):
+        """
+        Calculate the jacobian of the weighted residual from the
+        derivatives of the model admittance (array [nparams,
+        nfreqs]), returned as an array [2*nfreqs, nparams] (as
+        expected by scipy.optimize.least_squares).
+
+        """
+
+        jac = np.asarray(jac)
+
+        z2d = np.empty((self._freq.size*2, jac.shape[0]), dtype=np.float64)
+        z2d[0::2] = -(jac.real*np.real(self._weights)).T
+        z2d[1::2] = -(jac.imag*np.imag(self._weights)).T
+        return z2d
+
+
 def stdcomplex(x, axis=0):
     """
     Function to return complex standard deviation (individually
@@ -501,40 +734,22 @@ class _BaseDIDV(object):
         # get the frequencies for a DFT, based on the sample rate of the data
         dx = x[1]-x[0]
         fs = 1/dx
-        freq = fftfreq(len(x), fs)
-
-        # didv of fit in frequency space
-        ci = _BaseDIDV._threepoleadmittance(freq, A, B, C, tau1, tau2, tau3)
-
-        # analytic DFT of a duty cycled square wave
-        sf = np.zeros_like(freq)*0.0j
-
-        # even frequencies are zero unless the duty cycle is not 0.5
-        if (dutycycle==0.5):
-            # due to float precision, np.mod will have errors on the
-            # order of 1e-10 for large numbers, thus we set a bound on
-            # the error (1e-8)
-            oddinds = ((np.abs(np.mod(np.absolute(freq/sgfreq), 2)-1))<1e-8)
-            sf[oddinds] = 1.0j/(
-                pi*freq[oddinds]/sgfreq
-            )*sgamp*rsh*tracelength
-        else:
-            oddinds = ((np.abs(np.mod(np.abs(freq/sgfreq), 2)-1))<1e-8)
-            sf[oddinds] = -1.0j/(
-                2.0*pi*freq[oddinds]/sgfreq
-            )*sgamp*rsh*tracelength*(
-                np.exp(-2.0j*pi*freq[oddinds]/sgfreq*dutycycle)-1
-            )
-            eveninds = ((np.abs(np.mod(np.abs(freq/sgfreq)+1,2)-1))<1e-8)
-            eveninds[0] = False
-            sf[eveninds] = -1.0j/(
-                2.0*pi*freq[eveninds]/sgfreq
-            )*sgamp*rsh*tracelength*(
-                np.exp(-2.0j*pi*freq[eveninds]/sgfreq*dutycycle)-1
-            )
+
+        # frequencies and analytic DFT of a duty cycled square
+        # wave (cached)
+        freq, sf, harmonics = _squarewavespectrum(
+            fs, tracelength, sgamp, rsh, sgfreq, dutycycle,
+        )
+
+        # didv of fit in frequency space, only needed at the square
+        # wave harmonics (the square wave spectrum is zero elsewhere)
+        ci = _BaseDIDV._threepoleadmittance(
+            freq[harmonics], A, B, C, tau1, tau2, tau3,
+        )
 
         # convolve the square wave with the fit
-        sftes = sf*ci
+        sftes = np.zeros(tracelength, dtype=np.complex128)
+        sftes[harmonics] = sf[harmonics]*ci
 
         # inverse FFT to convert to time domain
         st = ifft(sftes)
@@ -547,7 +762,9 @@ class _BaseDIDV(object):
         """
         Function for taking a trace with a known square wave jitter and
         extracting the complex impedance via deconvolution of the
-        square wave and the TES response in frequency space.
+        square wave and the TES response in frequency space. The
+        trace can be a 2D array [ntraces, nbins], in which case the
+        deconvolution is done for all traces at once.
 
         """
 
@@ -558,34 +775,14 @@ class _BaseDIDV(object):
         dx = x[1]-x[0]
         fs = 1/dx
       
-        # FFT of the trace
-        freq, st = fft(trace, fs)
-
-        # analytic DFT of a duty cycled square wave
-        sf = np.zeros_like(freq)*0.0j
-
-        # even frequencies are zero unless the duty cycle is not 0.5
-        if (dutycycle==0.5):
-            # due to float precision, np.mod will have errors on the order of
-            # 1e-10 for large numbers, thus we set a bound on the error (1e-8)
-            oddinds = ((np.abs(np.mod(np.absolute(freq/sgfreq), 2)-1))<1e-8)
-            sf[oddinds] = 1.0j/(
-                pi*freq[oddinds]/sgfreq
-            )*sgamp*rsh*tracelength
-        else:
-            oddinds = ((np.abs(np.mod(np.abs(freq/sgfreq), 2)-1))<1e-8)
-            sf[oddinds] = -1.0j/(
-                2.0*pi*freq[oddinds]/sgfreq
-            )*sgamp*rsh*tracelength*(
-                np.exp(-2.0j*pi*freq[oddinds]/sgfreq*dutycycle)-1
-            )
-            eveninds = ((np.abs(np.mod(np.abs(freq/sgfreq)+1,2)-1))<1e-8)
-            eveninds[0] = False
-            sf[eveninds] = -1.0j/(
-                2.0*pi*freq[eveninds]/sgfreq
-            )*sgamp*rsh*tracelength*(
-                np.exp(-2.0j*pi*freq[eveninds]/sgfreq*dutycycle)-1
-            )
+        # FFT of the trace(s)
+        freq, st = fft(trace, fs, axis=-1)
+
+        # analytic DFT of a duty cycled square wave (cached, same
+        # for all traces)
+        sf = _squarewavespectrum(
+            fs, tracelength, sgamp, rsh, sgfreq, dutycycle,
+        )[1].copy()
 
         # the tracelength/2 value from the FFT is purely real, which can cause
         # errors when taking the standard deviation (get stddev = 0 for real
@@ -956,24 +1153,16 @@ class _BaseDIDV(object):
             flatinds > 0, flatinds < nbins,
         )]
 
-        #for storing results
-        didvs = list()
-
-        for trace in self._traces:
-            # deconvolve the trace from the square wave to get the
-            # dI/dV in frequency domain
-            didvi = _BaseDIDV._deconvolvedidv(
-                self._time,
-                trace,
-                self._rsh,
-                self._sgamp,
-                self._sgfreq,
-                self._dutycycle,
-            )[1]
-            didvs.append(didvi)
-
-        #convert to numpy structure
-        didvs = np.array(didvs)
+        # deconvolve all the traces from the square wave at once to
+        # get the dI/dV in frequency domain
+        didvs = _BaseDIDV._deconvolvedidv(
+            self._time,
+            self._traces,
+            self._rsh,
+            self._sgamp,
+            self._sgfreq,
+            self._dutycycle,
+        )[1]
 
         # get rid of any NaNs, as these will break the fit 
         cut = np.logical_not(np.isnan(didvs).any(axis=1))
@@ -1006,6 +1195,28 @@ class _BaseDIDV(object):
         self._offset_err = np.std(means)/np.sqrt(self._ntraces)
 
 
+    def _get_fit_inds(self, fcutoff=np.inf):
+        """
+        Hidden method to get the indices of the frequencies used by
+        the fits: the square wave harmonics below the cutoff
+        frequency (the dIdV is not defined at the other frequencies,
+        and neither at the Nyquist frequency, see _deconvolvedidv).
+
+        """
+
+        nbins = len(self._freq)
+
+        harmonics = _squarewavespectrum(
+            self._fs, nbins, self._sgamp, self._rsh,
+            self._sgfreq, self._dutycycle,
+        )[2].copy()
+        harmonics[nbins//2] = False
+
+        return np.flatnonzero(
+            harmonics & (np.abs(self._freq) < fcutoff)
+        )
+
+
     def get_list_fitted_poles(self):
         """
         Function to return a list of poles that 
@@ -1,7 +1,7 @@
 import numpy as np
 from scipy.optimize import least_squares, fsolve
 from qetpy.core._biasparams import get_biasparams_offsets, get_biasparams_ilg
-from ._base_didv import _BaseDIDV, complexadmittance
+from ._base_didv import _BaseDIDV, _DIDVModel, complexadmittance
 from ._plot_didv import _PlotDIDV
 from ._uncertainties_didv import get_smallsignalparams_vals, get_smallsignalparams_cov, get_smallsignalparams_sigmas, get_dPdI_with_uncertainties
 from qetpy.utils import fft, ifft, fftfreq, rfftfreq
@@ -300,6 +300,10 @@ class DIDV(_BaseDIDV, _PlotDIDV):
             
 
             
+        # model evaluation at the fit frequencies (frequency
+        # dependent terms and weights calculated once)
+        model = _DIDVModel(freq, didv, yerr=yerr)
+
         def _residual_calc(params):
             """
             Define a residual for the nonlinear least squares
@@ -307,38 +311,20 @@ class DIDV(_BaseDIDV, _PlotDIDV):
             poles.
 
             """
-            if (poles==1):
-                A, tau2, dt = params
-                ci = DIDV._onepoleadmittance(
-                    freq, A, tau2,
-                ) * np.exp(-2.0j*np.pi*freq*dt)
-
-            elif(poles==2):
-                A, B, tau1, tau2, dt = params
-                ci = DIDV._twopoleadmittance(
-                    freq, A, B, tau1, tau2,
-                ) * np.exp(-2.0j*np.pi*freq*dt)
-                
-            elif(poles==3):
-                A, B, C, tau1, tau2, tau3, dt = params
-                ci = DIDV._threepoleadmittance(
-                    freq, A, B, C, tau1, tau2, tau3,
-                ) * np.exp(-2.0j*np.pi*freq*dt)
-
-            # the difference between the data and the fit
-            diff = didv - ci
-            # get the weights from yerr, these should be
-            # 1/(standard deviation) for real and imaginary parts
-            if (yerr is None):
-                weights = 1.0+1.0j
-            else:
-                weights = 1.0/yerr.real+1.0j/yerr.imag
-            # create the residual vector, splitting up real and imaginary
-            # parts of the residual separately
-            z1d = np.zeros(freq.size*2, dtype=np.float64)
-            z1d[0:z1d.size:2] = diff.real*weights.real
-            z1d[1:z1d.size:2] = diff.imag*weights.imag
-            return z1d
+
+            ci = model.admittance(poles, params)
+            return model.residual(ci)
+
+
+        def _jacobian_calc(params):
+            """
+            Analytic jacobian of the residual with respect to the
+            fit parameters.
+
+            """
+
+            jac = model.admittance_jacobian(poles, params)
+            return model.residual_jacobian(jac)
 
 
         def _residual(var_params):
@@ -367,13 +353,30 @@ class DIDV(_BaseDIDV, _PlotDIDV):
                 np.place(all_params, ~lgcfix, var_params)
                 return _residual_calc(all_params)
 
-        
+
+        def _jacobian(var_params):
+            """
+            Jacobian of _residual, passed to nonlinear
+            least_squares scipy algorithm (only variable
+            parameters columns)
+
+            """
+
+            if fix_params is None:
+                return _jacobian_calc(var_params)
+            else:
+                all_params = np.zeros_like(lgcfix, dtype=float)
+                np.place(all_params, lgcfix, fix_params)
+                np.place(all_params, ~lgcfix, var_params)
+                return _jacobian_calc(all_params)[:, ~lgcfix]
+
 
         if (isloopgainsub1 is None):
             # res1 assumes loop gain > 1, where B<0 and tauI<0
             res1 = least_squares(
                 _residual,
                 p0,
+                jac=_jacobian,
                 bounds=bounds1,
                 loss=loss,
                 max_nfev=max_nfev,
@@ -387,6 +390,7 @@ class DIDV(_BaseDIDV, _PlotDIDV):
             res2 = least_squares(
                 _residual,
                 p02,
+                jac=_jacobian,
                 bounds=bounds2,
                 loss=loss,
                 max_nfev=max_nfev,
@@ -406,6 +410,7 @@ class DIDV(_BaseDIDV, _PlotDIDV):
             res = least_squares(
                 _residual,
                 p02,
+                jac=_jacobian,
                 bounds=bounds2,
                 loss=loss,
                 max_nfev=max_nfev,
@@ -420,6 +425,7 @@ class DIDV(_BaseDIDV, _PlotDIDV):
             res = least_squares(
                 _residual,
                 p0,
+                jac=_jacobian,
                 bounds=bounds1,
                 loss=loss,
                 max_nfev=max_nfev,
@@ -511,6 +517,10 @@ class DIDV(_BaseDIDV, _PlotDIDV):
             self.processtraces()
 
         fit_freqs = np.abs(self._freq) < fcutoff
+
+        # only fit the square wave harmonics (the dIdV is not
+        # defined at the other frequencies)
+        fit_inds = self._get_fit_inds(fcutoff)
              
         # 1-Pole fit
         if poles==1:
@@ -542,9 +552,9 @@ class DIDV(_BaseDIDV, _PlotDIDV):
             
             # 1 pole fitting
             fitparams1, fitcov1, fitcost1 = DIDV._fitdidv(
-                self._freq[fit_freqs],
-                self._didvmean[fit_freqs],
-                yerr=self._didvstd[fit_freqs],
+                self._freq[fit_inds],
+                self._didvmean[fit_inds],
+                yerr=self._didvstd[fit_inds],
                 A0=A0_1pole,
                 tau20=tau20_1pole,
                 dt=dt,
@@ -620,9 +630,9 @@ class DIDV(_BaseDIDV, _PlotDIDV):
        
             # 2 pole fitting
             fitparams2, fitcov2, fitcost2 = DIDV._fitdidv(
-                self._freq[fit_freqs],
-                self._didvmean[fit_freqs],
-                yerr=self._didvstd[fit_freqs],
+                self._freq[fit_inds],
+                self._didvmean[fit_inds],
+                yerr=self._didvstd[fit_inds],
                 A0=A0,
                 B0=B0,
                 tau10=tau10,
@@ -754,9 +764,9 @@ class DIDV(_BaseDIDV, _PlotDIDV):
             
             # 3 pole fitting
             fitparams3, fitcov3, fitcost3 = DIDV._fitdidv(
-                self._freq[fit_freqs],
-                self._didvmean[fit_freqs],
-                yerr=self._didvstd[fit_freqs],
+                self._freq[fit_inds],
+                self._didvmean[fit_inds],
+                yerr=self._didvstd[fit_inds],
                 A0=A0,
                 B0=B0,
                 C0=C0,
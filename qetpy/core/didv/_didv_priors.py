@@ -1,10 +1,9 @@
 import numpy as np
-from numpy import pi
 from scipy.optimize import least_squares, fsolve
 from scipy.fftpack import fft, ifft, fftfreq
 
 from iminuit import Minuit
-from ._base_didv import stdcomplex, complexadmittance, _BaseDIDV
+from ._base_didv import stdcomplex, complexadmittance, _BaseDIDV, _DIDVModel
 from ._didv import didvinitfromdata
 from ._plot_didv import _PlotDIDV
 
@@ -149,6 +148,109 @@ class DIDVPriors(_BaseDIDV, _PlotDIDV):
         return rsh * didv
 
         
+    @staticmethod
+    def _fitparamsfromtes(poles, params):
+        """
+        Function to calculate the fit parameters (A, tau2, dt),
+        (A, B, tau1, tau2, dt), or (A, B, C, tau1, tau2, tau3, dt)
+        directly from the array of Irwin's TES parameters (same
+        conversion as `_BaseDIDV._convertfromtesvalues`, without the
+        dictionary round-trip).
+
+        """
+
+        if poles == 1:
+            rsh, rp, L, dt = params
+            A = rsh + rp
+            return [A, L / A, dt]
+
+        if poles == 2:
+            rsh, rp, r0, beta, l, L, tau0, dt = params
+        elif poles == 3:
+            rsh, rp, r0, beta, l, L, tau0, gratio, tau3, dt = params
+        else:
+            raise ValueError("The number of poles should be 1, 2, or 3.")
+
+        A = rsh + rp + r0 * (1 + beta)
+        B = r0 * l / (1 - l) * (2 + beta)
+        tau1 = tau0 / (1 - l)
+        tau2 = L / A
+
+        if poles == 2:
+            return [A, B, tau1, tau2, dt]
+
+        C = gratio / (1 - l)
+
+        return [A, B, C, tau1, tau2, tau3, dt]
+
+
+    @staticmethod
+    def _fitparamsjacobian(poles, params):
+        """
+        Function to calculate the derivatives of the fit parameters
+        (A, tau2, dt), (A, B, tau1, tau2, dt), or (A, B, C, tau1,
+        tau2, tau3, dt) with respect to Irwin's TES parameters (see
+        `_BaseDIDV._convertfromtesvalues`), returned as an array
+        [nfitparams, ntesparams].
+
+        """
+
+        if poles == 1:
+            rsh, rp, L, dt = params
+            A = rsh + rp
+            jac = np.zeros((3, 4))
+            # A = rsh + rp
+            jac[0, 0:2] = 1
+            # tau2 = L / A
+            jac[1, 0:2] = -L / A**2
+            jac[1, 2] = 1 / A
+            # dt
+            jac[2, 3] = 1
+            return jac
+
+        if poles == 2:
+            rsh, rp, r0, beta, l, L, tau0, dt = params
+        elif poles == 3:
+            rsh, rp, r0, beta, l, L, tau0, gratio, tau3, dt = params
+        else:
+            raise ValueError("The number of poles should be 1, 2, or 3.")
+
+        ntes = len(params)
+        A = rsh + rp + r0 * (1 + beta)
+
+        dA = np.zeros(ntes)
+        dA[0:2] = 1
+        dA[2] = 1 + beta
+        dA[3] = r0
+
+        dB = np.zeros(ntes)
+        dB[2] = l / (1 - l) * (2 + beta)
+        dB[3] = r0 * l / (1 - l)
+        dB[4] = r0 * (2 + beta) / (1 - l)**2
+
+        dtau1 = np.zeros(ntes)
+        dtau1[4] = tau0 / (1 - l)**2
+        dtau1[6] = 1 / (1 - l)
+
+        dtau2 = -L / A**2 * dA
+        dtau2[5] = 1 / A
+
+        ddt = np.zeros(ntes)
+        ddt[-1] = 1
+
+        if poles == 2:
+            return np.array([dA, dB, dtau1, dtau2, ddt])
+
+        dC = np.zeros(ntes)
+        dC[4] = gratio / (1 - l)**2
+        dC[7] = 1 / (1 - l)
+
+        dtau3 = np.zeros(ntes)
+        dtau3[8] = 1
+
+        return np.array([dA, dB, dC, dtau1, dtau2, dtau3, ddt])
+
+
     @staticmethod
     def _fitdidv(freq, didv, poles, priors, invpriorscov, p0, yerr=None, bounds=None,):
         """
@@ -161,6 +263,18 @@ class DIDVPriors(_BaseDIDV, _PlotDIDV):
 
         """
 
+        # model evaluation at the fit frequencies (frequency
+        # dependent terms and weights calculated once)
+        model = _DIDVModel(freq, didv, yerr=yerr)
+
+        def _fitparams(params):
+            """
+            Convert TES parameters to fit parameters.
+
+            """
+
+            return DIDVPriors._fitparamsfromtes(poles, params)
+
         def _residual(params):
             """
             Define a residual for the nonlinear least squares algorithm
@@ -168,37 +282,27 @@ class DIDVPriors(_BaseDIDV, _PlotDIDV):
 
             """
 
-            if poles == 1:
-                rsh, rp, L, dt = params
-                ci = DIDVPriors._onepolescaledadmittance(
-                    freq, rsh, rp, L,
-                ) * np.exp(-2.0j*pi*freq*dt)
-            elif poles == 2:
-                rsh, rp, r0, beta, l, L, tau0, dt = params
-                ci = DIDVPriors._twopolescaledadmittance(
-                    freq, rsh, rp, r0, beta, l, L, tau0,
-                ) * np.exp(-2.0j*pi*freq*dt)
-            elif poles == 3:
-                rsh, rp, r0, beta, l, L, tau0, gratio, tau3, dt = params
-                ci = DIDVPriors._threepolescaledadmittance(
-                    freq, rsh, rp, r0, beta, l, L, tau0, gratio, tau3,
-                ) * np.exp(-2.0j*pi*freq*dt)
-
-            # the difference between the data and the fit
-            diff = didv - ci
-            # get the weights from yerr, these should be
-            # 1/(standard deviation) for real and imaginary parts
-            if (yerr is None):
-                weights = 1.0+1.0j
-            else:
-                weights = 1.0 / yerr.real + 1.0j / yerr.imag
-
-            # create the residual vector, splitting up real and
-            # imaginary parts of the residual separately
-            z1d = np.zeros(freq.size*2, dtype = np.float64)
-            z1d[0:z1d.size:2] = diff.real*weights.real
-            z1d[1:z1d.size:2] = diff.imag*weights.imag
-            return z1d
+            ci = params[0] * model.admittance(poles, _fitparams(params))
+
+            return model.residual(ci)
+
+        def _jacobian(params):
+            """
+            Analytic jacobian of the residual with respect to the
+            TES parameters (chain rule through the fit parameters).
+
+            """
+
+            fitparams = _fitparams(params)
+
+            jac = params[0] * np.dot(
+                DIDVPriors._fitparamsjacobian(poles, params).T,
+                model.admittance_jacobian(poles, fitparams),
+            )
+            # rsh scaling of the admittance
+            jac[0] += model.admittance(poles, fitparams)
+
+            return model.residual_jacobian(jac)
 
 
         def _residualpriors(params):
@@ -222,9 +326,21 @@ class DIDVPriors(_BaseDIDV, _PlotDIDV):
                 (_residual(params))**2 / 2
             ) + _residualpriors(params)**2 / 2
 
+        def _grad_neg_log_likelihood(params):
+            """Analytic gradient of the negative log likelihood."""
+
+            params = np.asarray(params)
+
+            return np.dot(
+                _residual(params), _jacobian(params)
+            ) - np.dot(
+                (invpriorscov + invpriorscov.T) / 2, priors - params
+            )
+
         m = Minuit(
             _neg_log_likelihood,
             p0,
+            grad=_grad_neg_log_likelihood,
         )
 
         if bounds is None:
@@ -355,20 +471,22 @@ class DIDVPriors(_BaseDIDV, _PlotDIDV):
         if self._tmean is None:
             self.processtraces()
 
-        fit_freqs = np.abs(self._freq) < fcutoff
+        # only fit the square wave harmonics (the dIdV is not
+        # defined at the other frequencies)
+        fit_inds = self._get_fit_inds(fcutoff)
 
         guess = self._guessparams(poles, fcutoff, priors)
 
         guess_new = [g if p == 0 else p for g, p in zip(guess, priors)]
 
         params, cov, cost = DIDVPriors._fitdidv(
-            self._freq[fit_freqs],
-            self._didvmean[fit_freqs] * self._rsh,
+            self._freq[fit_inds],
+            self._didvmean[fit_inds] * self._rsh,
             poles,
             priors,
             np.linalg.pinv(priorscov),
             p0=guess_new,
-            yerr=self._didvstd[fit_freqs] * self._rsh,
+            yerr=self._didvstd[fit_inds] * self._rsh,
             bounds=bounds,
         )
 
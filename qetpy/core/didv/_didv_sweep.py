@@ -0,0 +1,289 @@
+import os
+import multiprocessing
+import numpy as np
+from ._didv import DIDV
+
+
+__all__ = [
+    "fit_didv_sweep",
+]
+
+
+# fit parameters stored in the results table
+_PARAM_NAMES = ['A', 'B', 'C', 'tau1', 'tau2', 'tau3', 'dt']
+
+
+
+def fit_didv_sweep(data, poles=(1, 2, 3), fcutoff=np.inf,
+                   lgc_warm_start=True, lgc_descending=True,
+                   nb_workers=None, fit_kwargs=None,
+                   lgc_return_fitresults=False,
+                   verbose=True, **kwargs):
+    """
+    Process and fit the dIdV of many channels and bias points (IV/dIdV
+    sweep). Each channel is processed in a worker process (channels
+    are independent). Within a channel, bias points are fitted
+    sequentially (ordered by bias) and each fit is warm-started
+    from the result of the neighbouring (previously fitted) bias point.
+
+    Parameters
+    ----------
+    data : dict
+        Dictionary with key = (channel, bias) and value = either the
+        raw traces (ndarray [ntraces, nbins]) or a dictionary with
+        the raw traces ("rawtraces" key) and any `qetpy.DIDV`
+        initialization argument specific to that bias point (such
+        as "r0", "rp", "dt0", "sgamp", ...)
+    poles : int or list of int, optional
+        The fits to do for each bias point (1, 2, and/or 3 poles).
+        Default: (1, 2, 3)
+    fcutoff : float, optional
+        The cutoff frequency in Hz, above which data is ignored in
+        the fits. Default is `np.inf` (no cutoff)
+    lgc_warm_start : bool, optional
+        If True (default), the guessed parameters of each fit are the
+        fitted parameters of the neighbouring bias point (same number
+        of poles). If the fit of the neighbouring bias point failed,
+        the default `DIDV.dofit` guess is used.
+    lgc_descending : bool, optional
+        If True (default), bias points are fitted from the largest
+        to the smallest bias (usually from normal to superconducting),
+        otherwise from smallest to largest.
+    nb_workers : int, optional
+        Number of worker processes (at most the number of channels).
+        If 1, channels are processed in the current process.
+        Default: os.cpu_count()
+    fit_kwargs : dict, optional
+        Additional `qetpy.DIDV.dofit` arguments (such as "bounds",
+        "max_nfev", ...), same for all fits
+    lgc_return_fitresults : bool, optional
+        If True, also return the full `qetpy.DIDV.fitresult`
+        dictionaries. Default: False
+    verbose : bool, optional
+        Display information. Default: True
+    kwargs :
+        `qetpy.DIDV` initialization arguments common to all
+        bias points (such as "fs", "sgfreq", "sgamp", "rsh",
+        "tracegain", ...), overwritten by the bias point specific
+        metadata
+
+    Return
+    ------
+    results : structured ndarray [nchannels*nbias*npoles]
+        Results table, one row per channel, bias point and number
+        of poles (bias points in fit order within each channel),
+        fields:
+        channel, bias, poles, A, B, C, tau1, tau2, tau3, dt,
+        A_err, ..., dt_err, falltimes [3] (NaN if not
+        available), cost, offset, offset_err, warm_start (fit
+        warm-started from neighbouring bias point) and success
+        (False if processing or fit raised an exception, in that
+        case the parameters are NaN)
+    fitresults : dict, optional
+        Only if lgc_return_fitresults=True: dictionary with
+        key = (channel, bias) and value = dictionary
+        {poles: `qetpy.DIDV.fitresult(poles)`}
+
+    """
+
+    if isinstance(poles, (int, np.integer)):
+        poles = [poles]
+    poles = [int(ipole) for ipole in poles]
+    for ipole in poles:
+        if ipole not in [1, 2, 3]:
+            raise ValueError('ERROR: The number of poles should '
+                             'be 1, 2, or 3!')
+
+    if fit_kwargs is None:
+        fit_kwargs = dict()
+
+    # group bias points by channel
+    channels = dict()
+    for key, value in data.items():
+
+        if not isinstance(key, tuple) or len(key) != 2:
+            raise ValueError('ERROR: "data" keys should be '
+                             '(channel, bias) tuples!')
+        chan, bias = key
+
+        if isinstance(value, dict):
+            metadata = dict(value)
+            if 'rawtraces' not in metadata:
+                raise ValueError(f'ERROR: "rawtraces" missing for '
+                                 f'{chan} (bias={bias})!')
+        else:
+            metadata = {'rawtraces': value}
+
+        didv_kwargs = dict(kwargs)
+        didv_kwargs.update(metadata)
+
+        if chan not in channels:
+            channels[chan] = list()
+        channels[chan].append((bias, didv_kwargs))
+
+    for chan in channels:
+        channels[chan].sort(key=lambda point: point[0],
+                            reverse=lgc_descending)
+
+    # tasks (one per channel)
+    tasks = [(chan, points, poles, fcutoff, lgc_warm_start,
+              fit_kwargs, verbose) for chan, points in channels.items()]
+
+    # workers
+    if nb_workers is None:
+        nb_workers = os.cpu_count()
+    if nb_workers < 1:
+        raise ValueError('ERROR: "nb_workers" should be >= 1!')
+    nb_workers = min(int(nb_workers), max(len(tasks), 1))
+
+    if verbose:
+        print(f'INFO: Fitting dIdV of {len(data)} bias points '
+              f'({len(channels)} channels) with {nb_workers} '
+              f'process(es)')
+
+    if nb_workers == 1:
+        channel_results = [_fit_channel(task) for task in tasks]
+    else:
+        with multiprocessing.Pool(processes=nb_workers) as pool:
+            channel_results = pool.map(_fit_channel, tasks, chunksize=1)
+
+    # results table
+    rows = list()
+    fitresults = dict()
+    for chan_rows, chan_fitresults in channel_results:
+        rows.extend(chan_rows)
+        fitresults.update(chan_fitresults)
+
+    chan_len = max([len(str(chan)) for chan in channels] + [1])
+    results = np.zeros(len(rows), dtype=_result_dtype(chan_len))
+    for irow, row in enumerate(rows):
+        for name, val in row.items():
+            results[name][irow] = val
+
+    if lgc_return_fitresults:
+        return results, fitresults
+
+    return results
+
+
+def _result_dtype(chan_len):
+    """
+    Results table structured array dtype
+    """
+
+    dtype = [('channel', f'U{chan_len}'),
+             ('bias', np.float64),
+             ('poles', np.int32)]
+    dtype += [(name, np.float64) for name in _PARAM_NAMES]
+    dtype += [(f'{name}_err', np.float64) for name in _PARAM_NAMES]
+    dtype += [('falltimes', np.float64, (3,)),
+              ('cost', np.float64),
+              ('offset', np.float64),
+              ('offset_err', np.float64),
+              ('warm_start', np.bool_),
+              ('success', np.bool_)]
+
+    return np.dtype(dtype)
+
+
+def _warm_start_guess(poles, result):
+    """
+    Convert neighbouring bias point fit result to `DIDV.dofit`
+    guessed parameters. Signs follow the "loop gain > 1" convention
+    of the fit (both loop gain cases are still fitted) and null
+    parameters are not guessed (default guess used instead).
+    """
+
+    params = result['params']
+
+    if poles == 1:
+        guess = [abs(params['A']), params['tau2'], params['dt']]
+    elif poles == 2:
+        guess = [params['A'], -abs(params['B']), -abs(params['tau1']),
+                 params['tau2'], params['dt']]
+    else:
+        guess = [params['A'], -abs(params['B']), -abs(params['C']),
+                 -abs(params['tau1']), params['tau2'], params['tau3'],
+                 params['dt']]
+
+    return [val if (np.isfinite(val) and val != 0) else None
+            for val in guess]
+
+
+def _fit_channel(task):
+    """
+    Process and fit all bias points of a channel, bias points
+    are fitted sequentially with warm start
+    """
+
+    chan, points, poles, fcutoff, lgc_warm_start, fit_kwargs, verbose = task
+
+    rows = list()
+    fitresults = dict()
+
+    # previous (neighbouring) bias point results
+    previous = dict()
+
+    for bias, didv_kwargs in points:
+
+        fitresults[(chan, bias)] = dict()
+
+        try:
+            didvfit = DIDV(**didv_kwargs)
+            didvfit.processtraces()
+        except Exception as err:
+            if verbose:
+                print(f'WARNING: dIdV processing failed for {chan} '
+                      f'(bias={bias}): {err}')
+            didvfit = None
+
+        for ipole in poles:
+
+            row = {'channel': chan, 'bias': bias, 'poles': ipole,
+                   'success': False, 'warm_start': False}
+            for name in _PARAM_NAMES:
+                row[name] = np.nan
+                row[f'{name}_err'] = np.nan
+            row['falltimes'] = np.full(3, np.nan)
+            row['cost'] = np.nan
+            row['offset'] = np.nan
+            row['offset_err'] = np.nan
+
+            if didvfit is None:
+                rows.append(row)
+                continue
+
+            guess_params = None
+            if lgc_warm_start and previous.get(ipole) is not None:
+                guess_params = _warm_start_guess(ipole, previous[ipole])
+                row['warm_start'] = True
+
+            try:
+                didvfit.dofit(ipole, fcutoff=fcutoff,
+                              guess_params=guess_params,
+                              **fit_kwargs)
+                result = didvfit.fitresult(ipole)
+            except Exception as err:
+                if verbose:
+                    print(f'WARNING: {ipole}-pole dIdV fit failed for '
+                          f'{chan} (bias={bias}): {err}')
+                previous[ipole] = None
+                rows.append(row)
+                continue
+
+            for name in _PARAM_NAMES:
+                row[name] = result['params'][name]
+                row[f'{name}_err'] = result['errors'][name]
+
+            row['falltimes'] = result['falltimes']
+            row['cost'] = result['cost']
+            row['offset'] = result['offset']
+            row['offset_err'] = result['offset_err']
+            row['success'] = bool(np.isfinite(result['cost']))
+
+            previous[ipole] = result if row['success'] else None
+            fitresults[(chan, bias)][ipole] = result
+
+            rows.append(row)
+
+    return rows, fitresults
@@ -4,6 +4,7 @@ from scipy import interpolate, signal, constants
 from scipy import ndimage
 from sympy.ntheory import factorrat
 from sympy.core.symbol import S
+from contextlib import contextmanager
 import os
 os.environ["OMP_NUM_THREADS"] = "1"
 os.environ["MKL_NUM_THREADS"] = "1"
@@ -11,9 +12,20 @@ os.environ["NUMEXPR_NUM_THREADS"] = "1"
 os.environ["OPENBLAS_NUM_THREADS"] = "1"
 
 
-# global variable for the fft, fftfreq and
-# ifft functions
+# optional pyFFTW backend
+try:
+    import pyfftw
+    import pyfftw.interfaces.scipy_fft as pyfftw_fft
+    pyfftw.interfaces.cache.enable()
+except ImportError:
+    pyfftw_fft = None
+
+
+# global variables for the fft, fftfreq and
+# ifft functions (use set_fft_config or fft_config
+# to modify)
 FFT_MODULE = 'scipy'
+FFT_WORKERS = None
 
 __all__ = [
     "make_decreasing",
@@ -37,11 +49,17 @@ __all__ = [
     "interpolate_parabola",
     "interpolate_of",
     "argmin_chisq",
+    "set_fft_config",
+    "get_fft_config",
+    "fft_config",
     "fft",
     "ifft",
+    "rfft",
+    "irfft",
     "fftfreq",
     "rfftfreq",
     "energy_resolution",
+    "invert_csd",
     "calc_resolution_nxm", 
     "fold_spectrum",
     "convert_channel_list_to_name",
@@ -1154,7 +1172,7 @@ def argmin_chisq(chisq,
     bestind = np.nan
     
     # number samples
-    nbins = len(chisq)
+    nbins = chisq.shape[-1]
 
     # case constraints
     if (window_min is not None
@@ -1209,7 +1227,93 @@ def argmin_chisq(chisq,
     return bestind
 
 
-def fft(vals, fs=None, axis=-1):
+def set_fft_config(module=None, workers=None):
+    """
+    Set package-level FFT configuration used by fft, ifft,
+    rfft, irfft (and therefore by all qetpy algorithms
+    using these functions)
+
+    Parameters
+    ----------
+    module : str, optional
+      FFT backend: "scipy", "numpy" or "pyfftw" (requires
+      pyFFTW installed). Default: None (unchanged)
+
+    workers : int, optional
+      Maximum number of workers (threads) for parallel
+      computation (scipy and pyfftw only). A negative value
+      wraps around from os.cpu_count() (-1 = all cores).
+      Default: None (unchanged)
+
+    Return
+    ------
+    None
+
+    """
+    global FFT_MODULE, FFT_WORKERS
+    
+    if module is not None:
+        if module not in ['scipy', 'numpy', 'pyfftw']:
+            raise ValueError(
+                'ERROR: only module="scipy", "numpy" or "pyfftw" supported!'
+            )
+        if module == 'pyfftw' and pyfftw_fft is None:
+            raise ValueError('ERROR: pyFFTW is not installed!')
+        FFT_MODULE = module
+
+    if workers is not None:
+        FFT_WORKERS = workers
+
+
+def get_fft_config():
+    """
+    Get package-level FFT configuration
+
+    Return
+    ------
+    config : dict
+      dictionary with "module" and "workers" keys
+
+    """
+
+    return {'module': FFT_MODULE,
+            'workers': FFT_WORKERS}
+
+
+@contextmanager
+def fft_config(module=None, workers=None):
+    """
+    Context manager to temporarily modify the package-level
+    FFT configuration (see set_fft_config), for example:
+
+        with qp.utils.fft_config(workers=-1):
+            of.calc_batch(signals)
+
+    Parameters
+    ----------
+    module : str, optional
+      FFT backend: "scipy", "numpy" or "pyfftw"
+      Default: None (unchanged)
+
+    workers : int, optional
+      Maximum number of workers (threads)
+      Default: None (unchanged)
+
+    """
+    global FFT_MODULE, FFT_WORKERS
+    
+    module_saved = FFT_MODULE
+    workers_saved = FFT_WORKERS
+    
+    set_fft_config(module=module, workers=workers)
+    try:
+        yield
+    finally:
+        FFT_MODULE = module_saved
+        FFT_WORKERS = workers_saved
+
+
+def fft(vals, fs=None, axis=-1, overwrite_x=False, workers=None):
     """
     Calculate 1D FFT and frequency array
  
@@ -1222,6 +1326,15 @@ def fft(vals, fs=None, axis=-1):
       data taking sample rate
       if not None: freqs are returned
 
+    overwrite_x : bool, optional
+      If True, the contents of vals can be destroyed
+      (scipy and pyfftw only, ignored for numpy). Default: False
+
+    workers : int, optional
+      Maximum number of workers to use for parallel
+      computation (scipy and pyfftw only, ignored for numpy).
+      Default: None (package-level setting, see set_fft_config)
+
     Return
     ----------
     
@@ -1234,10 +1347,11 @@ def fft(vals, fs=None, axis=-1):
 
     """
 
-    # module (scipy or numpy)
-    # this is hard coded here on purpose so everyone is
-    # using same module
-  
+    # module (scipy, numpy, or pyfftw) and number of workers
+    # are package-level settings so everyone is using
+    # same module (see set_fft_config)
+    if workers is None:
+        workers = FFT_WORKERS
     
     # check if vals are numpy array
     if not isinstance(vals, np.ndarray):
@@ -1247,7 +1361,13 @@ def fft(vals, fs=None, axis=-1):
     fft_out = []
     freqs = None
     if FFT_MODULE == 'scipy':
-        fft_out = sp.fft.fft(vals, axis=axis, norm=None)
+        fft_out = sp.fft.fft(vals, axis=axis, norm=None,
+                             overwrite_x=overwrite_x, workers=workers)
+        if fs is not None:
+            freqs = sp.fft.fftfreq(fft_out.shape[-1], d=1.0/fs)
+    elif FFT_MODULE == 'pyfftw':
+        fft_out = pyfftw_fft.fft(vals, axis=axis, norm=None,
+                                 overwrite_x=overwrite_x, workers=workers)
         if fs is not None:
             freqs = sp.fft.fftfreq(fft_out.shape[-1], d=1.0/fs)
     elif FFT_MODULE == 'numpy':
@@ -1256,7 +1376,7 @@ def fft(vals, fs=None, axis=-1):
             freqs = np.fft.fftfreq(fft_out.shape[-1], d=1.0/fs)
     else:
         raise ValueError(
-            'ERROR: only module="scipy" or "numpy" supported!'
+            'ERROR: only module="scipy", "numpy" or "pyfftw" supported!'
         )
 
     if freqs is  None:
@@ -1266,7 +1386,7 @@ def fft(vals, fs=None, axis=-1):
 
 
 
-def ifft(vals, axis=-1):
+def ifft(vals, axis=-1, overwrite_x=False, workers=None):
     """
     Compute the 1-D inverse discrete Fourier Transform.
  
@@ -1279,6 +1399,15 @@ def ifft(vals, axis=-1):
      axis over which to compute the inverse DFT. If not given, 
      the last axis is used.
 
+    overwrite_x : bool, optional
+      If True, the contents of vals can be destroyed
+      (scipy and pyfftw only, ignored for numpy). Default: False
+
+    workers : int, optional
+      Maximum number of workers to use for parallel
+      computation (scipy and pyfftw only, ignored for numpy).
+      Default: None (package-level setting, see set_fft_config)
+
 
     Return
     ----------
@@ -1290,10 +1419,11 @@ def ifft(vals, axis=-1):
     
     """
 
-    # module (scipy or numpy)
-    # this is hard coded here on purpose so everyone is
-    # using same module
-  
+    # module (scipy, numpy, or pyfftw) and number of workers
+    # are package-level settings so everyone is using
+    # same module (see set_fft_config)
+    if workers is None:
+        workers = FFT_WORKERS
     
     # check if vals are numpy array
     if not isinstance(vals, np.ndarray):
@@ -1302,18 +1432,162 @@ def ifft(vals, axis=-1):
     # calculate ifft
     arr_out = []
     if FFT_MODULE == 'scipy':
-        arr_out = sp.fft.ifft(vals, axis=axis, norm=None)
+        arr_out = sp.fft.ifft(vals, axis=axis, norm=None,
+                              overwrite_x=overwrite_x, workers=workers)
+    elif FFT_MODULE == 'pyfftw':
+        arr_out = pyfftw_fft.ifft(vals, axis=axis, norm=None,
+                                  overwrite_x=overwrite_x, workers=workers)
     elif FFT_MODULE == 'numpy':
         arr_out = np.fft.ifft(vals, axis=axis, norm=None)
     else:
         raise ValueError(
-            'ERROR: only module="scipy" or "numpy" supported!'
+            'ERROR: only module="scipy", "numpy" or "pyfftw" supported!'
         )
         
     return arr_out
 
 
 
+def rfft(vals, fs=None, axis=-1, overwrite_x=False, workers=None):
+    """
+    Calculate 1D FFT of real input (one-sided: only
+    non-negative frequencies) and frequency array
+ 
+    Parameters
+    ----------
+    vals : nd numpy array 
+      array of (real) values in time domain
+   
+    fs : float  (optional)
+      data taking sample rate
+      if not None: freqs are returned
+
+    axis : int
+     axis over which to compute the FFT. If not given, 
+     the last axis is used.
+
+    overwrite_x : bool, optional
+      If True, the contents of vals can be destroyed
+      (scipy and pyfftw only, ignored for numpy). Default: False
+
+    workers : int, optional
+      Maximum number of workers to use for parallel
+      computation (scipy and pyfftw only, ignored for numpy).
+      Default: None (package-level setting, see set_fft_config)
+
+    Return
+    ----------
+    
+    freqs :  nd numpy array
+       Frequency array associated with FFT (one-sided,
+       if fs argument is not None)
+
+    fft :  nd numpy array
+       Fourier transformed data (one-sided)
+
+    """
+
+    # package-level number of workers
+    if workers is None:
+        workers = FFT_WORKERS
+    
+    # check if vals are numpy array
+    if not isinstance(vals, np.ndarray):
+        raise ValueError('ERROR: first parameter should be '
+                         ' a numpy array')
+    # calculate fft
+    fft_out = []
+    freqs = None
+    if FFT_MODULE == 'scipy':
+        fft_out = sp.fft.rfft(vals, axis=axis, norm=None,
+                              overwrite_x=overwrite_x, workers=workers)
+        if fs is not None:
+            freqs = sp.fft.rfftfreq(vals.shape[axis], d=1.0/fs)
+    elif FFT_MODULE == 'pyfftw':
+        fft_out = pyfftw_fft.rfft(vals, axis=axis, norm=None,
+                                  overwrite_x=overwrite_x, workers=workers)
+        if fs is not None:
+            freqs = sp.fft.rfftfreq(vals.shape[axis], d=1.0/fs)
+    elif FFT_MODULE == 'numpy':
+        fft_out = np.fft.rfft(vals, axis=axis, norm=None)
+        if fs is not None:
+            freqs = np.fft.rfftfreq(vals.shape[axis], d=1.0/fs)
+    else:
+        raise ValueError(
+            'ERROR: only module="scipy", "numpy" or "pyfftw" supported!'
+        )
+
+    if freqs is  None:
+        return fft_out
+    else:
+        return freqs, fft_out
+
+
+def irfft(vals, n=None, axis=-1, overwrite_x=False, workers=None):
+    """
+    Compute the 1-D inverse discrete Fourier Transform of
+    a one-sided spectrum (real output)
+ 
+    Parameters
+    ----------
+    vals : nd numpy array 
+      array of values frequency domain, one-sided
+      (non-negative frequencies only)
+
+    n : int, optional
+      length of the output (number of samples in time
+      domain). If not given, 2*(vals.shape[axis]-1) is 
+      used, so it is required for odd length
+   
+    axis : int
+     axis over which to compute the inverse DFT. If not given, 
+     the last axis is used.
+
+    overwrite_x : bool, optional
+      If True, the contents of vals can be destroyed
+      (scipy and pyfftw only, ignored for numpy). Default: False
+
+    workers : int, optional
+      Maximum number of workers to use for parallel
+      computation (scipy and pyfftw only, ignored for numpy).
+      Default: None (package-level setting, see set_fft_config)
+
+
+    Return
+    ----------
+    
+    arr :  nd numpy array
+     The real time domain array, transformed along the axis 
+     indicated by axis, or the last one if axis is not specified.
+ 
+    """
+
+    # package-level number of workers
+    if workers is None:
+        workers = FFT_WORKERS
+    
+    # check if vals are numpy array
+    if not isinstance(vals, np.ndarray):
+        raise ValueError('ERROR: first parameter should be '
+                         ' a numpy array')
+    # calculate ifft
+    arr_out = []
+    if FFT_MODULE == 'scipy':
+        arr_out = sp.fft.irfft(vals, n=n, axis=axis, norm=None,
+                               overwrite_x=overwrite_x, workers=workers)
+    elif FFT_MODULE == 'pyfftw':
+        arr_out = pyfftw_fft.irfft(vals, n=n, axis=axis, norm=None,
+                                   overwrite_x=overwrite_x, workers=workers)
+    elif FFT_MODULE == 'numpy':
+        arr_out = np.fft.irfft(vals, n=n, axis=axis, norm=None)
+    else:
+        raise ValueError(
+            'ERROR: only module="scipy", "numpy" or "pyfftw" supported!'
+        )
+        
+    return arr_out
+
+
 def fftfreq(nbins, fs):
     """
     Calculate 1D FFT frequency array two-sided
@@ -1336,13 +1610,13 @@ def fftfreq(nbins, fs):
     """
 
     fft_freqs_out = []
-    if FFT_MODULE == 'scipy':
+    if FFT_MODULE == 'scipy' or FFT_MODULE == 'pyfftw':
         fft_freqs_out = sp.fft.fftfreq(nbins, d=1.0/fs)
     elif FFT_MODULE == 'numpy':
         fft_freqs_out = np.fft.fftfreq(nbins, d=1.0/fs)
     else:
         raise ValueError(
-            'ERROR: only FFT_MODULE="scipy" or "numpy" supported!'
+            'ERROR: only FFT_MODULE="scipy", "numpy" or "pyfftw" supported!'
         )
         
     return fft_freqs_out
@@ -1370,13 +1644,13 @@ def rfftfreq(nbins, fs):
     """
 
     fft_freqs_out = []
-    if FFT_MODULE == 'scipy':
+    if FFT_MODULE == 'scipy' or FFT_MODULE == 'pyfftw':
         fft_freqs_out = sp.fft.rfftfreq(nbins, d=1.0/fs)
     elif FFT_MODULE == 'numpy':
         fft_freqs_out = np.fft.rfftfreq(nbins, d=1.0/fs)
     else:
         raise ValueError(
-            'ERROR: only FFT_MODULE="scipy" or "numpy" supported!'
+            'ERROR: only FFT_MODULE="scipy", "numpy" or "pyfftw" supported!'
         )
         
     return fft_freqs_out
@@ -1468,6 +1742,92 @@ def energy_resolution(psd, template,  dpdi, fs,
     
     return energy_res
 
+def invert_csd(csd, method='pinv', lgc_real_signals=None):
+    """
+    Invert CSD (or covariance) matrices for all frequencies
+    at once (stacked numpy.linalg calculations along the
+    frequency axis). The matrices are assumed to be Hermitian
+    (csd[i,j,f] = conj(csd[j,i,f])). If the CSD is the
+    (two-sided) CSD of real signals, only the non-negative
+    frequencies are inverted, the negative frequencies are
+    the complex conjugates.
+
+    Parameters
+    ----------
+
+    csd : 3D ndarray [nchans, nchans, nfreqs]
+      CSD matrices
+
+    method : str, optional
+      'pinv' : pseudo-inverse (Hermitian eigen-decomposition)
+      'inv' : inverse (LU decomposition)
+      'cholesky' : inverse using Cholesky decomposition
+                   (positive definite matrices only)
+      Default: 'pinv'
+
+    lgc_real_signals : bool, optional
+      If True, csd is the two-sided CSD of real signals
+      (csd[:,:,-f] = conj(csd[:,:,f]))
+      Default: None (check csd)
+
+
+    Return
+    ------
+
+    icsd : 3D ndarray [nchans, nchans, nfreqs]
+      inverted CSD matrices
+
+    """
+
+    csd = np.asarray(csd)
+    if csd.ndim != 3 or csd.shape[0] != csd.shape[1]:
+        raise ValueError('ERROR: Expecting "csd" to be a 3D array '
+                         '[nchans, nchans, nfreqs]!')
+
+    nfreqs = csd.shape[-1]
+
+    # check if real signals two-sided CSD
+    if lgc_real_signals is None:
+        lgc_real_signals = np.allclose(
+            csd[:,:,1:], np.conjugate(csd[:,:,:0:-1]),
+            rtol=1e-12, atol=0)
+
+    # frequencies to invert
+    nfreqs_inv = nfreqs
+    if lgc_real_signals:
+        nfreqs_inv = nfreqs//2 + 1
+
+    # stack [nfreqs, nchans, nchans]
+    matrices = np.moveaxis(csd[:,:,:nfreqs_inv], -1, 0)
+
+    if method == 'pinv':
+        imatrices = np.linalg.pinv(matrices, hermitian=True)
+    elif method == 'inv':
+        imatrices = np.linalg.inv(matrices)
+    elif method == 'cholesky':
+        lmatrices = np.linalg.cholesky(matrices)
+        identity = np.broadcast_to(np.eye(matrices.shape[-1]),
+                                   matrices.shape)
+        ilmatrices = np.linalg.solve(lmatrices, identity)
+        imatrices = (np.conjugate(np.swapaxes(ilmatrices, -1, -2))
+                     @ ilmatrices)
+    else:
+        raise ValueError('ERROR: only method="pinv", "inv" or '
+                         '"cholesky" supported!')
+
+    # back to [nchans, nchans, nfreqs]
+    icsd = np.zeros(csd.shape, dtype=np.result_type(imatrices, complex))
+    icsd[:,:,:nfreqs_inv] = np.moveaxis(imatrices, 0, -1)
+
+    # negative frequencies
+    if lgc_real_signals and nfreqs > nfreqs_inv:
+        icsd[:,:,nfreqs_inv:] = np.conjugate(
+            icsd[:,:,1:nfreqs-nfreqs_inv+1][:,:,::-1]
+        )
+
+    return icsd
+
+
 def calc_resolution_nxm(csd, template, fs):
     """
     Calculates the resolution of an NxM OF. To calculate energy resolution corectly,
@@ -1499,37 +1859,24 @@ def calc_resolution_nxm(csd, template, fs):
     
     """
 
-    channels = len(template[:,0,0])
-    amplitudes = len(template[0,:,0])
-    samples = len(template[0,0,:])
+    samples = template.shape[-1]
     
     df = fs/samples
 
-    template_fft = np.zeros_like(template, dtype=np.complex128)
-
-    i = 0
-    while i < len(template_fft[:,0,0]):
-        j = 0
-        while j < len(template_fft[0,:,0]):
-            _, temp_fft = fft(template[i,j,:], int(fs), axis=-1)
-            template_fft[i,j,:] = temp_fft/samples/df
-            j += 1
-        i += 1
-
-    inverse_csd = np.zeros([channels, channels, samples], dtype=np.complex128)
-    i = 0
-    while i < samples:
-        inverse_csd[:, :, i] = np.linalg.inv(csd[:,:, i])
-        i += 1
-
-    integrals_arr = np.zeros(amplitudes)
-    i = 1 #ignore zero frequency bin
-    while i < samples:
-        j = 0
-        while j < amplitudes:
-            integrals_arr[j] += np.abs(np.matmul(np.matmul(template_fft[:,j,i], inverse_csd[:,:,i]), np.transpose(template_fft[:,j,i])))
-            j += 1
-        i += 1
+    # template fft [channels, amplitudes, samples]
+    template_fft = fft(np.asarray(template, dtype=np.float64), axis=-1)
+    template_fft = template_fft/samples/df
+
+    # inverted csd [channels, channels, samples]
+    inverse_csd = invert_csd(csd, method='inv')
+
+    # ignore zero frequency bin
+    integrals_arr = np.sum(
+        np.abs(np.einsum('ajf,abf,bjf->jf',
+                         template_fft[:,:,1:],
+                         inverse_csd[:,:,1:],
+                         template_fft[:,:,1:])),
+        axis=-1)
 
     integrals_arr *= df
     res_arr = integrals_arr**-0.5
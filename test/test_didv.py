@@ -1,6 +1,8 @@
 import qetpy as qp
 import numpy as np
 import pytest
+from qetpy.core.didv._base_didv import _BaseDIDV, _DIDVModel
+from qetpy.core.didv._didv_priors import DIDVPriors
 
 
 def _initialize_didv(poles, sgfreq=100, autoresample=False):
@@ -159,3 +161,207 @@ def test_didv():
         )
 
             
+
+
+def test_deconvolvedidv_batch():
+    """
+    Function for testing that the batched deconvolution of the
+    traces gives the same dIdV as the trace by trace deconvolution,
+    for different duty cycles.
+
+    """
+
+    np.random.seed(0)
+
+    fs = 625e3
+    sgfreq = 100
+    rsh = 5e-3
+    sgamp = 0.009381 / 20000
+
+    t = np.arange(int(4 * fs / sgfreq)) / fs
+    traces = np.random.normal(1, 1e-2, (5, len(t)))
+
+    for dutycycle in [0.5, 0.3]:
+        didvs = _BaseDIDV._deconvolvedidv(
+            t, traces, rsh, sgamp, sgfreq, dutycycle,
+        )[1]
+
+        for trace, didv in zip(traces, didvs):
+            assert np.allclose(
+                _BaseDIDV._deconvolvedidv(
+                    t, trace, rsh, sgamp, sgfreq, dutycycle,
+                )[1],
+                didv,
+                rtol=1e-12,
+            )
+
+
+def test_didv_model():
+    """
+    Function for testing that the cached model evaluation used by the
+    fits gives the same admittance as the 1, 2, and 3-pole
+    admittance functions.
+
+    """
+
+    freq = np.arange(1, 2000, 2) * 100.0
+    params = [0.24, -0.34, -0.05, -5.6e-5, 4.2e-7, 1e-3]
+    dt = 1e-6
+
+    model = _DIDVModel(freq, np.zeros(len(freq), dtype=complex))
+
+    phase = np.exp(-2.0j * np.pi * freq * dt)
+    expected = {
+        1: _BaseDIDV._onepoleadmittance(freq, params[0], params[4]),
+        2: _BaseDIDV._twopoleadmittance(
+            freq, params[0], params[1], params[3], params[4],
+        ),
+        3: _BaseDIDV._threepoleadmittance(freq, *params),
+    }
+    fitparams = {
+        1: [params[0], params[4], dt],
+        2: [params[0], params[1], params[3], params[4], dt],
+        3: params + [dt],
+    }
+
+    for poles in [1, 2, 3]:
+        ci = model.admittance(poles, fitparams[poles])
+        assert np.allclose(ci, expected[poles] * phase, rtol=1e-12)
+
+        residual = model.residual(ci)
+        assert np.allclose(residual[0::2], -ci.real)
+        assert np.allclose(residual[1::2], -ci.imag)
+
+
+def test_didv_jacobian():
+    """
+    Function for testing the analytic jacobians used by the DIDV and
+    DIDVPriors fits against finite differences.
+
+    """
+
+    freq = np.arange(1, 200, 2) * 100.0
+    rng = np.random.default_rng(0)
+    didv = rng.normal(size=len(freq)) + 1.0j * rng.normal(size=len(freq))
+    yerr = rng.uniform(1, 2, len(freq)) + 1.0j * rng.uniform(1, 2, len(freq))
+
+    model = _DIDVModel(freq, didv, yerr=yerr)
+
+    fitparams = {
+        1: [0.24, 4.2e-7, 1e-6],
+        2: [0.24, -0.34, -5.6e-5, 4.2e-7, 1e-6],
+        3: [0.24, -0.34, -0.05, -5.6e-5, 4.2e-7, 1e-3, 1e-6],
+    }
+    tesparams = {
+        1: [5e-3, 6e-3, 1e-7, 1e-6],
+        2: [5e-3, 6e-3, 0.0756, 2, 10, 1e-7, 5e-4, 1e-6],
+        3: [5e-3, 6e-3, 0.0756, 2, 10, 1e-7, 5e-4, 0.5, 1e-3, 1e-6],
+    }
+    tesnames = {
+        1: ['rsh', 'rp', 'L', 'dt'],
+        2: ['rsh', 'rp', 'r0', 'beta', 'l', 'L', 'tau0', 'dt'],
+        3: ['rsh', 'rp', 'r0', 'beta', 'l', 'L', 'tau0', 'gratio', 'tau3',
+            'dt'],
+    }
+    fitnames = {
+        1: ['A', 'tau2', 'dt'],
+        2: ['A', 'B', 'tau1', 'tau2', 'dt'],
+        3: ['A', 'B', 'C', 'tau1', 'tau2', 'tau3', 'dt'],
+    }
+
+    def _numerical_jacobian(func, params):
+        params = np.asarray(params, dtype=float)
+        jac = []
+        for ipar in range(len(params)):
+            step = np.zeros(len(params))
+            step[ipar] = abs(params[ipar]) * 1e-6
+            jac.append(
+                (func(params + step) - func(params - step)) / (2 * step[ipar])
+            )
+        return np.array(jac).T
+
+    def _convert(poles, params):
+        tes = dict.fromkeys(
+            ['rsh', 'rp', 'r0', 'beta', 'l', 'L', 'tau0', 'gratio', 'tau3']
+        )
+        tes.update(zip(tesnames[poles], params))
+        fit = _BaseDIDV._convertfromtesvalues(tes)
+        return np.array([fit[name] for name in fitnames[poles]])
+
+    for poles in [1, 2, 3]:
+        jac = model.residual_jacobian(
+            model.admittance_jacobian(poles, fitparams[poles])
+        )
+        jac_num = _numerical_jacobian(
+            lambda p: model.residual(model.admittance(poles, p)),
+            fitparams[poles],
+        )
+        assert np.allclose(jac, jac_num, rtol=1e-6, atol=1e-6 * np.abs(jac).max())
+
+        jac = DIDVPriors._fitparamsjacobian(poles, tesparams[poles])
+        jac_num = _numerical_jacobian(
+            lambda p: _convert(poles, p), tesparams[poles],
+        )
+        assert np.allclose(jac, jac_num, rtol=1e-6, atol=1e-6 * np.abs(jac).max())
+
+
+def test_fit_didv_sweep():
+    """
+    Function for testing `qetpy.fit_didv_sweep`: the first (cold
+    start) bias point of each channel should give the same results
+    as `qetpy.DIDV`, and multi-process results should be identical
+    to single process results.
+
+    """
+
+    np.random.seed(0)
+
+    rsh = 5e-3
+    fs = 625e3
+    sgfreq = 100
+    sgamp = 0.009381 / 20000
+
+    true_params = {
+        'rsh': rsh, 'rp': 0.006, 'r0': 0.0756, 'i0': 1e-6, 'beta': 2,
+        'L': 1e-7, 'tau0': 500e-6, 'gratio': 0, 'tau3': 0, 'dt': 0,
+    }
+
+    psd_test = np.ones(int(4 * fs / sgfreq)) / 1.3e9**2 / 1e4
+    t = np.arange(len(psd_test)) / fs
+
+    data = dict()
+    for chan in ['chan1', 'chan2']:
+        for bias, loopgain in [(1e-6, 5), (2e-6, 10)]:
+            true_params['l'] = loopgain
+            rawtraces = qp.squarewaveresponse(
+                t, sgamp, sgfreq, true_params, rsh=rsh,
+            ) + qp.gen_noise_from_psd(psd_test, fs=fs, ntraces=20)
+            data[(chan, bias)] = {'rawtraces': rawtraces, 'r0': 0.0756}
+
+    didv_kwargs = dict(fs=fs, sgfreq=sgfreq, sgamp=sgamp, rsh=rsh,
+                       rp=0.006, dt0=-1e-6 - 1 / (2 * sgfreq),
+                       add180phase=True)
+
+    results = []
+    for nb_workers in [1, 2]:
+        results.append(
+            qp.fit_didv_sweep(data, poles=[1, 2], nb_workers=nb_workers,
+                              verbose=False, **didv_kwargs)
+        )
+
+    assert len(results[0]) == 8
+    assert np.all(results[0]['success'])
+    for name in ['A', 'B', 'tau1', 'tau2', 'dt', 'cost']:
+        assert np.array_equal(results[0][name], results[1][name])
+
+    # first bias point (largest bias) is not warm-started
+    didvfit = qp.DIDV(data[('chan1', 2e-6)]['rawtraces'], r0=0.0756,
+                      **didv_kwargs)
+    for irow, poles in enumerate([1, 2]):
+        didvfit.dofit(poles)
+        row = results[0][irow]
+        assert row['channel'] == 'chan1' and row['bias'] == 2e-6
+        assert not row['warm_start']
+        assert np.isclose(row['A'], didvfit.fitresult(poles)['params']['A'])
+
+    assert np.all(results[0]['warm_start'][2:4])
@@ -306,6 +306,88 @@ def test_OFnonlin():
                           1.92735955e-04, 2.60001024e-02], rtol=1e-6)
     """
 
+
+def test_OFnonlin_jacobian():
+    """
+    Testing function for `qetpy.OFnonlin.jacobian`, the analytic
+    jacobian should agree with finite differences of the residuals.
+
+    """
+
+    signal, template, psd = create_example_data()
+    fs = 625e3
+
+    nlin = qp.OFnonlin(psd, fs, template=template)
+    nlin.data = np.fft.fft(signal) / nlin.norm
+    nlin.error = np.sqrt(nlin.psd)
+    nlin.taurise = 20e-6
+
+    params = {
+        1: [4e-6, 6.5e-5, 0.026],
+        2: [4e-6, 2e-5, 6.5e-5, 0.026],
+        3: [9e-6, 1e-6, 2e-5, 6.5e-5, 1.5e-4, 0.026],
+        4: [9e-6, 5e-7, 2e-8, 2e-5, 6.4e-5, 1e-4, 1.9e-4, 0.026],
+    }
+
+    for npolefit, scale_amplitude in [(1, True), (1, False), (2, True),
+                                      (2, False), (3, True), (4, True)]:
+        nlin.npolefit = npolefit
+        nlin.scale_amplitude = scale_amplitude
+
+        p = np.array(params[npolefit])
+        jac = nlin.jacobian(p)
+
+        for ipar in range(len(p)):
+            step = np.zeros(len(p))
+            step[ipar] = 1e-11 if ipar == len(p) - 1 else abs(p[ipar]) * 1e-6
+            jac_num = (
+                nlin.residuals(p + step) - nlin.residuals(p - step)
+            ) / (2 * step[ipar])
+            assert isclose(jac[:, ipar], jac_num, rtol=1e-5,
+                           atol=1e-5 * np.abs(jac[:, ipar]).max())
+
+
+def test_OFnonlin_batch():
+    """
+    Testing function for `qetpy.OFnonlin.dofit_batch`, results
+    (warm-started, multi-process) should agree with event by event
+    `qetpy.OFnonlin.dofit`.
+
+    """
+
+    signal, template, psd = create_example_data()
+    fs = 625e3
+
+    # undo the roll in create_example_data, different amplitudes
+    signal = np.roll(signal, -100)
+    pulses = np.array([signal, 0.5 * signal, 2 * signal])
+
+    nlin = qp.OFnonlin(psd, fs, template=template)
+
+    for npolefit in [1, 2]:
+        results = np.array([
+            nlin.dofit(pulse, npolefit=npolefit, taurise=20e-6,
+                       lgcfullrtn=False)
+            for pulse in pulses
+        ])
+
+        for nb_workers in [1, 2]:
+            variables, errors, cov, chi2, success = nlin.dofit_batch(
+                pulses, npolefit=npolefit, taurise=20e-6,
+                nb_workers=nb_workers,
+            )
+
+            assert variables.shape == results.shape
+            assert cov.shape == (len(pulses), npolefit + 2, npolefit + 2)
+            assert np.all(success)
+            assert isclose(variables, results, rtol=1e-5)
+
+    # object state should be the same as single process
+    nlin_multi = qp.OFnonlin(psd, fs, template=template)
+    nlin_multi.dofit_batch(pulses, npolefit=2, taurise=20e-6, nb_workers=2)
+    for attr in ['npolefit', 'taurise', 'dof', 'error', 'data']:
+        assert isclose(getattr(nlin_multi, attr), getattr(nlin, attr))
+
     
 def test_MuonTailFit():
     """
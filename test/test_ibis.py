@@ -62,3 +62,34 @@ def test_ibis():
     np.all(np.isclose(ivobj.rnorm_err,np.array([[0.03367567, 0.03316034, 0.03328893]])))])
     
     assert np.all([test_val1, test_val2])
+
+
+def test_ibis_linfit():
+    """
+    Testing function for the closed form weighted least squares fit
+    of `IBIS.analyze`, should be the same as `curve_fit` (with
+    absolute sigma) for all bath temperatures and channels.
+
+    """
+
+    from scipy.optimize import curve_fit
+
+    rng = np.random.default_rng(0)
+    x = np.linspace(1e-4, 3e-4, 5) * np.ones((2, 3, 1))
+    yerr = rng.uniform(1e-9, 2e-9, x.shape)
+    y = 0.015 * x + 1.5e-5 + rng.normal(0, 1, x.shape) * yerr
+
+    b, m, b_err, m_err = IBIS._linfit(x, y, yerr)
+
+    for t in range(2):
+        for ch in range(3):
+            popt, pcov = curve_fit(
+                IBIS._fitfunc, x[t, ch], y[t, ch],
+                sigma=yerr[t, ch], absolute_sigma=True,
+            )
+            assert np.allclose([b[t, ch], m[t, ch]], popt, rtol=1e-6)
+            assert np.allclose([b_err[t, ch], m_err[t, ch]],
+                               np.sqrt(np.diag(pcov)), rtol=1e-6)
+
+    with pytest.raises(ValueError):
+        IBIS._linfit(x, y * np.nan, yerr)
@@ -0,0 +1,459 @@
+import numpy as np
+
+from helpers import isclose, create_example_data
+import qetpy as qp
+
+
+def _create_batch_data(nevents=4):
+    """
+    Helper function for creating a batch of example traces
+    (with alternating pulse polarity), the template and psd.
+
+    """
+
+    signals = []
+    for ievent in range(nevents):
+        signal, template, psd = create_example_data()
+        signals.append(signal * (-1)**ievent)
+
+    # add independent noise to each event
+    rng = np.random.default_rng(0)
+    signals = np.array(signals) + rng.normal(0, 2e-8, (nevents, len(template)))
+
+    return signals, template, psd
+
+
+def _create_nxm_data(templates, psd):
+    """
+    Helper function for creating 2 channels NxM inputs: the
+    templates [2, ntmps, nbins] (same templates for both
+    channels), the template tags [2, ntmps], and a csd with
+    correlated channels.
+
+    """
+
+    nbins = len(psd)
+
+    templates = np.stack([np.stack(templates)] * 2)
+    template_tags = np.array(
+        [[f'{chr(ord("a") + itmp)}{ichan + 1}'
+          for itmp in range(templates.shape[1])]
+         for ichan in range(2)], dtype=object)
+
+    csd = np.zeros((2, 2, nbins))
+    csd[0, 0] = psd
+    csd[1, 1] = 2 * psd
+    csd[0, 1] = csd[1, 0] = 0.3 * psd
+
+    return templates, template_tags, csd
+
+
+def _create_twosided_psd(nbins, fs=625e3, noise_std=2e-8):
+    """
+    Helper function for creating a two-sided (symmetric) psd.
+
+    """
+
+    rng = np.random.default_rng(1)
+    noise = rng.normal(0, noise_std, (50, nbins))
+    _, psd = qp.calc_psd(noise, fs=fs, folded_over=False)
+
+    return psd
+
+
+def test_of1x1_calc_batch():
+    """
+    Testing function for `qetpy.OF1x1.calc_batch`, results
+    should be identical to event by event `qetpy.OF1x1.calc`.
+
+    """
+
+    signals, template, psd = _create_batch_data()
+    fs = 625e3
+
+    of = qp.OF1x1(template=template, psd=psd, sample_rate=fs,
+                  pretrigger_samples=len(template)//2,
+                  verbose=False)
+
+    for kwargs in [dict(),
+                   dict(interpolate_t0=True),
+                   dict(pulse_direction_constraint=1,
+                        window_min_from_trig_usec=-200,
+                        window_max_from_trig_usec=300)]:
+
+        res_withdelay = []
+        res_nodelay = []
+        for signal in signals:
+            of.calc(signal=signal, **kwargs)
+            res_withdelay.append(of.get_result_withdelay())
+            res_nodelay.append(of.get_result_nodelay())
+
+        of.calc_batch(signals, **kwargs)
+
+        assert isclose(np.array(of.get_result_withdelay()),
+                       np.array(res_withdelay).T, rtol=1e-8)
+        assert isclose(np.array(of.get_result_nodelay()),
+                       np.array(res_nodelay).T, rtol=1e-8)
+
+
+def test_of1x1_rfft():
+    """
+    Testing function for the one-sided (`lgc_rfft=True`) mode of
+    `qetpy.OFBase`, results should be identical to the two-sided mode.
+
+    """
+
+    signals, template, _ = _create_batch_data()
+    fs = 625e3
+
+    # odd and even number of samples
+    for nbins in [len(template), len(template) - 1]:
+
+        psd = _create_twosided_psd(nbins, fs=fs)
+
+        results = []
+        for lgc_rfft in [False, True]:
+
+            of_base = qp.OFBase(fs, verbose=False, lgc_rfft=lgc_rfft)
+            of_base.add_template('chan', template[:nbins],
+                                 pretrigger_samples=nbins//2)
+            of_base.set_psd('chan', psd.copy())
+
+            of = qp.OF1x1(of_base=of_base, channel='chan', verbose=False)
+            of.calc_batch(signals[:, :nbins], interpolate_t0=True)
+
+            result = list(of.get_result_withdelay())
+            result.extend(of.get_result_nodelay())
+            result.append(of.get_amplitude_resolution())
+            result.append(of.get_time_resolution(1e-7))
+            results.append(result)
+
+        for val, val_rfft in zip(*results):
+            assert isclose(val, val_rfft, rtol=1e-8)
+
+
+def test_of1x1_workspace():
+    """
+    Testing function for the preallocated arrays (`lgc_workspace=True`)
+    mode of `qetpy.OFBase`, results should be the same as the default
+    mode, event by event.
+
+    """
+
+    signals, template, _ = _create_batch_data()
+    psd = _create_twosided_psd(len(template))
+    fs = 625e3
+
+    results = []
+    for lgc_workspace in [False, True]:
+
+        of_base = qp.OFBase(fs, verbose=False, lgc_workspace=lgc_workspace)
+        of_base.add_template('chan', template, pretrigger_samples=100)
+        of_base.set_psd('chan', psd.copy())
+
+        of = qp.OF1x1(of_base=of_base, channel='chan', verbose=False)
+
+        result = []
+        for signal in signals:
+            of.calc(signal=signal)
+            result.append(of.get_result_withdelay() + of.get_result_nodelay())
+        results.append(result)
+
+    assert isclose(results[0], results[1], rtol=1e-10)
+
+
+def test_of_processor():
+    """
+    Testing function for `qetpy.OFProcessor`, results (multi-process
+    and single process) should be identical to `qetpy.OF1x1.calc`,
+    in event order.
+
+    """
+
+    signals, template, psd = _create_batch_data(nevents=6)
+    fs = 625e3
+
+    of = qp.OF1x1(template=template, psd=psd, sample_rate=fs,
+                  pretrigger_samples=len(template)//2,
+                  verbose=False)
+
+    res_withdelay = []
+    for signal in signals:
+        of.calc(signal=signal, interpolate_t0=True)
+        res_withdelay.append(of.get_result_withdelay())
+    res_withdelay = np.array(res_withdelay).T
+
+    for nb_workers in [1, 2]:
+        with qp.OFProcessor(of._of_base, 'unknown', nb_workers=nb_workers,
+                            verbose=False) as processor:
+            results = processor.process(signals, chunk_size=4,
+                                        interpolate_t0=True)
+
+        for ival, name in enumerate(['amp', 't0', 'chi2', 'lowchi2']):
+            assert isclose(results[name], res_withdelay[ival], rtol=1e-8)
+
+
+def test_of_base_shared(tmp_path):
+    """
+    Testing function for `qetpy.OFBase.export_shared` and
+    `qetpy.OFBase.attach_shared` (shared memory and memory-mapped
+    file), results should be identical to the original OF base.
+
+    """
+
+    signal, template, psd = create_example_data()
+    fs = 625e3
+
+    of_base = qp.OFBase(fs, verbose=False)
+    of = qp.OF1x1(of_base=of_base, template=template, psd=psd,
+                  pretrigger_samples=len(template)//2,
+                  verbose=False)
+    of.calc(signal=signal)
+    result = of.get_result_withdelay()
+
+    for filename in [None, str(tmp_path / 'of_base.dat')]:
+
+        shared_info = of_base.export_shared(filename=filename)
+        of_base_shared = qp.OFBase.attach_shared(shared_info)
+
+        phi = of_base_shared.phi('unknown', 'default')
+        assert not phi.flags.writeable
+        assert isclose(phi, of_base.phi('unknown', 'default'))
+
+        of_shared = qp.OF1x1(of_base=of_base_shared, verbose=False)
+        of_shared.calc(signal=signal)
+        assert isclose(of_shared.get_result_withdelay(), result)
+
+        of_base.release_shared(shared_info)
+
+
+def test_of_cache(tmp_path):
+    """
+    Testing function for `qetpy.OFCache`: NxM pre-calculations
+    should be reloaded from the cache with identical results, and
+    least recently used entries should be deleted when the maximum
+    size is reached.
+
+    """
+
+    signal, template, psd = create_example_data()
+    nbins = len(template)
+
+    templates, template_tags, csd = _create_nxm_data(
+        [template], psd)
+    signals = np.stack([signal, 0.8 * signal])
+
+    cache = qp.OFCache(str(tmp_path), verbose=False)
+
+    results = []
+    for icalc in range(2):
+        of_base = qp.OFBase(625e3, verbose=False, cache=cache)
+        of = qp.OFnxm(of_base=of_base, channels='chan1|chan2',
+                      templates=templates, template_tags=template_tags,
+                      csd=csd, pretrigger_samples=nbins//2,
+                      verbose=False)
+        of.calc(signals)
+        results.append(of.get_fit_withdelay())
+
+        # icovf, phi matrix and weight matrix
+        assert len(list(tmp_path.glob('ofcache_*.npz'))) == 3
+
+    assert isclose(results[0][0], results[1][0])
+    assert isclose(results[0][2], results[1][2])
+
+    # LRU eviction
+    cache = qp.OFCache(str(tmp_path), max_size_mb=cache.size_mb,
+                       verbose=False)
+    cache.save(cache.hash_key('test'), array=np.zeros(1000))
+    assert len(list(tmp_path.glob('ofcache_*.npz'))) < 4
+    assert cache.size_mb <= cache.max_size_mb
+    assert cache.load(cache.hash_key('test')) is not None
+
+
+def test_ofnxmx2_tiled():
+    """
+    Testing function for the tiled time combinations mode
+    (`block_size`) of `qetpy.OFnxmx2`, best fits should be
+    identical to the full time combinations mode.
+
+    """
+
+    signal, template, psd = create_example_data()
+    nbins = len(template)
+
+    templates, template_tags, csd = _create_nxm_data(
+        [template, np.roll(template, 10)], psd)
+    signals = np.stack([signal + 0.5 * np.roll(signal, 30), 0.8 * signal])
+
+    for polarity_constraint in [False, True]:
+
+        results = []
+        for block_size in [None, 500]:
+            of = qp.OFnxmx2(channels='chan1|chan2', templates=templates,
+                            template_tags=template_tags,
+                            template_time_tags=np.array([0, 1]),
+                            csd=csd, sample_rate=625e3,
+                            pretrigger_samples=nbins//2,
+                            fit_window=[[-40, 40], [-40, 40]],
+                            block_size=block_size, verbose=False)
+            of.calc(signals, polarity_constraint=polarity_constraint,
+                    nb_best=3)
+            results.append(of.get_fit() + of.get_best_fits(3))
+
+        for val, val_tiled in zip(*results):
+            assert isclose(val, val_tiled, rtol=1e-10)
+
+
+def test_of_coarse_to_fine():
+    """
+    Testing function for the coarse-to-fine two-pulse search
+    (`decimation`) of `qetpy.OF1x2` and `qetpy.OFnxmx2`, best
+    fits should be identical to the exhaustive search.
+
+    """
+
+    signal, template, psd = create_example_data()
+    nbins = len(template)
+    fs = 625e3
+
+    template_2 = 0.7 * template + 0.3 * np.roll(template, 5)
+    signal = signal + 0.6 * np.roll(signal, 60)
+
+    of = qp.OF1x2(template_1=template, template_2=template_2, psd=psd,
+                  sample_rate=fs, pretrigger_samples=nbins//2,
+                  fit_window=[[-100, 100], [-100, 100]], verbose=False)
+
+    for kwargs in [dict(),
+                   dict(flag_polarity_constraints=True),
+                   dict(flag_polarity_constraints=True, method='hard')]:
+
+        results = []
+        for decimation in [None, 4]:
+            of._of_base.clear_signal()
+            of.calc(signal, decimation=decimation, **kwargs)
+            results.append([of._chi2, of._time_first_pulse,
+                            of._time_second_pulse,
+                            of._amplitude[of._template_1_tag],
+                            of._amplitude[of._template_2_tag]])
+
+        assert isclose(results[0], results[1], rtol=1e-10)
+
+    # OFnxmx2
+    templates, template_tags, csd = _create_nxm_data(
+        [template, template_2], psd)
+    signals = np.stack([signal, 0.8 * signal])
+
+    for block_size in [None, 500]:
+
+        of = qp.OFnxmx2(channels='chan1|chan2', templates=templates,
+                        template_tags=template_tags,
+                        template_time_tags=np.array([0, 1]),
+                        csd=csd, sample_rate=fs,
+                        pretrigger_samples=nbins//2,
+                        fit_window=[[-100, 100], [-100, 100]],
+                        block_size=block_size, verbose=False)
+
+        results = []
+        for decimation in [None, 4]:
+            of.calc(signals, nb_best=2, decimation=decimation)
+            results.append(of.get_fit() + of.get_best_fits(1))
+
+        for val, val_coarse in zip(*results):
+            assert isclose(val, val_coarse, rtol=1e-10)
+
+    # number of time combinations (t1 <= t2)
+    assert of._of_base.count_time_combinations(
+        [[-100, 100], [-100, 100]], True) == 200 * 201 // 2
+
+
+def test_of1x3_ordered():
+    """
+    Testing function for the ordered time combinations search
+    (`min_separation`) of `qetpy.OF1x3`, results should be the
+    same with and without branch-and-bound pruning, and the
+    pulses should be found.
+
+    """
+
+    _, template, psd = create_example_data()
+    nbins = len(template)
+    fs = 625e3
+
+    template_2 = np.roll(template, 3)
+    template_3 = np.roll(template, 8)
+
+    noise = qp.gen_noise_from_psd(psd, fs=fs, ntraces=1)[0]
+    signal = (noise + 4e-6 * np.roll(template, -60)
+              + 3e-6 * np.roll(template_2, 10)
+              + 5e-6 * np.roll(template_3, 80))
+
+    of = qp.OF1x3(template_1=template, template_2=template_2,
+                  template_3=template_3, psd=psd, sample_rate=fs,
+                  pretrigger_samples=nbins//2, verbose=False)
+
+    results = []
+    for lgc_prune in [False, True]:
+        of._of_base.clear_signal()
+        of.calc(signal, fit_window=[[-100, 100]]*3, min_separation=50,
+                block_size=5000, lgc_prune=lgc_prune)
+        results.append([of._chi2, of._time_first_pulse,
+                        of._time_second_pulse, of._time_third_pulse,
+                        of._amplitude[of._template_1_tag],
+                        of._amplitude[of._template_2_tag],
+                        of._amplitude[of._template_3_tag]])
+
+    assert isclose(results[0], results[1])
+    assert results[1][1:4] == [-60, 10, 80]
+    assert isclose(results[1][4:], [4e-6, 3e-6, 5e-6], rtol=0.05)
+
+
+def test_ofnxm_calc_batch():
+    """
+    Testing function for `qetpy.OFnxm.calc_batch`, results
+    should be identical to event by event `qetpy.OFnxm.calc`.
+
+    """
+
+    signals, template, psd = _create_batch_data()
+    nbins = len(template)
+
+    templates, template_tags, csd = _create_nxm_data(
+        [template, np.roll(template, 10)], psd)
+    signals = np.stack([signals, 0.8 * np.roll(signals, 5, axis=-1)], axis=1)
+
+    of = qp.OFnxm(channels='chan1|chan2', templates=templates,
+                  template_tags=template_tags, csd=csd,
+                  sample_rate=625e3, pretrigger_samples=nbins//2,
+                  verbose=False)
+
+    for kwargs in [dict(),
+                   dict(window_min_from_trig_usec=-200,
+                        window_max_from_trig_usec=300),
+                   dict(pulse_direction_constraint=1)]:
+
+        res_withdelay = []
+        res_nodelay = []
+        for signal in signals:
+            of.calc(signal=signal)
+            res_withdelay.append(of.get_fit_withdelay(**kwargs))
+            res_nodelay.append(of.get_fit_nodelay())
+
+        of.calc_batch(signals)
+        results = [of.get_fit_withdelay(**kwargs), of.get_fit_nodelay()]
+
+        for result, res in zip(results, [res_withdelay, res_nodelay]):
+            for ival in range(3):
+                assert isclose(result[ival],
+                               np.array([val[ival] for val in res]),
+                               rtol=1e-8)
+
+    # multi-process driver (NxM batches)
+    with qp.OFProcessor(of._of_base, 'chan1|chan2',
+                        template_tags=template_tags, nb_workers=1,
+                        verbose=False) as processor:
+        results = processor.process(signals, chunk_size=3, **kwargs)
+
+    for ival, name in enumerate(['amp', 't0', 'chi2']):
+        assert isclose(results[name],
+                       np.array([val[ival] for val in res_withdelay]),
+                       rtol=1e-8)
@@ -2,13 +2,17 @@ import pytest
 import numpy as np
 
 from helpers import isclose
-from qetpy import calc_psd
+from scipy.signal import csd
+from qetpy import (calc_psd, calc_csd, NoiseAccumulator, Noise, gen_noise,
+                   gen_noise_batches)
 from qetpy.cut import removeoutliers, iterstat
 from qetpy.core.didv._base_didv import stdcomplex
 from qetpy.utils import (lowpassfilter, align_traces,
-                         calc_offset, energy_absorbed, powertrace_simple,
+                         calc_offset, energy_absorbed, powertrace_simple, slope,
                          shift, make_template, estimate_g,
-                         resample_factors, resample_data)
+                         resample_factors, resample_data,
+                         fft, ifft, get_fft_config, fft_config,
+                         invert_csd)
 
 def test_shift():
     """Testing function for `qetpy.utils.shift`."""
@@ -74,6 +78,135 @@ def test_calc_psd():
 
     assert len(res)>0
 
+def test_calc_csd():
+    """Testing function for `qetpy.calc_csd` (chunked), compared
+    to `scipy.signal.csd` trace by trace."""
+
+    traces = np.random.randn(10, 2, 1001)
+    fs = 625e3
+
+    for folded_over in [False, True]:
+        freqs, res = calc_csd(traces, fs=fs, folded_over=folded_over,
+                              use_hann_window=True, chunk_size=3)
+
+        expected = np.mean([csd(trace[0], trace[1], fs=fs, window='hann',
+                                nperseg=1001, nfft=1001,
+                                return_onesided=folded_over)[1]
+                            for trace in traces], axis=0)
+
+        assert len(freqs) == len(expected)
+        assert isclose(res[0, 1], expected, rtol=1e-8)
+
+def test_noise_accumulator():
+    """Testing function for `qetpy.NoiseAccumulator`, results
+    should be the same as `qetpy.calc_psd` and `qetpy.calc_csd` with
+    all traces at once."""
+
+    traces = np.random.randn(50, 3, 500)
+    traces[:, 1] += 0.5 * traces[:, 0]
+    fs = 625e3
+
+    accumulator = NoiseAccumulator(fs, folded_over=True)
+    for istart in range(0, 50, 16):
+        accumulator.update(traces[istart:istart+16])
+
+    assert accumulator.ntraces == 50
+    assert isclose(accumulator.get_psd()[1],
+                   calc_psd(traces, fs=fs, folded_over=True)[1])
+    assert isclose(accumulator.get_csd()[1],
+                   calc_csd(traces, fs=fs, folded_over=True)[1])
+
+    # standard deviation
+    traces_csd = np.array([calc_csd(trace, fs=fs, folded_over=True)[1]
+                           for trace in traces])
+    real_csd_std, imag_csd_std = accumulator.get_csd_std()
+    assert isclose(real_csd_std, np.std(np.real(traces_csd), axis=0),
+                   rtol=1e-6, atol=1e-20)
+    assert isclose(imag_csd_std, np.std(np.imag(traces_csd), axis=0),
+                   rtol=1e-6, atol=1e-20)
+
+    # large csd mean with small spread (common sinusoid)
+    sinusoid = 1e3 * np.sin(2 * np.pi * 10 * np.arange(500) / 500)
+    traces = 1e-3 * np.random.randn(50, 3, 500) + sinusoid
+
+    accumulator = NoiseAccumulator(fs, folded_over=True)
+    for istart in range(0, 50, 16):
+        accumulator.update(traces[istart:istart+16])
+
+    traces_csd = np.array([calc_csd(trace, fs=fs, folded_over=True)[1]
+                           for trace in traces])
+    real_csd_std, _ = accumulator.get_csd_std()
+    assert isclose(real_csd_std[..., 10],
+                   np.std(np.real(traces_csd), axis=0)[..., 10],
+                   rtol=1e-6)
+
+def test_noise_slope_corrcoeff():
+    """Testing function for `qetpy.Noise.remove_trace_slope` and
+    `qetpy.Noise.calculate_corrcoeff`."""
+
+    traces = np.random.randn(40, 2, 256)
+    traces[:, 1] += traces[:, 0]
+    traces += np.arange(256) * np.random.randn(40, 2, 1)
+
+    noise = Noise(traces, 625e3, ['chan1', 'chan2'])
+    noise.remove_trace_slope()
+
+    for ichan in range(2):
+        for itrace in range(40):
+            assert abs(slope(noise.time, noise.traces[itrace, ichan])) < 1e-6
+
+    noise.calculate_corrcoeff()
+    traces_fft = np.abs(np.fft.rfft(noise.traces))
+
+    assert isclose(noise.corrcoeff[:, :, 10],
+                   np.corrcoef(traces_fft[:, :, 10].T))
+    assert isclose(noise.corrcoeff[0, 0], 1)
+
+def test_gen_noise():
+    """Testing function for `qetpy.gen_noise`: reproducible with
+    a seed (independently of chunk size), and CSD of generated noise
+    should match input CSD."""
+
+    fs = 625e3
+    rng = np.random.default_rng(0)
+    traces = rng.normal(size=(500, 2, 128))
+    traces[:, 1] += traces[:, 0]
+    _, csd_in = calc_csd(traces, fs=fs)
+
+    noise = gen_noise(csd_in, fs=fs, n_traces=2000, rng=1)
+    assert noise.shape == (2000, 2, 128)
+    assert isclose(gen_noise(csd_in, fs=fs, n_traces=20, rng=1,
+                             chunk_size=7), noise[:20])
+
+    _, csd_out = calc_csd(noise, fs=fs)
+    ratio = np.real(csd_out[:, :, 1:64]) / np.real(csd_in[:, :, 1:64])
+    assert isclose(np.mean(ratio), 1, rtol=0.05)
+
+def test_gen_noise_batches():
+    """Testing function for `qetpy.gen_noise_batches`."""
+
+    fs = 625e3
+    _, psd = calc_psd(np.random.randn(100, 256), fs=fs)
+    template = np.exp(-np.arange(256)/20) - np.exp(-np.arange(256)/2)
+    amplitudes = np.arange(1, 11)
+
+    batches = list(gen_noise_batches(psd, fs=fs, n_traces=10, batch_size=4,
+                                     seed=2))
+    assert [len(batch) for batch in batches] == [4, 4, 2]
+
+    # reproducible
+    batches_repeat = gen_noise_batches(psd, fs=fs, batch_size=4, seed=2)
+    assert isclose(next(batches_repeat), batches[0])
+
+    # injected templates (shift = 3 samples)
+    batches_pulses = list(gen_noise_batches(psd, fs=fs, batch_size=4, seed=2,
+                                            templates=template,
+                                            amplitudes=amplitudes,
+                                            t0s=3/fs))
+    pulses = np.concatenate(batches_pulses) - np.concatenate(batches)
+    expected = amplitudes[:, np.newaxis] * np.roll(template, 3)
+    assert isclose(pulses[:, 0], expected, atol=1e-10)
+
 def test_removeoutliers():
     traces = np.random.randn(100, 32000)
     offsets = traces.mean(axis=1)
@@ -264,3 +397,46 @@ def test_resample():
     assert all(res[ii] == expected_res[ii] for ii in range(2))
 
 
+
+
+def test_fft_config():
+    """Testing function for `qetpy.utils.fft_config`."""
+
+    config = get_fft_config()
+    vals = np.random.rand(4, 1000)
+    vals_fft = fft(vals)
+
+    with fft_config(module='numpy', workers=2):
+        assert get_fft_config() == {'module': 'numpy', 'workers': 2}
+        assert isclose(fft(vals), vals_fft)
+        assert isclose(np.real(ifft(vals_fft)), vals)
+
+    assert get_fft_config() == config
+
+    with pytest.raises(ValueError):
+        with fft_config(module='fftpack'):
+            pass
+
+    assert get_fft_config() == config
+
+
+def test_invert_csd():
+    """Testing function for `qetpy.utils.invert_csd`."""
+
+    rng = np.random.default_rng(0)
+
+    # odd and even number of frequencies
+    for nbins in [100, 101]:
+        traces_fft = np.fft.fft(rng.normal(size=(3, 20, nbins)))
+        csd = np.einsum('ief,jef->ijf', traces_fft, traces_fft.conjugate())
+        expected = np.stack(
+            [np.linalg.pinv(csd[:, :, ii]) for ii in range(nbins)],
+            axis=-1,
+        )
+
+        for method in ['pinv', 'inv', 'cholesky']:
+            assert isclose(invert_csd(csd, method=method), expected,
+                           rtol=1e-6, atol=1e-12)
+
+        assert isclose(invert_csd(csd, lgc_real_signals=False), expected,
+                       rtol=1e-6, atol=1e-12)